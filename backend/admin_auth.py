@@ -0,0 +1,34 @@
+"""
+Authorization for admin-only endpoints
+
+Admin calls send the ADMIN_TOKEN value in an X-Admin-Token header (or as
+"Authorization: Bearer <token>"). While ADMIN_TOKEN is unset every admin
+endpoint answers 404, so nothing is exposed by default.
+"""
+import hmac
+from typing import Mapping
+from fastapi import HTTPException, Request
+from config import ADMIN_TOKEN
+
+
+def _presented_token(headers: Mapping[str, str]) -> str:
+    token = headers.get("x-admin-token")
+    if token:
+        return token
+    scheme, _, credentials = (headers.get("authorization") or "").partition(" ")
+    return credentials.strip() if scheme.lower() == "bearer" else ""
+
+
+def is_admin(headers: Mapping[str, str]) -> bool:
+    """Whether the request headers carry the admin token"""
+    if not ADMIN_TOKEN:
+        return False
+    return hmac.compare_digest(_presented_token(headers).encode(), ADMIN_TOKEN.encode())
+
+
+async def require_admin(request: Request):
+    """FastAPI dependency for admin endpoints"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(request.headers):
+        raise HTTPException(status_code=403, detail="Admin token required")
@@ -5,12 +5,16 @@ API endpoints integrados para Air-Guardian con modelo avanzado
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict, Any
-import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import joblib
 import os
 import json
+import asyncio
+from metrics import observe_inference
+from forecast_cache import forecast_cache, hour_bucket
+from model_registry import VersionedModel
+from config import MODEL_MMAP
+from forest_arrays import load_or_export
 
 router = APIRouter(prefix="/api/advanced", tags=["Advanced Predictions"])
 
@@ -29,91 +33,182 @@ class AdvancedPredictionResponse(BaseModel):
 # Cargar modelo avanzado
 model_path = "model/advanced_aqi_model.pkl"
 config_path = "model/model_config.json"
+# Exportacion en arrays mapeados en memoria, compartida por todos los workers
+packed_path = "model/advanced_aqi_model.forest"
 
-if os.path.exists(model_path) and os.path.exists(config_path):
-    model_data = joblib.load(model_path)
+class AdvancedModel:
+    """Modelo multisalida guardado por sync_models_simple.py (diccionario de joblib)"""
+    
+    def __init__(self, model, scaler, feature_columns, output_columns):
+        self.model = model
+        self.scaler = scaler
+        self.feature_columns = list(feature_columns)
+        self.output_columns = list(output_columns)
+    
+    def predict_advanced(self, features_dict):
+        """Prediccion por contaminante; las caracteristicas ausentes valen 0.0"""
+        row = np.array([[float(features_dict.get(col, 0.0)) for col in self.feature_columns]])
+        predictions = self.model.predict(self.scaler.transform(row))
+        return {col: float(predictions[0][i]) for i, col in enumerate(self.output_columns)}
+
+def load_model_data(path=model_path):
+    import joblib
+    model_data = joblib.load(path)
+    columns = {key: model_data[key] for key in ('feature_columns', 'output_columns')}
+    return model_data['model'], model_data['scaler'], columns
+
+def load_advanced_model():
+    """(modelo, configuracion), o None si no hay modelo guardado"""
+    if not (os.path.exists(config_path) and (os.path.exists(model_path) or os.path.exists(packed_path))):
+        print("Modelo avanzado no encontrado")
+        return None
     with open(config_path, 'r') as f:
         model_config = json.load(f)
-    
-    advanced_predictor = model_data
+    if MODEL_MMAP:
+        model, scaler, meta = load_or_export(packed_path, model_path, load_model_data)
+        columns = {key: meta[key] for key in ('feature_columns', 'output_columns')}
+    else:
+        model, scaler, columns = load_model_data()
     print("Modelo avanzado cargado exitosamente")
-else:
-    advanced_predictor = None
-    print("Modelo avanzado no encontrado")
+    return AdvancedModel(model, scaler, **columns), model_config
 
-@router.post("/predict", response_model=AdvancedPredictionResponse)
-async def advanced_predict(request: AdvancedPredictionRequest):
-    """Prediccion avanzada con multiples escenarios"""
-    if advanced_predictor is None:
-        raise HTTPException(status_code=503, detail="Modelo avanzado no disponible")
+def load_advanced_version(version):
+    """(modelo, configuracion) de una version del registro"""
+    source = version.file("advanced_aqi_model.pkl")
+    load_source = lambda: load_model_data(source)
+    if MODEL_MMAP:
+        model, scaler, meta = load_or_export(version.file("advanced_aqi_model.forest"), source, load_source)
+        columns = {key: meta[key] for key in ('feature_columns', 'output_columns')}
+    else:
+        model, scaler, columns = load_source()
+    model_config = {**version.config, 'features': version.features, 'outputs': version.outputs,
+                    'metrics': version.metrics, 'version': version.version}
+    return AdvancedModel(model, scaler, **columns), model_config
+
+def validate_advanced(value, version):
+    """Rechaza versiones cuyo esquema no coincide con el manifiesto o que predicen valores no finitos"""
+    model, _ = value
+    if model.feature_columns != version.features:
+        raise ValueError("las caracteristicas del modelo no coinciden con el manifiesto")
+    if model.output_columns != version.outputs:
+        raise ValueError("las salidas del modelo no coinciden con el manifiesto")
+    prediction = model.predict_advanced({})
+    if set(prediction) != set(version.outputs) or not np.isfinite(list(prediction.values())).all():
+        raise ValueError("el modelo devolvio predicciones invalidas")
+
+# Se carga en segundo plano al arrancar y se reemplaza por las nuevas
+# versiones del registro; 503 hasta que este listo
+advanced_model = VersionedModel("advanced", load_advanced_version, validate_advanced, load_advanced_model)
+
+# Nombres de los contaminantes del modelo avanzado en el historial de estaciones
+HISTORY_FIELDS = {'pm25': 'PM2_5', 'pm10': 'PM10', 'no2': 'NO2', 'o3': 'O3', 'so2': 'SO2'}
+
+def compute_scenarios(request, advanced_predictor, model_config, history, now):
+    """
+    Predicciones horarias de cada escenario, a partir de la hora de now.
+
+    No incluye las marcas de tiempo: el resultado se guarda en cache y
+    stamp_times las agrega al responder.
+    """
+    # Realizar predicciones para multiples escenarios
+    scenarios = {
+        "tendencia_actual": 1.0,
+        "politica_verde": 0.7,
+        "crecimiento_urbano": 1.3,
+        "emergencia_climatica": 0.4,
+        "sin_cambios": 1.0
+    }
     
-    try:
-        # Realizar predicciones para multiples escenarios
-        scenarios = {
-            "tendencia_actual": 1.0,
-            "politica_verde": 0.7,
-            "crecimiento_urbano": 1.3,
-            "emergencia_climatica": 0.4,
-            "sin_cambios": 1.0
-        }
-        
-        predictions = {}
+    predictions = {}
+    
+    for scenario_name, factor in scenarios.items():
+        scenario_predictions = []
         
-        for scenario_name, factor in scenarios.items():
-            scenario_predictions = []
+        for hour in range(1, request.hours_ahead + 1):
+            future_time = now + timedelta(hours=hour)
             
-            for hour in range(1, request.hours_ahead + 1):
-                future_time = datetime.now() + timedelta(hours=hour)
-                
-                # Crear caracteristicas
-                features = {
-                    'hour_sin': np.sin(2 * np.pi * future_time.hour / 24),
-                    'hour_cos': np.cos(2 * np.pi * future_time.hour / 24),
-                    'month_sin': np.sin(2 * np.pi * future_time.month / 12),
-                    'month_cos': np.cos(2 * np.pi * future_time.month / 12),
-                    'is_weekend': 1 if future_time.weekday() >= 5 else 0,
-                    **request.current_data
-                }
+            # Crear caracteristicas
+            features = {
+                'hour_sin': np.sin(2 * np.pi * future_time.hour / 24),
+                'hour_cos': np.cos(2 * np.pi * future_time.hour / 24),
+                'month_sin': np.sin(2 * np.pi * future_time.month / 12),
+                'month_cos': np.cos(2 * np.pi * future_time.month / 12),
+                'is_weekend': 1 if future_time.weekday() >= 5 else 0,
+                **request.current_data
+            }
+            
+            # Agregar caracteristicas de lag
+            for col in model_config['outputs']:
+                current = request.current_data.get(col, 30)
+                for lag in (1, 3, 6, 24):
+                    features[f'{col}_lag_{lag}h'] = history.get(f'{col}_lag_{lag}h', current)
+            
+            # Agregar estadisticas moviles
+            current = request.current_data.get('PM2_5', 30)
+            features['PM2_5_rolling_mean_6h'] = history.get('PM2_5_rolling_mean_6h', current)
+            features['PM2_5_rolling_std_6h'] = history.get('PM2_5_rolling_std_6h', 5.0)
+            features['PM2_5_rolling_mean_24h'] = history.get('PM2_5_rolling_mean_24h', current)
+            
+            # Predecir
+            try:
+                with observe_inference("advanced", 1):
+                    pred = advanced_predictor.predict_advanced(features)
                 
-                # Agregar caracteristicas de lag
-                for col in model_config['outputs']:
-                    features[f'{col}_lag_1h'] = request.current_data.get(col, 30)
-                    features[f'{col}_lag_3h'] = request.current_data.get(col, 30)
-                    features[f'{col}_lag_6h'] = request.current_data.get(col, 30)
-                    features[f'{col}_lag_24h'] = request.current_data.get(col, 30)
+                # Aplicar factor de escenario
+                adjusted_pred = {}
+                for pollutant, value in pred.items():
+                    adjusted_pred[pollutant] = max(0, value * factor)
                 
-                # Agregar estadisticas moviles
-                features['PM2_5_rolling_mean_6h'] = request.current_data.get('PM2_5', 30)
-                features['PM2_5_rolling_std_6h'] = 5.0
-                features['PM2_5_rolling_mean_24h'] = request.current_data.get('PM2_5', 30)
+                scenario_predictions.append({
+                    'hour': hour,
+                    'predictions': adjusted_pred,
+                    'confidence': max(0.5, 1.0 - (hour / request.hours_ahead) * 0.5)
+                })
                 
-                # Predecir
-                try:
-                    pred = advanced_predictor.predict_advanced(features)
-                    
-                    # Aplicar factor de escenario
-                    adjusted_pred = {}
-                    for pollutant, value in pred.items():
-                        adjusted_pred[pollutant] = max(0, value * factor)
-                    
-                    scenario_predictions.append({
-                        'timestamp': future_time.isoformat(),
-                        'hour': hour,
-                        'predictions': adjusted_pred,
-                        'confidence': max(0.5, 1.0 - (hour / request.hours_ahead) * 0.5)
-                    })
-                    
-                except Exception as e:
-                    print(f"Error en prediccion: {e}")
-                    continue
-            
-            predictions[scenario_name] = scenario_predictions
+            except Exception as e:
+                print(f"Error en prediccion: {e}")
+                continue
+        
+        predictions[scenario_name] = scenario_predictions
+    
+    return predictions
+
+def stamp_times(predictions, now):
+    """Copia de las predicciones con la marca de tiempo de cada hora, relativa a now"""
+    return {
+        scenario_name: [
+            {'timestamp': (now + timedelta(hours=entry['hour'])).isoformat(), **entry}
+            for entry in scenario_predictions
+        ]
+        for scenario_name, scenario_predictions in predictions.items()
+    }
+
+@router.post("/predict", response_model=AdvancedPredictionResponse)
+async def advanced_predict(request: AdvancedPredictionRequest):
+    """Prediccion avanzada con multiples escenarios"""
+    from main import feature_state
+    advanced_predictor, model_config = advanced_model.get()
+    model_version = advanced_model.version
+    
+    try:
+        # Lags y estadisticas moviles reales de la estacion, si tiene historial;
+        # si no, se usan los valores actuales
+        history = feature_state.features(request.station_id, HISTORY_FIELDS)
+        
+        # Misma estacion, hora, horizonte, version del modelo y datos de entrada: mismo pronostico.
+        # La cache guarda solo las salidas del modelo, calculadas con las caracteristicas de la
+        # hora de now; las marcas de tiempo se calculan en cada respuesta
+        now = datetime.now()
+        key = ("advanced", request.station_id, hour_bucket(now), request.hours_ahead,
+               model_version, tuple(sorted(request.current_data.items())))
+        predictions = await forecast_cache.get(key, lambda: asyncio.to_thread(
+            compute_scenarios, request, advanced_predictor, model_config, history, now))
         
         return AdvancedPredictionResponse(
             station_id=request.station_id,
-            predictions=predictions,
+            predictions=stamp_times(predictions, now),
             model_info=model_config,
-            generated_at=datetime.now().isoformat()
+            generated_at=now.isoformat()
         )
         
     except Exception as e:
@@ -155,7 +250,5 @@ async def get_available_scenarios():
 @router.get("/model-info")
 async def get_model_info():
     """Obtiene informacion del modelo avanzado"""
-    if advanced_predictor is None:
-        raise HTTPException(status_code=503, detail="Modelo avanzado no disponible")
-    
+    _, model_config = advanced_model.get()
     return model_config
@@ -0,0 +1,118 @@
+"""
+Vectorized multi-pollutant US EPA AQI engine
+
+Sub-indices are computed for whole arrays at once with np.searchsorted
+over per-pollutant breakpoint tables. The overall AQI is the maximum
+sub-index, and the dominant pollutant is the one that produced it.
+
+Breakpoints follow the EPA tables. Index ranges are contiguous (0-50,
+50-100, ...) as in the original calculate_aqi_pm25, so PM2.5 results are
+unchanged. Concentrations above the last breakpoint extrapolate the top
+segment. Negative or NaN concentrations count as missing.
+"""
+from typing import Dict, Mapping, Optional, Tuple
+import numpy as np
+
+# Index range of each segment, shared by all pollutants
+_I_LO = np.array([0.0, 50.0, 100.0, 150.0, 200.0, 300.0])
+_I_HI = np.array([50.0, 100.0, 150.0, 200.0, 300.0, 500.0])
+
+# (C_lo, C_hi) per segment, in each pollutant's native unit
+BREAKPOINTS: Dict[str, Tuple[Tuple[float, float], ...]] = {
+    # µg/m³, 24-hour
+    "pm25": ((0.0, 12.0), (12.1, 35.4), (35.5, 55.4), (55.5, 150.4), (150.5, 250.4), (250.5, 500.4)),
+    # µg/m³, 24-hour
+    "pm10": ((0.0, 54.0), (55.0, 154.0), (155.0, 254.0), (255.0, 354.0), (355.0, 424.0), (425.0, 604.0)),
+    # ppb, 8-hour up to 200 ppb, then the 1-hour table's upper bound
+    "o3": ((0.0, 54.0), (55.0, 70.0), (71.0, 85.0), (86.0, 105.0), (106.0, 200.0), (201.0, 604.0)),
+    # ppb, 1-hour
+    "no2": ((0.0, 53.0), (54.0, 100.0), (101.0, 360.0), (361.0, 649.0), (650.0, 1249.0), (1250.0, 2049.0)),
+    # ppb, 1-hour
+    "so2": ((0.0, 35.0), (36.0, 75.0), (76.0, 185.0), (186.0, 304.0), (305.0, 604.0), (605.0, 1004.0)),
+    # ppm, 8-hour
+    "co": ((0.0, 4.4), (4.5, 9.4), (9.5, 12.4), (12.5, 15.4), (15.5, 30.4), (30.5, 50.4)),
+}
+
+NATIVE_UNITS = {"pm25": "µg/m³", "pm10": "µg/m³", "o3": "ppb", "no2": "ppb", "so2": "ppb", "co": "ppm"}
+
+POLLUTANTS = tuple(BREAKPOINTS)
+
+# Molecular weights (g/mol) for µg/m³ <-> ppb at 25 °C and 1 atm
+_MOLECULAR_WEIGHT = {"o3": 48.00, "no2": 46.01, "so2": 64.07, "co": 28.01}
+_MOLAR_VOLUME = 24.45
+
+_TABLES = {
+    name: (np.array([b[0] for b in bps]), np.array([b[1] for b in bps]))
+    for name, bps in BREAKPOINTS.items()
+}
+
+
+def _normalize_unit(unit: str) -> str:
+    unit = unit.strip().lower().replace("μ", "u").replace("µ", "u").replace("³", "3")
+    return {"ug/m3": "ug/m3", "ugm3": "ug/m3", "ppb": "ppb", "ppm": "ppm"}.get(unit, unit)
+
+
+def convert(pollutant: str, values, unit: Optional[str]) -> np.ndarray:
+    """Convert concentrations in unit to the pollutant's native AQI unit"""
+    values = np.asarray(values, dtype=float)
+    if unit is None:
+        return values
+    unit = _normalize_unit(unit)
+    native = _normalize_unit(NATIVE_UNITS[pollutant])
+    if unit == native:
+        return values
+    if pollutant in ("pm25", "pm10"):
+        raise ValueError(f"Unsupported unit {unit!r} for {pollutant}")
+
+    # Express as ppb first, then as the native unit
+    if unit == "ppb":
+        ppb = values
+    elif unit == "ppm":
+        ppb = values * 1000.0
+    elif unit == "ug/m3":
+        ppb = values * _MOLAR_VOLUME / _MOLECULAR_WEIGHT[pollutant]
+    else:
+        raise ValueError(f"Unsupported unit {unit!r} for {pollutant}")
+    return ppb / 1000.0 if native == "ppm" else ppb
+
+
+def sub_index(pollutant: str, concentrations) -> np.ndarray:
+    """AQI sub-index for an array of concentrations in the native unit (NaN if missing)"""
+    c_lo, c_hi = _TABLES[pollutant]
+    c = np.asarray(concentrations, dtype=float)
+    c = np.where(c >= 0, c, np.nan)
+    idx = np.minimum(np.searchsorted(c_hi[:-1], c, side="left"), len(c_hi) - 1)
+    slope = (_I_HI[idx] - _I_LO[idx]) / (c_hi[idx] - c_lo[idx])
+    return _I_LO[idx] + slope * (c - c_lo[idx])
+
+
+def compute_aqi(concentrations: Mapping[str, object],
+                units: Optional[Mapping[str, str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Overall AQI and dominant pollutant for aligned concentration arrays.
+
+    concentrations maps pollutant name to an array (or scalar). Names
+    without a breakpoint table are ignored. units optionally maps
+    pollutant to the unit of its values; native units are assumed
+    otherwise. Returns (aqi, dominant): aqi is a float array with NaN
+    where no pollutant is available, and dominant holds pollutant names,
+    or None where aqi is NaN.
+    """
+    names = [name for name in concentrations if name in BREAKPOINTS]
+    if not names:
+        shape = np.shape(next(iter(concentrations.values()), np.nan)) if concentrations else ()
+        return np.full(shape, np.nan), np.full(shape, None, dtype=object)
+
+    units = units or {}
+    stacked = np.stack(np.broadcast_arrays(*[
+        sub_index(name, convert(name, concentrations[name], units.get(name)))
+        for name in names
+    ]))
+    missing = np.isnan(stacked)
+    best = np.argmax(np.where(missing, -np.inf, stacked), axis=0)
+    aqi = np.take_along_axis(stacked, best[np.newaxis], axis=0)[0]
+    all_missing = missing.all(axis=0)
+    dominant = np.asarray(names, dtype=object)[best]
+    dominant = np.where(all_missing, None, dominant)
+    return aqi, dominant
+
@@ -0,0 +1,451 @@
+"""
+End-to-end HTTP load test for the Air Guardian backend
+
+Starts main:app under uvicorn with the upstream stand-in (UPSTREAM_MODE=replay,
+see upstream_stub.py), drives each endpoint scenario with a fixed number of
+concurrent clients for a fixed time, and reports throughput, latency
+percentiles and server RSS per scenario. Responses with a Server-Timing
+serialize entry (FAST_SERIALIZATION=true) also report serialization time.
+
+Results are written as JSON so a later run can be compared against them:
+
+    python benchmark.py --save benchmarks/baseline.json
+    python benchmark.py --compare benchmarks/baseline.json
+
+Use --url to benchmark a server that is already running instead.
+
+The advanced model is not in the repository, so before starting the server
+a synthetic one (same features, outputs and forest size as
+air_quality_training/sync_models_simple.py) is trained once and published
+to a benchmark-only model registry (benchmarks/registry/). Scenarios that
+return errors are reported but never saved or compared: their numbers
+would measure error handling, not the endpoint.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_REGISTRY_DIR = os.path.join(BACKEND_DIR, "benchmarks", "registry")
+ADVANCED_CONFIG_PATH = os.path.join(BACKEND_DIR, "model", "model_config.json")
+
+# Request factory: (rng, context) -> (method, path, params, json body)
+RequestSpec = Tuple[str, str, Optional[dict], Optional[dict]]
+
+
+def _station(rng: random.Random, ctx: dict) -> str:
+    return rng.choice(ctx["station_ids"])
+
+
+SCENARIOS: Dict[str, Callable[[random.Random, dict], RequestSpec]] = {
+    "stations": lambda rng, ctx: ("GET", "/api/stations", None, None),
+    "stations_nearby": lambda rng, ctx: (
+        "GET", "/api/stations",
+        {"lat": round(-12.05 + rng.uniform(-0.2, 0.2), 3), "lon": round(-77.04 + rng.uniform(-0.2, 0.2), 3),
+         "radius": 25},
+        None,
+    ),
+    "stations_by_country": lambda rng, ctx: (
+        "GET", f"/api/stations/by-country/{rng.choice(['US', 'MX', 'GB', 'DE', 'FR'])}", None, None),
+    "predict": lambda rng, ctx: ("GET", f"/api/predict/{_station(rng, ctx)}", {"hours": 48}, None),
+    "predict_batch": lambda rng, ctx: (
+        "POST", "/api/predict/batch", None,
+        {"station_ids": rng.sample(ctx["station_ids"], min(20, len(ctx["station_ids"]))), "hours": 48},
+    ),
+    "advanced_predict": lambda rng, ctx: (
+        "POST", "/api/advanced/predict", None,
+        {"station_id": _station(rng, ctx),
+         "current_data": {"pm25": rng.uniform(5, 80), "pm10": rng.uniform(10, 120),
+                          "no2": rng.uniform(5, 60), "o3": rng.uniform(10, 90)},
+         "hours_ahead": 48, "scenario": "tendencia_actual"},
+    ),
+    "tempo_grid": lambda rng, ctx: (
+        "GET", "/api/tempo/grid",
+        {"parameter": rng.choice(["no2", "o3"]), "lat_min": 20, "lat_max": 50, "lon_min": -125, "lon_max": -65},
+        None,
+    ),
+    "prediction_layer_heatmap": lambda rng, ctx: (
+        "GET", f"/api/prediction-layer/heatmap/{rng.choice(['pm25', 'pm10', 'no2', 'o3'])}",
+        {"lat": -12.0464, "lon": -77.0428}, None),
+    "prediction_charts": lambda rng, ctx: (
+        "GET", f"/api/prediction-charts/{rng.choice(['2178', '2179', '2180'])}/"
+               f"{rng.choice(['impact', 'timeline', 'comparison'])}", None, None),
+    "prediction_charts_stations": lambda rng, ctx: (
+        "GET", "/api/prediction-charts/available-stations", None, None),
+}
+
+# Weighted mix approximating the frontend's traffic
+MIX = {
+    "stations": 30,
+    "stations_nearby": 10,
+    "predict": 25,
+    "advanced_predict": 5,
+    "tempo_grid": 10,
+    "prediction_layer_heatmap": 15,
+    "prediction_charts": 5,
+}
+
+
+def rss_mb(pid: Optional[int]) -> Optional[float]:
+    """Resident set size of a process in MB (None when it cannot be read)"""
+    if pid is None:
+        return None
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 2**20
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def serialize_ms(response: httpx.Response) -> Optional[float]:
+    """Duration of the "serialize" metric in a Server-Timing header, if present"""
+    for metric in response.headers.get("server-timing", "").split(","):
+        name, _, params = metric.strip().partition(";")
+        if name == "serialize":
+            for param in params.split(";"):
+                key, _, value = param.strip().partition("=")
+                if key == "dur":
+                    try:
+                        return float(value)
+                    except ValueError:
+                        return None
+    return None
+
+
+def summarize(latencies: List[float], statuses: Dict[int, int], elapsed: float,
+              rss_samples: List[float], serialize_samples: Optional[List[float]] = None) -> Dict[str, Any]:
+    lat = np.asarray(latencies) * 1000.0
+    total = sum(statuses.values())
+    errors = sum(count for status, count in statuses.items() if not 200 <= status < 400)
+    stats = {
+        "requests": total,
+        "errors": errors,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+    }
+    if len(lat):
+        p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+        stats.update({
+            "mean_ms": round(float(lat.mean()), 2),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "max_ms": round(float(lat.max()), 2),
+        })
+    if serialize_samples:
+        serialize = np.asarray(serialize_samples)
+        stats["serialize_mean_ms"] = round(float(serialize.mean()), 3)
+        stats["serialize_p95_ms"] = round(float(np.percentile(serialize, 95)), 3)
+    if rss_samples:
+        stats["rss_mb"] = round(rss_samples[-1], 1)
+        stats["rss_peak_mb"] = round(max(rss_samples), 1)
+    return stats
+
+
+async def run_scenario(client: httpx.AsyncClient, choose: Callable[[random.Random], str], ctx: dict,
+                       concurrency: int, duration: float, seed: int, pid: Optional[int]) -> Dict[str, Any]:
+    """Drive requests from concurrency workers for duration seconds"""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    rss_samples: List[float] = []
+    serialize_samples: List[float] = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(n: int):
+        rng = random.Random(seed * 1000 + n)
+        while time.perf_counter() < deadline:
+            method, path, params, body = SCENARIOS[choose(rng)](rng, ctx)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, json=body)
+                await response.aread()
+                status = response.status_code
+                serialize = serialize_ms(response)
+                if serialize is not None:
+                    serialize_samples.append(serialize)
+            except httpx.HTTPError:
+                status = 599
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async def sample_rss():
+        while time.perf_counter() < deadline:
+            value = rss_mb(pid)
+            if value is not None:
+                rss_samples.append(value)
+            await asyncio.sleep(0.25)
+
+    started = time.perf_counter()
+    await asyncio.gather(sample_rss(), *(worker(n) for n in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started, rss_samples, serialize_samples)
+
+
+def train_advanced_model(path: str, seed: int, n_samples: int = 5000) -> Dict[str, Any]:
+    """Train a synthetic advanced model like sync_models_simple.py and save it as its joblib dict"""
+    import joblib
+    import pandas as pd
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.multioutput import MultiOutputRegressor
+    from sklearn.preprocessing import StandardScaler
+
+    with open(ADVANCED_CONFIG_PATH) as f:
+        config = json.load(f)
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(end=datetime(2025, 10, 5), periods=n_samples, freq="h")
+    df = pd.DataFrame({
+        "PM2_5": rng.gamma(2, 15, n_samples) + 10,
+        "PM10": rng.gamma(2, 20, n_samples) + 15,
+        "NO2": rng.gamma(2, 10, n_samples) + 5,
+        "O3": rng.gamma(2, 15, n_samples) + 10,
+        "SO2": rng.gamma(2, 5, n_samples) + 2,
+        "temperature": rng.normal(20, 8, n_samples),
+        "humidity": rng.uniform(30, 90, n_samples),
+        "wind_speed": rng.gamma(2, 3, n_samples),
+        "pressure": rng.normal(1013, 10, n_samples),
+        "pm25_satellite": rng.uniform(10, 40, n_samples),
+        "hour": timestamps.hour,
+        "day_of_week": timestamps.dayofweek,
+        "month": timestamps.month,
+    })
+    df["is_weekend"] = (df["day_of_week"] >= 5).astype(int)
+    df["hour_sin"] = np.sin(2 * np.pi * df["hour"] / 24)
+    df["hour_cos"] = np.cos(2 * np.pi * df["hour"] / 24)
+    df["month_sin"] = np.sin(2 * np.pi * df["month"] / 12)
+    df["month_cos"] = np.cos(2 * np.pi * df["month"] / 12)
+    for col in config["outputs"]:
+        for lag in (1, 3, 6, 24):
+            df[f"{col}_lag_{lag}h"] = df[col].shift(lag)
+    df["PM2_5_rolling_mean_6h"] = df["PM2_5"].rolling(window=6, min_periods=1).mean()
+    df["PM2_5_rolling_std_6h"] = df["PM2_5"].rolling(window=6, min_periods=1).std()
+    df["PM2_5_rolling_mean_24h"] = df["PM2_5"].rolling(window=24, min_periods=1).mean()
+    df = df.dropna()
+
+    scaler = StandardScaler()
+    X = scaler.fit_transform(df[config["features"]].to_numpy())
+    model = MultiOutputRegressor(RandomForestRegressor(
+        n_estimators=100, max_depth=15, min_samples_split=5, min_samples_leaf=2, random_state=seed, n_jobs=-1))
+    model.fit(X, df[config["outputs"]].to_numpy())
+    joblib.dump({"model": model, "scaler": scaler, "feature_columns": config["features"],
+                 "output_columns": config["outputs"], "trained_at": datetime.utcnow().isoformat()}, path)
+    return config
+
+
+def ensure_advanced_model(registry_dir: str, seed: int):
+    """Publish a synthetic advanced model to registry_dir unless it already has a version"""
+    sys.path.insert(0, BACKEND_DIR)
+    from model_registry import ModelRegistry
+
+    registry = ModelRegistry(registry_dir)
+    if registry.latest("advanced") is not None:
+        return
+    print("Training a synthetic advanced model for the benchmark (once)...")
+    os.makedirs(registry_dir, exist_ok=True)
+    path = os.path.join(registry_dir, f".advanced-{os.getpid()}.pkl")
+    try:
+        config = train_advanced_model(path, seed)
+        registry.publish("advanced", {"advanced_aqi_model.pkl": path}, config["features"], config["outputs"],
+                         config={**config, "synthetic": True})
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def start_server(port: int, env_overrides: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("UPSTREAM_MODE", "replay")
+    env.setdefault("MOCK_SEED", "42")
+    env.update(env_overrides)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+def models_settled(health: Dict[str, Any]) -> bool:
+    """No model is still pending or loading, so model endpoints are measured warm"""
+    return all(model.get("state") not in ("pending", "loading") for model in health.get("models", {}).values())
+
+
+async def wait_ready(base_url: str, timeout: float = 120.0):
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get("/health/ready")
+                if response.status_code == 200 and models_settled(response.json()):
+                    return
+            except (httpx.HTTPError, ValueError):
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"Server at {base_url} did not become ready within {timeout:.0f}s")
+
+
+async def run_benchmark(base_url: str, scenarios: List[str], concurrency: int, duration: float,
+                        warmup: float, seed: int, pid: Optional[int]) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits) as client:
+        stations = (await client.get("/api/stations")).json()
+        ctx = {"station_ids": [s["station_id"] for s in stations] or ["station_1"]}
+
+        results = {"rss_idle_mb": rss_mb(pid), "endpoints": {}}
+        for name in scenarios:
+            if name == "mix":
+                names, weights = zip(*MIX.items())
+                choose = lambda rng: rng.choices(names, weights)[0]
+            else:
+                choose = lambda rng, name=name: name
+            if warmup:
+                await run_scenario(client, choose, ctx, concurrency, warmup, seed, None)
+            stats = await run_scenario(client, choose, ctx, concurrency, duration, seed, pid)
+            results["endpoints"][name] = stats
+            print(format_row(name, stats))
+        return results
+
+
+def format_row(name: str, stats: Dict[str, Any]) -> str:
+    return (f"{name:28s} {stats['requests']:7d} req {stats['errors']:5d} err "
+            f"{stats['throughput_rps']:9.1f} rps  p50 {stats.get('p50_ms', 0):8.1f}  "
+            f"p95 {stats.get('p95_ms', 0):8.1f}  p99 {stats.get('p99_ms', 0):8.1f} ms  "
+            f"rss {stats.get('rss_peak_mb', 0) or 0:7.1f} MB"
+            + (f"  ser {stats['serialize_mean_ms']:.2f} ms" if "serialize_mean_ms" in stats else ""))
+
+
+def failed_scenarios(results: Dict[str, Any]) -> List[str]:
+    """Scenarios with any error response"""
+    return [name for name, stats in results.get("endpoints", {}).items() if stats.get("errors")]
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> bool:
+    """
+    Print per-endpoint deltas; False if any p95 or throughput regressed
+    beyond max_regression, or a scenario had errors in either run.
+    """
+    ok = True
+    print(f"\nComparison against baseline from {baseline.get('meta', {}).get('timestamp', '?')}")
+    for name, stats in current["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base:
+            print(f"{name:28s} (no baseline)")
+            continue
+        if stats.get("errors") or base.get("errors"):
+            # Latencies of error responses say nothing about the endpoint
+            print(f"{name:28s} not compared: {stats.get('errors', 0)} errors now, "
+                  f"{base.get('errors', 0)} in the baseline")
+            ok = False
+            continue
+        deltas = []
+        for key, higher_is_worse in (("p50_ms", True), ("p95_ms", True), ("p99_ms", True),
+                                     ("throughput_rps", False), ("rss_peak_mb", True)):
+            if not base.get(key) or stats.get(key) is None:
+                continue
+            change = (stats[key] - base[key]) / base[key]
+            deltas.append(f"{key} {change:+.1%}")
+            regressed = change > max_regression if higher_is_worse else change < -max_regression
+            if regressed and key in ("p95_ms", "throughput_rps"):
+                ok = False
+                deltas[-1] += " REGRESSION"
+        print(f"{name:28s} " + ", ".join(deltas))
+    return ok
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the Air Guardian API against stubbed upstreams")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--scenarios", default=",".join(list(SCENARIOS) + ["mix"]),
+                        help="Comma-separated scenario names (default: all, plus mix)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Simulated upstream latency")
+    parser.add_argument("--save", help="Write results JSON to this path")
+    parser.add_argument("--compare", help="Compare against a saved results JSON")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail --compare when p95 or throughput regress by more than this fraction")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS and s != "mix"]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    server = None
+    pid = None
+    base_url = args.url
+    if base_url is None:
+        base_url = f"http://127.0.0.1:{args.port}"
+        ensure_advanced_model(BENCHMARK_REGISTRY_DIR, args.seed)
+        server = start_server(args.port, {"UPSTREAM_STUB_LATENCY_MS": str(args.latency_ms),
+                                          "UPSTREAM_STUB_SEED": str(args.seed),
+                                          "MODEL_REGISTRY_DIR": BENCHMARK_REGISTRY_DIR})
+        pid = server.pid
+
+    try:
+        asyncio.run(wait_ready(base_url))
+        results = asyncio.run(run_benchmark(base_url, scenarios, args.concurrency, args.duration,
+                                            args.warmup, args.seed, pid))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    results["meta"] = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "url": args.url or "local",
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "upstream_latency_ms": None if args.url else args.latency_ms,
+        "seed": args.seed,
+        "fast_serialization": os.getenv("FAST_SERIALIZATION", "false"),
+        "python": sys.version.split()[0],
+    }
+
+    failed = failed_scenarios(results)
+    if failed and args.save:
+        print(f"\nNot saving {args.save}: {', '.join(failed)} returned errors")
+        sys.exit(1)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,3 +11,99 @@ CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost
 
 # OpenWeather API Configuration
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "your_openweather_api_key_here")
+
+# Upstream base URLs
+OPENAQ_BASE_URL = os.getenv("OPENAQ_BASE_URL", "https://api.openaq.org")
+OPENWEATHER_BASE_URL = os.getenv("OPENWEATHER_BASE_URL", "https://api.openweathermap.org")
+
+# Upstream HTTP client pool
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+OPENAQ_TIMEOUT = float(os.getenv("OPENAQ_TIMEOUT", "30"))
+OPENAQ_FALLBACK_TIMEOUT = float(os.getenv("OPENAQ_FALLBACK_TIMEOUT", "15"))
+OPENWEATHER_TIMEOUT = float(os.getenv("OPENWEATHER_TIMEOUT", "10"))
+UPSTREAM_MAX_CONNECTIONS_PER_HOST = int(os.getenv("UPSTREAM_MAX_CONNECTIONS_PER_HOST", "20"))
+UPSTREAM_MAX_KEEPALIVE_PER_HOST = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_PER_HOST", "10"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Station snapshot cache
+STATION_CACHE_TTL = float(os.getenv("STATION_CACHE_TTL", "300"))
+STATION_CACHE_MAX_ENTRIES = int(os.getenv("STATION_CACHE_MAX_ENTRIES", "256"))
+STATION_CACHE_ERROR_BACKOFF = float(os.getenv("STATION_CACHE_ERROR_BACKOFF", "30"))
+
+# OpenAQ multi-country fallback (fetched concurrently under one deadline)
+OPENAQ_FALLBACK_COUNTRIES = [c.strip() for c in os.getenv("OPENAQ_FALLBACK_COUNTRIES", "US,MX,CA,GB,DE,FR,IT,ES,AU,JP").split(",") if c.strip()]
+OPENAQ_FALLBACK_DEADLINE = float(os.getenv("OPENAQ_FALLBACK_DEADLINE", "8"))
+OPENAQ_FALLBACK_PER_COUNTRY = int(os.getenv("OPENAQ_FALLBACK_PER_COUNTRY", "20"))
+OPENAQ_FALLBACK_MAX_STATIONS = int(os.getenv("OPENAQ_FALLBACK_MAX_STATIONS", "30"))
+
+# Weather cache (OpenWeather current conditions update roughly every 10 minutes)
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_CACHE_MAX_ENTRIES = int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "4096"))
+WEATHER_GRID_DEG = float(os.getenv("WEATHER_GRID_DEG", "0.1"))
+WEATHER_BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "8"))
+
+# Upstream stand-in (live | replay | record), see upstream_stub.py
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live").lower()
+UPSTREAM_FIXTURES_DIR = os.getenv("UPSTREAM_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+UPSTREAM_STUB_LATENCY_MS = float(os.getenv("UPSTREAM_STUB_LATENCY_MS", "0"))
+UPSTREAM_STUB_JITTER_MS = float(os.getenv("UPSTREAM_STUB_JITTER_MS", "0"))
+UPSTREAM_STUB_ERROR_RATE = float(os.getenv("UPSTREAM_STUB_ERROR_RATE", "0"))
+UPSTREAM_STUB_RESULTS = int(os.getenv("UPSTREAM_STUB_RESULTS", "0"))
+UPSTREAM_STUB_SEED = int(os.getenv("UPSTREAM_STUB_SEED", "42"))
+
+# Seed for mock stations/weather/history (unset keeps them random per call)
+MOCK_SEED = int(os.environ["MOCK_SEED"]) if os.getenv("MOCK_SEED") else (UPSTREAM_STUB_SEED if UPSTREAM_MODE == "replay" else None)
+
+# Station history store (hourly, see timeseries_store.py); opt-in, since it polls upstream and writes to disk
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "false").lower() in ("1", "true", "yes")
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "history.sqlite"))
+HISTORY_POLL_INTERVAL = float(os.getenv("HISTORY_POLL_INTERVAL", "900"))
+
+# Batch forecasts
+PREDICT_BATCH_MAX_STATIONS = int(os.getenv("PREDICT_BATCH_MAX_STATIONS", "500"))
+
+# Live station feed (/ws/stations and /api/stations/stream)
+STATION_FEED_REFRESH_INTERVAL = float(os.getenv("STATION_FEED_REFRESH_INTERVAL", "60"))
+STATION_FEED_MAX_PENDING = int(os.getenv("STATION_FEED_MAX_PENDING", "16"))
+STATION_FEED_KEEPALIVE = float(os.getenv("STATION_FEED_KEEPALIVE", "15"))
+
+# Cached JSON responses (ETag + pre-compressed bodies, see response_cache.py)
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+TEMPO_GRID_TTL = float(os.getenv("TEMPO_GRID_TTL", "3600"))
+HEATMAP_TTL = float(os.getenv("HEATMAP_TTL", "300"))
+STATIONS_BY_COUNTRY_TTL = float(os.getenv("STATIONS_BY_COUNTRY_TTL", "300"))
+
+# Fast response path: build plain dicts instead of validated models and serialize with orjson
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "false").lower() in ("1", "true", "yes")
+
+# Prometheus metrics (/metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+# Admin endpoints (X-Admin-Token header); disabled while unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Sampling profiler: profile requests slower than PROFILE_SLOW_REQUEST_MS (0 = off),
+# or admin requests with ?profile=1
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_BUFFER_SECONDS = float(os.getenv("PROFILE_BUFFER_SECONDS", "60"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+
+# Readiness (/health/ready): also wait for the AQI model to be warm
+HEALTH_READY_REQUIRES_MODELS = os.getenv("HEALTH_READY_REQUIRES_MODELS", "false").lower() in ("1", "true", "yes")
+
+# Serve forests from memory-mapped array exports (shared by all workers, see forest_arrays.py)
+MODEL_MMAP = os.getenv("MODEL_MMAP", "true").lower() in ("1", "true", "yes")
+
+# Versioned model registry (see model_registry.py); new versions are picked up without a restart
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "registry"))
+MODEL_REGISTRY_POLL_INTERVAL = float(os.getenv("MODEL_REGISTRY_POLL_INTERVAL", "30"))
+
+# Forecast cache for /api/predict/{station_id} and /api/advanced/predict (see forecast_cache.py); TTL 0 = off
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", "900"))
+FORECAST_CACHE_MAX_BYTES = int(os.getenv("FORECAST_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
@@ -0,0 +1,81 @@
+"""
+Shape-preserving downsampling for long time series
+
+Both methods return sorted row indices into the original series, so every
+column of a multi-field record can be reduced with the same selection.
+The first and last points are always kept.
+
+- lttb: Largest-Triangle-Three-Buckets, which keeps the points that
+  contribute most to the visual shape of a line.
+- minmax: the minimum and maximum of each bucket, which keeps every
+  peak and trough.
+"""
+from typing import Optional
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """Indices of the n_out points chosen by Largest-Triangle-Three-Buckets"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    # Interior points split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = np.nanmean(y[next_start:next_end]) if np.isfinite(y[next_start:next_end]).any() else y[a]
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        area = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        area = np.where(np.isnan(area), -1.0, area)
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, n_out: int) -> np.ndarray:
+    """Indices of the minimum and maximum of each of n_out // 2 buckets, plus both ends"""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    n_buckets = max(1, (n_out - 2) // 2)
+    edges = np.linspace(1, n - 1, n_buckets + 1).astype(int)
+    filled = np.where(np.isnan(y), np.nanmean(y) if np.isfinite(y).any() else 0.0, y)
+    picks = [0, n - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            bucket = filled[start:end]
+            picks.append(start + int(np.argmin(bucket)))
+            picks.append(start + int(np.argmax(bucket)))
+    return np.unique(picks)
+
+
+def downsample_indices(x, y, max_points: Optional[int], method: str = "lttb") -> np.ndarray:
+    """Row indices to keep so that at most max_points remain (all rows if max_points is None)"""
+    n = len(y)
+    if max_points is None or max_points >= n:
+        return np.arange(n)
+    if method == "minmax":
+        return minmax_indices(y, max_points)
+    if method == "lttb":
+        return lttb_indices(x, y, max_points)
+    raise ValueError(f"Unknown downsampling method {method!r}, expected one of {METHODS}")
@@ -4,7 +4,9 @@ from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 import random
 import asyncio
+import time
 from typing import Dict, Any
+from metrics import record_upstream, record_upstream_error
 
 # --- CONFIGURACIÓN DEL CORREO ---
 # Usando credenciales alternativas o configuración más robusta
@@ -107,6 +109,8 @@ El equipo de AirGuardian
             ]
             
             for config in smtp_configs:
+                start = time.perf_counter()
+                sent = 0
                 try:
                     print(f"Intentando conectar a {config['host']}:{config['port']}")
                     
@@ -126,6 +130,7 @@ El equipo de AirGuardian
                     print("Enviando email...")
                     text_message = message.as_string()
                     server.sendmail(self.sender_email, user_data['email'], text_message)
+                    sent += len(text_message)
                     print(f"Correo enviado exitosamente a {user_data['email']}!")
                     
                     # Also send to default recipient for backup
@@ -135,25 +140,30 @@ El equipo de AirGuardian
                         message["Subject"] = f"Reporte de Calidad del Aire - {user_data['name']} en {user_data.get('city', 'ubicacion')}"
                         text_message = message.as_string()
                         server.sendmail(self.sender_email, self.default_recipient, text_message)
+                        sent += len(text_message)
                         print(f"Copia enviada a {self.default_recipient}!")
                     
                     server.quit()
+                    record_upstream("smtp", time.perf_counter() - start, sent=sent)
                     return True
                     
                 except smtplib.SMTPAuthenticationError as e:
                     print(f"Error de autenticacion con {config['host']}:{config['port']}: {e}")
+                    record_upstream_error("smtp", "auth")
                     if server:
                         server.quit()
                     continue
                     
                 except smtplib.SMTPException as e:
                     print(f"Error SMTP con {config['host']}:{config['port']}: {e}")
+                    record_upstream_error("smtp", "status")
                     if server:
                         server.quit()
                     continue
                     
                 except Exception as e:
                     print(f"Error inesperado con {config['host']}:{config['port']}: {e}")
+                    record_upstream_error("smtp", "connection")
                     if server:
                         server.quit()
                     continue
@@ -198,6 +208,7 @@ El equipo de AirGuardian
             message["Subject"] = "Reporte Programado de Calidad del Aire"
             message.attach(MIMEText(message_body, "plain", "utf-8"))
 
+            start = time.perf_counter()
             server_smtp = smtplib.SMTP("smtp.gmail.com", 587)
             server_smtp.starttls()
             server_smtp.login(self.sender_email, self.sender_password)
@@ -206,9 +217,11 @@ El equipo de AirGuardian
             server_smtp.sendmail(self.sender_email, self.default_recipient, text_message)
             print(f"Notificacion programada enviada exitosamente!")
             server_smtp.quit()
+            record_upstream("smtp", time.perf_counter() - start, sent=len(text_message))
 
         except Exception as e:
             print(f"Error al enviar notificacion programada: {e}")
+            record_upstream_error("smtp", "connection")
 
 # Global email service instance
 email_service = EmailService()
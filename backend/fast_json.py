@@ -0,0 +1,90 @@
+"""
+Opt-in fast JSON path for hot endpoints
+
+With FAST_SERIALIZATION enabled, hot endpoints build plain dicts shaped like
+their response models instead of model instances (skipping validation of
+data the backend produced itself) and return them already serialized with
+orjson, so FastAPI does not validate them a second time against
+response_model. The routes keep their response_model, so the OpenAPI
+schema is unchanged. Without orjson installed the standard json module is
+used.
+
+Fast responses carry a Server-Timing header with the serialization time.
+"""
+import importlib.util
+import json
+import time
+from typing import Any, Dict, Type, TypeVar, Union
+import numpy as np
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from config import FAST_SERIALIZATION
+
+ORJSON_AVAILABLE = importlib.util.find_spec("orjson") is not None
+if ORJSON_AVAILABLE:
+    import orjson
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+_defaults: Dict[type, Dict[str, Any]] = {}
+
+
+def _field_defaults(model_cls: Type[BaseModel]) -> Dict[str, Any]:
+    """Default for every field in declaration order (required fields map to None)"""
+    defaults = _defaults.get(model_cls)
+    if defaults is None:
+        defaults = {name: None if field.is_required() else field.get_default(call_default_factory=True)
+                    for name, field in model_cls.model_fields.items()}
+        _defaults[model_cls] = defaults
+    return defaults
+
+
+def make(model_cls: Type[Model], **fields: Any) -> Union[Model, Dict[str, Any]]:
+    """
+    A response model instance, or on the fast path a plain dict with the same fields.
+
+    Plain dicts skip both validation and object construction (in Pydantic v2
+    model_construct is slower than validating a small model), and serialize
+    directly with orjson.
+    """
+    if FAST_SERIALIZATION:
+        defaults = _field_defaults(model_cls)
+        if len(fields) == len(defaults):
+            return fields
+        # Fill omitted fields, keeping the model's field order
+        return {name: fields.get(name, default) for name, default in defaults.items()}
+    return model_cls(**fields)
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        # Field values only; nested models are handled recursively
+        return obj.__dict__
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize models, dicts, lists and NumPy values to UTF-8 JSON"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(payload), separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def respond(payload: Any, status_code: int = 200) -> Any:
+    """
+    Return value for a hot endpoint.
+
+    On the fast path this is a pre-serialized Response; otherwise the
+    payload itself, which FastAPI validates and serializes as usual.
+    """
+    if not FAST_SERIALIZATION:
+        return payload
+    start = time.perf_counter()
+    body = dumps(payload)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return Response(body, status_code=status_code, media_type="application/json",
+                    headers={"Server-Timing": f"serialize;dur={elapsed_ms:.3f}"})
@@ -0,0 +1,188 @@
+"""
+Incremental lag and rolling-window features per station
+
+The models are trained on features that create_features computes over a
+full hourly DataFrame: lags of 1/3/6/24 hours and rolling means and
+standard deviations over 6 and 24 hours. Serving keeps the same features
+up to date per station instead, one observation at a time:
+
+- each field of each station has a fixed-size ring buffer holding the
+  last HISTORY_HOURS + 1 hourly values (NaN for hours without a reading)
+- each rolling window keeps a running sum, sum of squares and count
+
+so an observation costs O(1) (at most one ring step per elapsed hour) and
+reading the features costs O(1), with no pandas involved. As in pandas'
+rolling(min_periods=1), missing hours are left out of the windows and the
+standard deviation uses ddof=1. A reading for an hour already seen
+replaces the earlier one; readings older than the latest hour are ignored.
+"""
+import math
+import threading
+from array import array
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+from timeseries_store import TimeSeriesStore, to_hour
+
+LAGS = (1, 3, 6, 24)
+WINDOWS = (6, 24)
+HISTORY_HOURS = max(LAGS + WINDOWS)
+
+_NAN = float("nan")
+
+
+class SeriesState:
+    """Hourly ring buffer of one field with running window sums"""
+
+    __slots__ = ("capacity", "values", "last_hour", "sums", "squares", "counts")
+
+    def __init__(self):
+        # One extra slot keeps the value leaving the longest window readable
+        self.capacity = HISTORY_HOURS + 1
+        self.values = array("d", [_NAN]) * self.capacity
+        self.last_hour: Optional[int] = None
+        self.sums = [0.0] * len(WINDOWS)
+        self.squares = [0.0] * len(WINDOWS)
+        self.counts = [0] * len(WINDOWS)
+
+    def _reset(self):
+        for slot in range(self.capacity):
+            self.values[slot] = _NAN
+        for i in range(len(WINDOWS)):
+            self.sums[i] = self.squares[i] = 0.0
+            self.counts[i] = 0
+
+    def _add(self, value: float, sign: int):
+        for i in range(len(WINDOWS)):
+            self.sums[i] += sign * value
+            self.squares[i] += sign * value * value
+            self.counts[i] += sign
+            if not self.counts[i]:
+                # Drop accumulated rounding error whenever a window empties
+                self.sums[i] = self.squares[i] = 0.0
+
+    def _step(self):
+        """Advance one hour, with no reading yet for the new hour"""
+        hour = self.last_hour + 1
+        for i, window in enumerate(WINDOWS):
+            leaving = self.values[(hour - window) % self.capacity]
+            if leaving == leaving:  # not NaN
+                self.sums[i] -= leaving
+                self.squares[i] -= leaving * leaving
+                self.counts[i] -= 1
+                if not self.counts[i]:
+                    self.sums[i] = self.squares[i] = 0.0
+        self.values[hour % self.capacity] = _NAN
+        self.last_hour = hour
+
+    def observe(self, hour: int, value: float) -> bool:
+        """Record value for hour; False if hour is older than the latest one"""
+        if self.last_hour is not None and hour < self.last_hour:
+            return False
+        if self.last_hour is None or hour - self.last_hour > HISTORY_HOURS:
+            self._reset()
+            self.last_hour = hour
+        while self.last_hour < hour:
+            self._step()
+
+        slot = hour % self.capacity
+        previous = self.values[slot]
+        if previous == previous:
+            self._add(previous, -1)
+        self.values[slot] = value
+        self._add(value, 1)
+        return True
+
+    def features(self, prefix: str, out: Dict[str, float]):
+        """Add the known lag and rolling features, named after prefix, to out"""
+        if self.last_hour is None:
+            return
+        for lag in LAGS:
+            value = self.values[(self.last_hour - lag) % self.capacity]
+            if value == value:
+                out[f"{prefix}_lag_{lag}h"] = value
+        for i, window in enumerate(WINDOWS):
+            count = self.counts[i]
+            if count:
+                mean = self.sums[i] / count
+                out[f"{prefix}_rolling_mean_{window}h"] = mean
+            if count > 1:
+                variance = (self.squares[i] - self.sums[i] * mean) / (count - 1)
+                out[f"{prefix}_rolling_std_{window}h"] = math.sqrt(max(0.0, variance))
+
+
+class FeatureStateStore:
+    """SeriesState per (station, field), safe to update from worker threads"""
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+        self._stations: Dict[str, Dict[str, SeriesState]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._stations)
+
+    def observe(self, station_id: str, timestamp: Any, values: Mapping[str, Optional[float]]) -> bool:
+        """Record one reading; False if its timestamp cannot be parsed"""
+        try:
+            hour = to_hour(timestamp)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            self._observe(station_id, hour, values)
+        return True
+
+    def _observe(self, station_id: str, hour: int, values: Mapping[str, Optional[float]]):
+        series = self._stations.get(station_id)
+        if series is None:
+            series = self._stations[station_id] = {}
+        for name in self.fields:
+            value = values.get(name)
+            if value is None:
+                continue
+            value = float(value)
+            if math.isnan(value):
+                continue
+            state = series.get(name)
+            if state is None:
+                state = series[name] = SeriesState()
+            state.observe(hour, value)
+
+    def observe_many(self, rows: Iterable[Tuple[str, Any, Mapping[str, Optional[float]]]]) -> int:
+        """Record (station_id, timestamp, values) rows, as TimeSeriesStore.append takes them"""
+        count = 0
+        for station_id, timestamp, values in rows:
+            count += self.observe(station_id, timestamp, values)
+        return count
+
+    def features(self, station_id: str, names: Optional[Mapping[str, str]] = None) -> Dict[str, float]:
+        """
+        Lag and rolling features of a station as of its latest reading.
+
+        Features are named "<field>_lag_1h", "<field>_rolling_mean_6h", ...;
+        names maps fields to other prefixes (and limits the fields used).
+        Features that have no data yet are left out.
+        """
+        out: Dict[str, float] = {}
+        with self._lock:
+            series = self._stations.get(station_id)
+            if not series:
+                return out
+            for field, prefix in (names or {name: name for name in self.fields}).items():
+                state = series.get(field)
+                if state is not None:
+                    state.features(prefix, out)
+        return out
+
+    def load_history(self, store: TimeSeriesStore) -> int:
+        """Seed every station's state from the last HISTORY_HOURS of stored measurements"""
+        loaded = 0
+        for station_id in store.stations():
+            latest = store.latest_hour(station_id)
+            if latest is None:
+                continue
+            hours, columns = store.query(station_id, (latest - HISTORY_HOURS) * 3600, (latest + 1) * 3600)
+            fields = [name for name in self.fields if name in columns]
+            with self._lock:
+                for row, hour in enumerate(hours.tolist()):
+                    self._observe(station_id, hour, {name: float(columns[name][row]) for name in fields})
+            loaded += 1
+        return loaded
@@ -0,0 +1,96 @@
+"""
+Cache of computed forecasts
+
+A forecast only changes when the station's hourly reading or the model
+changes, so forecasts are cached under (station, input hour, horizon,
+model version) and repeated views within the hour cost a dictionary
+lookup. Entries also expire after a TTL, which bounds how long other
+inputs (current weather) can be out of date. The cache is an LRU bounded
+by the serialized size of its entries. Concurrent misses for the same key
+share one computation.
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Hashable
+from config import FORECAST_CACHE_TTL, FORECAST_CACHE_MAX_BYTES
+from fast_json import dumps
+from singleflight import SingleFlight
+from timeseries_store import to_hour
+
+
+def hour_bucket(timestamp: Any) -> int:
+    """Hours since the epoch of a reading's timestamp, or of now if it cannot be parsed"""
+    try:
+        return to_hour(timestamp)
+    except (TypeError, ValueError):
+        return to_hour(datetime.utcnow())
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size")
+
+    def __init__(self, value: Any, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class ForecastCache:
+    """LRU + TTL of forecasts, bounded by total serialized bytes; ttl <= 0 disables it"""
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        The cached forecast for key, calling compute() when it is missing or expired.
+
+        Exceptions from compute propagate and nothing is cached.
+        """
+        if self.ttl <= 0:
+            return await compute()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+        self.misses += 1
+        return await self._flight.do(key, lambda: self._compute(key, compute))
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = await compute()
+        self._store(key, _Entry(value, time.monotonic() + self.ttl, len(dumps(value))))
+        return value
+
+    def _store(self, key: Hashable, entry: _Entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+
+forecast_cache = ForecastCache(FORECAST_CACHE_TTL, FORECAST_CACHE_MAX_BYTES)
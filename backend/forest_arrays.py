@@ -0,0 +1,411 @@
+"""
+Array-backed random forests that can be memory-mapped and shared by workers
+
+scikit-learn copies every tree into private memory when a forest is
+unpickled, so each uvicorn worker holds its own copy of the model. Here a
+fitted forest (RandomForestRegressor / ExtraTreesRegressor, or a
+MultiOutputRegressor of them) and its StandardScaler are exported once to
+a directory of plain .npy arrays:
+
+    feature, threshold, left, value   one entry per node, all trees concatenated
+    roots, tree_output                one entry per tree
+    scaler_mean, scaler_scale         optional StandardScaler parameters
+    meta.json                         shapes, output names and the source file
+
+The export path is a symlink to the current version directory, switched
+atomically when the model is exported again. Loading them with
+mmap_mode="r" maps the files read-only, so all workers
+share one copy through the page cache, and scikit-learn is not needed to
+serve predictions.
+
+The layout is built for traversing every tree for a whole batch in a few
+NumPy operations per level:
+
+- nodes are numbered breadth-first with siblings next to each other, so
+  the right child of a node is left + 1 and one step is
+  node = left[node] + (x[feature[node]] > threshold[node])
+- a leaf points to itself with an infinite threshold, so rows that reach
+  a leaf early stay there without masks, and max_depth steps finish
+  every tree
+- thresholds are float32, rounded down from scikit-learn's float64
+  thresholds; scikit-learn compares float32 inputs, and for any float32
+  x, x <= t holds exactly when x <= round_down(t), so the same leaves are
+  reached
+
+Predictions match the scikit-learn model up to floating-point summation
+order. Run this module to check that on a fitted model and to compare
+latencies across batch sizes:
+
+    python forest_arrays.py model/aqi_model.pkl
+    python forest_arrays.py model/advanced_aqi_model.pkl --sizes 1,48,1000
+"""
+import json
+import os
+import re
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+FORMAT_VERSION = 2
+
+_LEAF = -1
+_NODE_ARRAYS = ("feature", "threshold", "left", "value")
+_TREE_ARRAYS = ("roots", "tree_output")
+
+# Rows traversed together; keeps the (rows x trees) work arrays in cache
+CHUNK_ROWS = 512
+
+
+def _forests(model: Any) -> List[Any]:
+    """The single-output forests making up model, one per output"""
+    if hasattr(model, "estimators_") and all(hasattr(e, "estimators_") for e in model.estimators_):
+        forests = list(model.estimators_)  # MultiOutputRegressor
+    elif hasattr(model, "estimators_") and hasattr(model.estimators_[0], "tree_"):
+        forests = [model]
+    else:
+        raise ValueError(f"Cannot pack {type(model).__name__}: expected a fitted random forest")
+    for forest in forests:
+        if getattr(forest, "n_outputs_", 1) != 1 or hasattr(forest, "learning_rate"):
+            raise ValueError(f"Cannot pack {type(forest).__name__}: only single-output averaging forests")
+    return forests
+
+
+def _breadth_first(children_left: np.ndarray, children_right: np.ndarray) -> np.ndarray:
+    """Node ids of one tree in breadth-first order, with the two children of a node adjacent"""
+    level = np.zeros(1, dtype=np.intp)
+    order = [level]
+    while True:
+        internal = level[children_left[level] != _LEAF]
+        if not len(internal):
+            break
+        level = np.column_stack((children_left[internal], children_right[internal])).ravel()
+        order.append(level)
+    return np.concatenate(order)
+
+
+def _round_down_float32(threshold: np.ndarray) -> np.ndarray:
+    """Largest float32 not above each float64 threshold"""
+    rounded = threshold.astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def export_forest(model: Any, scaler: Any = None) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Flatten a fitted forest (and optional StandardScaler) into arrays and metadata"""
+    forests = _forests(model)
+    feature, threshold, left, value = [], [], [], []
+    roots, tree_output = [], []
+    offset = 0
+    max_depth = 0
+    for output, forest in enumerate(forests):
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            order = _breadth_first(tree.children_left, tree.children_right)
+            new_id = np.empty(tree.node_count, dtype=np.intp)
+            new_id[order] = np.arange(tree.node_count)
+            is_leaf = tree.children_left[order] == _LEAF
+            first_child = new_id[np.where(is_leaf, 0, tree.children_left[order])]
+            roots.append(offset)
+            tree_output.append(output)
+            feature.append(np.where(is_leaf, 0, tree.feature[order]).astype(np.int32))
+            threshold.append(np.where(is_leaf, np.float32(np.inf), _round_down_float32(tree.threshold[order])))
+            left.append(np.where(is_leaf, np.arange(tree.node_count), first_child) + offset)
+            value.append(tree.value.reshape(tree.node_count, -1)[order, 0].astype(np.float64))
+            max_depth = max(max_depth, int(tree.max_depth))
+            offset += tree.node_count
+
+    arrays = {
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold).astype(np.float32),
+        "left": np.concatenate(left).astype(np.int64),
+        "value": np.concatenate(value),
+        "roots": np.asarray(roots, dtype=np.int64),
+        "tree_output": np.asarray(tree_output, dtype=np.int32),
+    }
+    if scaler is not None:
+        n_features = len(scaler.mean_) if getattr(scaler, "mean_", None) is not None else scaler.n_features_in_
+        mean = scaler.mean_ if getattr(scaler, "mean_", None) is not None else np.zeros(n_features)
+        scale = scaler.scale_ if getattr(scaler, "scale_", None) is not None else np.ones(n_features)
+        arrays["scaler_mean"] = np.asarray(mean, dtype=np.float64)
+        arrays["scaler_scale"] = np.asarray(scale, dtype=np.float64)
+
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "n_features": int(forests[0].n_features_in_),
+        "n_outputs": len(forests),
+        # A forest fitted on a 1-D target predicts a 1-D array
+        "multi_output": len(forests) > 1 or model is not forests[0],
+        "n_trees": len(roots),
+        "n_nodes": offset,
+        "max_depth": max_depth,
+    }
+    return arrays, meta
+
+
+class PackedScaler:
+    """StandardScaler.transform over stored mean and scale"""
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X: Any) -> np.ndarray:
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean_
+        X /= self.scale_
+        return X
+
+
+class PackedForest:
+    """Prediction over packed forest arrays, possibly memory-mapped"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any], chunk_rows: int = CHUNK_ROWS):
+        self.meta = meta
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.value = arrays["value"]
+        self.roots = np.asarray(arrays["roots"], dtype=np.intp)
+        self.tree_output = arrays["tree_output"]
+        self.n_outputs = meta["n_outputs"]
+        self.n_features_in_ = meta["n_features"]
+        self.chunk_rows = chunk_rows
+        # Trees of each output are contiguous
+        tree_output = np.asarray(self.tree_output)
+        self._output_starts = np.searchsorted(tree_output, np.arange(self.n_outputs))
+        self._output_sizes = np.bincount(tree_output, minlength=self.n_outputs)
+
+    def _apply_chunk(self, X: np.ndarray) -> np.ndarray:
+        flat = X.ravel()
+        row_offset = (np.arange(len(X)) * X.shape[1])[:, np.newaxis]
+        node = np.repeat(self.roots[np.newaxis, :], len(X), axis=0)
+        for _ in range(self.meta["max_depth"]):
+            node = self.left[node] + (flat[row_offset + self.feature[node]] > self.threshold[node])
+        return node
+
+    def apply(self, X: Any) -> np.ndarray:
+        """Leaf node index reached by every row in every tree, shape (n_rows, n_trees)"""
+        # Trees compare float32 features, as in scikit-learn
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}, expected (n_rows, {self.n_features_in_})")
+        if len(X) <= self.chunk_rows:
+            return self._apply_chunk(X)
+        return np.concatenate([self._apply_chunk(X[start:start + self.chunk_rows])
+                               for start in range(0, len(X), self.chunk_rows)])
+
+    def predict(self, X: Any) -> np.ndarray:
+        leaf_values = self.value[self.apply(X)]
+        if self.n_outputs == 1:
+            out = leaf_values.sum(axis=1, keepdims=True)
+        else:
+            out = np.add.reduceat(leaf_values, self._output_starts, axis=1)
+        out /= self._output_sizes
+        return out if self.meta["multi_output"] else out[:, 0]
+
+
+def _source_stamp(path: Optional[str]) -> Optional[Dict[str, int]]:
+    if not path or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _export_versions(directory: str) -> List[str]:
+    """Export directories written for directory (path.v<time_ns>-<pid>), oldest first"""
+    parent, base = os.path.split(os.path.abspath(directory))
+    pattern = re.compile(re.escape(base) + r"\.v(\d+)-\d+$")
+    found = [(int(match.group(1)), name) for name in os.listdir(parent)
+             for match in [pattern.match(name)] if match]
+    return [os.path.join(parent, name) for _, name in sorted(found)]
+
+
+def save_packed(directory: str, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]):
+    """
+    Write arrays and meta.json to a new version directory and point the
+    directory symlink at it atomically.
+
+    directory always resolves to a complete export, so a worker loading
+    while another one exports sees either the old or the new version. The
+    previous version is kept for loads that already resolved it; versions
+    older than that are removed.
+    """
+    path = os.path.abspath(directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    version = f"{path}.v{time.time_ns()}-{os.getpid()}"
+    os.makedirs(version)
+    for name, array in arrays.items():
+        np.save(os.path.join(version, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(version, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A plain directory from an older export cannot be replaced by a symlink in one step
+        shutil.rmtree(path, ignore_errors=True)
+    link = f"{path}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, path)
+
+    # Only versions older than the previous one: a newer one may still be written by another worker
+    for old in _export_versions(path):
+        if old in (version, previous) or previous is None:
+            break
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def read_meta(directory: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_packed(directory: str, mmap_mode: Optional[str] = "r") -> Tuple[PackedForest, Optional[PackedScaler], Dict[str, Any]]:
+    """Load a packed forest (and scaler, if stored), memory-mapped read-only by default"""
+    # Resolve the symlink once, so all files come from the same export
+    directory = os.path.realpath(directory)
+    meta = read_meta(directory)
+    if meta is None or meta.get("format_version") != FORMAT_VERSION:
+        raise FileNotFoundError(f"No packed model in {directory}")
+    names = _NODE_ARRAYS + _TREE_ARRAYS
+    arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in names}
+    scaler = None
+    if os.path.exists(os.path.join(directory, "scaler_mean.npy")):
+        scaler = PackedScaler(np.load(os.path.join(directory, "scaler_mean.npy")),
+                              np.load(os.path.join(directory, "scaler_scale.npy")))
+    return PackedForest(arrays, meta), scaler, meta
+
+
+def is_current(directory: str, source_path: Optional[str]) -> bool:
+    """Whether directory holds a packed export of source_path as it is now (or source_path is gone)"""
+    meta = read_meta(directory)
+    if meta is None or meta.get("format_version") != FORMAT_VERSION:
+        return False
+    stamp = _source_stamp(source_path)
+    return stamp is None or meta.get("source") == stamp
+
+
+def load_or_export(directory: str, source_path: Optional[str],
+                   load_source: Callable[[], Tuple[Any, Any, Dict[str, Any]]],
+                   mmap_mode: Optional[str] = "r") -> Tuple[PackedForest, Optional[PackedScaler], Dict[str, Any]]:
+    """
+    Load the packed model in directory, exporting it first if it is missing
+    or older than source_path.
+
+    load_source() returns (fitted model, scaler or None, extra metadata) and
+    is only called when an export is needed.
+    """
+    if not is_current(directory, source_path):
+        model, scaler, extra = load_source()
+        arrays, meta = export_forest(model, scaler)
+        meta.update(extra)
+        meta["source"] = _source_stamp(source_path)
+        save_packed(directory, arrays, meta)
+        print(f"Packed {meta['n_trees']} trees ({meta['n_nodes']} nodes) into {directory}")
+    return load_packed(directory, mmap_mode)
+
+
+def load_fitted(path: str, scaler_path: Optional[str] = None) -> Tuple[Any, Any]:
+    """(model, scaler) from a pickled model, or from a joblib dict with "model" and "scaler" keys"""
+    import joblib
+    loaded = joblib.load(path)
+    if isinstance(loaded, dict):
+        return loaded["model"], loaded.get("scaler")
+    return loaded, joblib.load(scaler_path) if scaler_path else None
+
+
+def sample_inputs(packed: PackedForest, n_rows: int, seed: int = 0) -> np.ndarray:
+    """
+    Model inputs for testing: each feature is drawn from the thresholds the
+    forest splits it on, half of them exactly at a threshold and half nudged
+    to either side, so rows reach many different leaves and exercise the
+    comparisons at their edges.
+    """
+    rng = np.random.default_rng(seed)
+    feature = np.asarray(packed.feature)
+    threshold = np.asarray(packed.threshold)
+    split = np.isfinite(threshold)
+    X = rng.normal(size=(n_rows, packed.n_features_in_)).astype(np.float32)
+    for column in range(packed.n_features_in_):
+        candidates = threshold[split & (feature == column)]
+        if len(candidates):
+            picked = rng.choice(candidates, n_rows)
+            nudge = rng.choice([-1, 0, 0, 1], n_rows) * np.abs(picked).clip(1e-3) * 1e-4
+            X[:, column] = picked + nudge.astype(np.float32)
+    return X.astype(np.float64)
+
+
+def check_equivalence(model: Any, packed: PackedForest, X: np.ndarray, tolerance: float = 1e-9) -> float:
+    """Largest absolute difference between scikit-learn and packed predictions; raises above tolerance"""
+    expected = np.asarray(model.predict(X), dtype=np.float64)
+    actual = packed.predict(X)
+    if expected.shape != actual.shape:
+        raise AssertionError(f"Prediction shapes differ: {expected.shape} vs {actual.shape}")
+    scale = max(1.0, float(np.abs(expected).max(initial=0.0)))
+    difference = float(np.abs(expected - actual).max(initial=0.0))
+    if difference > tolerance * scale:
+        raise AssertionError(f"Packed predictions differ from scikit-learn by up to {difference:g}")
+    return difference
+
+
+def _time_call(predict: Callable[[np.ndarray], Any], X: np.ndarray, min_seconds: float) -> float:
+    """Median seconds per call over at least min_seconds (and 3 calls)"""
+    predict(X)
+    times = []
+    start = time.perf_counter()
+    while len(times) < 3 or time.perf_counter() - start < min_seconds:
+        call_start = time.perf_counter()
+        predict(X)
+        times.append(time.perf_counter() - call_start)
+    return float(np.median(times))
+
+
+def benchmark(model: Any, packed: PackedForest, sizes: List[int], min_seconds: float = 0.5,
+              seed: int = 0) -> List[Dict[str, float]]:
+    """Median latency of scikit-learn and packed predict for each batch size"""
+    X = sample_inputs(packed, max(sizes), seed)
+    results = []
+    for size in sizes:
+        sklearn_s = _time_call(model.predict, X[:size], min_seconds)
+        packed_s = _time_call(packed.predict, X[:size], min_seconds)
+        results.append({"rows": size, "sklearn_ms": sklearn_s * 1000, "packed_ms": packed_s * 1000,
+                        "speedup": sklearn_s / packed_s})
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import warnings
+
+    parser = argparse.ArgumentParser(description="Check a packed forest against scikit-learn and compare latencies")
+    parser.add_argument("model", help="Pickled forest, or a joblib dict with model and scaler")
+    parser.add_argument("--check-rows", type=int, default=20000, help="Rows compared with scikit-learn")
+    parser.add_argument("--sizes", default="1,10,100,1000,10000", help="Batch sizes to benchmark")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="Measuring time per batch size and engine")
+    parser.add_argument("--no-bench", action="store_true", help="Only run the equivalence check")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Inputs are already scaled arrays; scikit-learn warns when a forest was fitted with column names
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    model, _ = load_fitted(args.model)
+    start = time.perf_counter()
+    arrays, meta = export_forest(model)
+    packed = PackedForest(arrays, meta)
+    print(f"Packed {meta['n_trees']} trees, {meta['n_nodes']} nodes, {meta['n_outputs']} output(s), "
+          f"depth {meta['max_depth']} in {time.perf_counter() - start:.2f}s")
+
+    difference = check_equivalence(model, packed, sample_inputs(packed, args.check_rows, args.seed))
+    print(f"Equivalence: {args.check_rows} rows match scikit-learn (max difference {difference:.3g})")
+
+    if not args.no_bench:
+        print(f"{'rows':>8} {'sklearn ms':>12} {'packed ms':>12} {'speedup':>9}")
+        for row in benchmark(model, packed, [int(size) for size in args.sizes.split(",")],
+                             args.min_seconds, args.seed):
+            print(f"{row['rows']:>8} {row['sklearn_ms']:>12.3f} {row['packed_ms']:>12.3f} {row['speedup']:>8.1f}x")
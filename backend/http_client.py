@@ -0,0 +1,119 @@
+"""
+Shared upstream HTTP clients for OpenAQ and OpenWeather
+
+One pooled httpx.AsyncClient per upstream host lives for the whole
+application lifetime, so requests reuse keep-alive (and HTTP/2 where the
+h2 package is installed) connections instead of paying TCP+TLS setup on
+every call.
+"""
+import importlib.util
+import time
+from typing import Any, Dict, Optional, Tuple
+import httpx
+from config import (
+    OPENAQ_API_KEY,
+    OPENAQ_BASE_URL,
+    OPENWEATHER_BASE_URL,
+    OPENAQ_TIMEOUT,
+    OPENWEATHER_TIMEOUT,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_MAX_CONNECTIONS_PER_HOST,
+    UPSTREAM_MAX_KEEPALIVE_PER_HOST,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_HTTP2,
+    UPSTREAM_MODE,
+)
+from metrics import record_upstream, record_upstream_error
+from singleflight import SingleFlight
+from upstream_stub import upstream_transport
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamClients:
+    """App-lifetime pool of upstream clients, one per host"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self.flight = SingleFlight()
+
+    def _build(self, name: str, base_url: str, timeout: float, headers: Optional[dict] = None) -> httpx.AsyncClient:
+        # httpx limits apply per client; one client per host gives per-host limits
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_PER_HOST,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            http2=UPSTREAM_HTTP2 and HTTP2_AVAILABLE,
+            # Replay/record stand-in when UPSTREAM_MODE is not live
+            transport=upstream_transport(name),
+        )
+
+    def _get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            if name == "openaq":
+                client = self._build(name, OPENAQ_BASE_URL, OPENAQ_TIMEOUT, {"X-API-Key": OPENAQ_API_KEY})
+            else:
+                client = self._build(name, OPENWEATHER_BASE_URL, OPENWEATHER_TIMEOUT)
+            self._clients[name] = client
+        return client
+
+    @property
+    def openaq(self) -> httpx.AsyncClient:
+        return self._get("openaq")
+
+    @property
+    def openweather(self) -> httpx.AsyncClient:
+        return self._get("openweather")
+
+    async def get_json(self, name: str, path: str, params: Optional[dict] = None,
+                       timeout: Optional[float] = None) -> Tuple[int, Any]:
+        """
+        GET path on the named upstream and return (status_code, body).
+
+        body is the decoded JSON on 200 and the raw text otherwise.
+        Identical concurrent requests share one upstream call.
+        """
+        key = (name, path, tuple(sorted((params or {}).items())))
+        return await self.flight.do(key, lambda: self._get_json(name, path, params, timeout))
+
+    async def _get_json(self, name: str, path: str, params: Optional[dict],
+                        timeout: Optional[float]) -> Tuple[int, Any]:
+        client = self._get(name)
+        start = time.perf_counter()
+        try:
+            if timeout is None:
+                response = await client.get(path, params=params)
+            else:
+                response = await client.get(path, params=params, timeout=timeout)
+        except httpx.TimeoutException:
+            record_upstream_error(name, "timeout")
+            raise
+        except httpx.HTTPError:
+            record_upstream_error(name, "connection")
+            raise
+        record_upstream(name, time.perf_counter() - start, response.status_code, received=len(response.content))
+        if response.status_code != 200:
+            return response.status_code, response.text
+        return response.status_code, response.json()
+
+    async def start(self):
+        """Open the pools eagerly at application startup"""
+        self._get("openaq")
+        self._get("openweather")
+        print(f"Upstream HTTP clients ready (mode={UPSTREAM_MODE}, http2={UPSTREAM_HTTP2 and HTTP2_AVAILABLE})")
+
+    async def close(self):
+        """Close all pooled connections at application shutdown"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+upstream = UpstreamClients()
@@ -1,28 +1,179 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
-import httpx
+from typing import List, Optional, Set
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import asyncio
-from config import OPENAQ_API_KEY, CORS_ORIGINS, OPENWEATHER_API_KEY
+import random
+from config import (
+    CORS_ORIGINS, OPENWEATHER_API_KEY, OPENAQ_FALLBACK_TIMEOUT,
+    OPENAQ_FALLBACK_COUNTRIES, OPENAQ_FALLBACK_DEADLINE, OPENAQ_FALLBACK_PER_COUNTRY,
+    OPENAQ_FALLBACK_MAX_STATIONS,
+    STATION_CACHE_TTL, STATION_CACHE_MAX_ENTRIES, STATION_CACHE_ERROR_BACKOFF,
+    WEATHER_CACHE_TTL, WEATHER_CACHE_MAX_ENTRIES, WEATHER_GRID_DEG, WEATHER_BATCH_CONCURRENCY,
+    UPSTREAM_MODE, MOCK_SEED,
+    HISTORY_ENABLED, HISTORY_DB_PATH, HISTORY_POLL_INTERVAL,
+    STATION_FEED_REFRESH_INTERVAL, STATION_FEED_MAX_PENDING, STATION_FEED_KEEPALIVE,
+    STATIONS_BY_COUNTRY_TTL, RESPONSE_COMPRESSION_MIN_SIZE, RESPONSE_GZIP_LEVEL,
+    METRICS_ENABLED, EVENT_LOOP_LAG_INTERVAL, PROFILE_SLOW_REQUEST_MS,
+    HEALTH_READY_REQUIRES_MODELS, MODEL_REGISTRY_POLL_INTERVAL,
+)
 from email_service_fixed import email_service
+from http_client import upstream
+from snapshot_cache import SnapshotCache
+from station_registry import StationRegistry
+from station_feed import StationFeed
+from response_cache import response_cache, StreamingAwareGZipMiddleware
+from forecast_cache import forecast_cache
+from fast_json import respond
+import metrics
+import model_loader
+import profiler
+import model_registry
+from openaq_parser import parse_latest
+from aqi import compute_aqi
+from downsample import METHODS as DOWNSAMPLE_METHODS, downsample_indices
+from timeseries_store import TimeSeriesStore, FIELDS as HISTORY_FIELDS, hour_to_iso, to_hour
+from feature_state import FeatureStateStore
+import numpy as np
 
 load_dotenv()
 
-app = FastAPI(title="AirGuardian API", version="1.0.0")
+# Core routes; the application is assembled by create_app() at the end of this module
+router = APIRouter()
+
+# Station snapshots keyed by (lat, lon, radius); None is the global snapshot
+station_cache = SnapshotCache(
+    ttl=STATION_CACHE_TTL,
+    max_entries=STATION_CACHE_MAX_ENTRIES,
+    error_backoff=STATION_CACHE_ERROR_BACKOFF,
+)
 
-# CORS configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://localhost:3000", "http://127.0.0.1:5173", "http://127.0.0.1:3000"],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
+# Current weather keyed by WEATHER_GRID_DEG grid cell
+weather_cache = SnapshotCache(
+    ttl=WEATHER_CACHE_TTL,
+    max_entries=WEATHER_CACHE_MAX_ENTRIES,
+    error_backoff=STATION_CACHE_ERROR_BACKOFF,
 )
 
+# Running weather prefetches, held so they are not garbage-collected mid-flight
+weather_prefetches: Set[asyncio.Task] = set()
+
+# Every station seen in any upstream response, indexed by id and location
+station_registry = StationRegistry()
+
+# Changed stations pushed to WebSocket/SSE subscribers after each refresh
+station_feed = StationFeed(max_pending=STATION_FEED_MAX_PENDING)
+feed_refresher: Optional[asyncio.Task] = None
+
+metrics.register_cache("stations", station_cache)
+metrics.register_cache("weather", weather_cache)
+metrics.register_cache("responses", response_cache)
+metrics.register_cache("forecasts", forecast_cache)
+loop_monitor: Optional[asyncio.Task] = None
+registry_watcher: Optional[asyncio.Task] = None
+
+def register_stations(stations: List["StationData"]):
+    """Index freshly fetched stations and push the changed ones to live subscribers"""
+    station_registry.update(stations)
+    station_feed.publish(stations)
+
+# Hourly measurement history, appended by the background poller
+history_store: Optional[TimeSeriesStore] = None
+history_poller: Optional[asyncio.Task] = None
+
+# Lag and rolling-window model features per station, updated with every reading
+feature_state = FeatureStateStore(HISTORY_FIELDS)
+
+# Set once every startup handler has run
+startup_complete = False
+
+@router.on_event("startup")
+async def startup_models():
+    """Load or train models in the background; model endpoints answer 503 until they are ready"""
+    model_loader.start_all()
+
+@router.on_event("startup")
+async def startup_model_registry():
+    """Swap in new model versions as they are published to the registry"""
+    global registry_watcher
+    if MODEL_REGISTRY_POLL_INTERVAL > 0:
+        registry_watcher = asyncio.create_task(model_registry.watch(MODEL_REGISTRY_POLL_INTERVAL))
+
+@router.on_event("startup")
+async def startup_upstream_clients():
+    """Open the shared upstream connection pools"""
+    await upstream.start()
+
+@router.on_event("startup")
+async def startup_history_store():
+    """Open the history store and start polling station snapshots into it"""
+    global history_store, history_poller
+    if not HISTORY_ENABLED:
+        return
+    os.makedirs(os.path.dirname(HISTORY_DB_PATH), exist_ok=True)
+    history_store = TimeSeriesStore(HISTORY_DB_PATH)
+    history_poller = asyncio.create_task(poll_station_history())
+
+@router.on_event("startup")
+async def startup_station_feed():
+    """Keep the default snapshot fresh while live subscribers are connected"""
+    global feed_refresher
+    feed_refresher = asyncio.create_task(refresh_station_feed())
+
+@router.on_event("startup")
+async def startup_metrics():
+    """Sample event loop lag for /metrics"""
+    global loop_monitor
+    if METRICS_ENABLED:
+        loop_monitor = asyncio.create_task(metrics.monitor_event_loop(EVENT_LOOP_LAG_INTERVAL))
+
+@router.on_event("startup")
+async def startup_profiler():
+    """Keep a rolling window of stack samples when slow-request profiling is on"""
+    if PROFILE_SLOW_REQUEST_MS > 0:
+        profiler.sampler.start()
+
+@router.on_event("shutdown")
+async def shutdown_upstream_clients():
+    """Close the shared upstream connection pools"""
+    await upstream.close()
+
+@router.on_event("shutdown")
+async def shutdown_metrics():
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+
+@router.on_event("shutdown")
+async def shutdown_profiler():
+    profiler.sampler.stop()
+
+@router.on_event("shutdown")
+async def shutdown_model_registry():
+    if registry_watcher is not None:
+        registry_watcher.cancel()
+
+@router.on_event("shutdown")
+async def shutdown_weather_prefetch():
+    for task in list(weather_prefetches):
+        task.cancel()
+
+@router.on_event("shutdown")
+async def shutdown_station_feed():
+    if feed_refresher is not None:
+        feed_refresher.cancel()
+
+@router.on_event("shutdown")
+async def shutdown_history_store():
+    """Stop the history poller and close the store"""
+    if history_poller is not None:
+        history_poller.cancel()
+    if history_store is not None:
+        history_store.close()
+
 # Models
 class StationData(BaseModel):
     station_id: str
@@ -30,6 +181,7 @@ class StationData(BaseModel):
     latitude: float
     longitude: float
     aqi: Optional[int] = None
+    dominant_pollutant: Optional[str] = None
     pollutants: dict
     last_update: str
 
@@ -60,20 +212,8 @@ class NotificationRequest(BaseModel):
     city: str
 
 # Helper functions
-def calculate_aqi_pm25(pm25: float) -> int:
-    """Calculate AQI from PM2.5 concentration (µg/m³)"""
-    if pm25 <= 12.0:
-        return int((50 / 12.0) * pm25)
-    elif pm25 <= 35.4:
-        return int(50 + ((100 - 50) / (35.4 - 12.1)) * (pm25 - 12.1))
-    elif pm25 <= 55.4:
-        return int(100 + ((150 - 100) / (55.4 - 35.5)) * (pm25 - 35.5))
-    elif pm25 <= 150.4:
-        return int(150 + ((200 - 150) / (150.4 - 55.5)) * (pm25 - 55.5))
-    elif pm25 <= 250.4:
-        return int(200 + ((300 - 200) / (250.4 - 150.5)) * (pm25 - 150.5))
-    else:
-        return int(300 + ((500 - 300) / (500.4 - 250.5)) * (pm25 - 250.5))
+# Mock and synthetic pollutant values are all reported in µg/m³
+MOCK_UNITS = {"pm25": "µg/m³", "pm10": "µg/m³", "no2": "µg/m³", "o3": "µg/m³"}
 
 def get_aqi_color(aqi: int) -> str:
     """Get color based on AQI value"""
@@ -91,163 +231,161 @@ def get_aqi_color(aqi: int) -> str:
         return "#7E0023"  # Maroon
 
 # API Endpoints
-@app.get("/")
+@router.get("/")
 async def root():
     return {"message": "AirGuardian API", "version": "1.0.0"}
 
-@app.get("/api/stations", response_model=List[StationData])
-async def get_stations(lat: Optional[float] = None, lon: Optional[float] = None, radius: int = 50):
-    """Get air quality monitoring stations from OpenAQ"""
+if METRICS_ENABLED:
+    @router.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        """Prometheus scrape endpoint"""
+        return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE_LATEST})
+
+@router.get("/health/live", include_in_schema=False)
+async def health_live():
+    """The process is up and the event loop is responsive"""
+    return {"status": "alive"}
+
+@router.get("/health/ready", include_in_schema=False)
+async def health_ready():
+    """Ready to serve station data; model states are reported but only gate readiness if configured"""
+    models = model_loader.statuses()
+    ready = startup_complete
+    if HEALTH_READY_REQUIRES_MODELS:
+        ready = ready and models.get("aqi", {}).get("state") == model_loader.READY
+    body = {"status": "ready" if ready else "starting", "models": models}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+class UpstreamUnavailable(Exception):
+    """Raised when no real station data could be fetched from OpenAQ"""
+
+@router.get("/api/stations", response_model=List[StationData])
+async def list_stations(lat: Optional[float] = None, lon: Optional[float] = None, radius: int = 50):
+    """Get air quality monitoring stations (cached OpenAQ snapshot)"""
+    return respond(await get_stations(lat, lon, radius))
+
+async def get_stations(lat: Optional[float] = None, lon: Optional[float] = None, radius: int = 50) -> List[StationData]:
+    """Stations for a query, from the registry or the snapshot cache (fallback countries or mock data if neither has any)"""
+    if lat is not None and lon is not None:
+        # Answer locally when this area was already loaded in full
+        if station_registry.covers(lat, lon, radius):
+            return station_registry.within_radius(lat, lon, radius)[:50]
+        key = (round(lat, 4), round(lon, 4), radius)
+    else:
+        key = None
+    
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # OpenAQ API v3 with API key
-            headers = {
-                "X-API-Key": OPENAQ_API_KEY
-            }
-            
-            params = {
-                "limit": 100,
-                "order_by": "lastUpdated",
-                "sort": "desc"
-            }
-            
-            if lat is not None and lon is not None:
-                params["coordinates"] = f"{lat},{lon}"
-                params["radius"] = radius * 1000  # Convert km to meters
-            
-            response = await client.get(
-                "https://api.openaq.org/v3/latest",
-                params=params,
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                print(f"OpenAQ API error: {response.status_code} - {response.text}")
-                # Try to get data from multiple countries as fallback
-                return await get_fallback_stations()
-            
-            data = response.json()
-            stations = []
-            
-            for result in data.get("results", [])[:50]:  # Limit to 50 stations
-                measurements = result.get("measurements", [])
-                pollutants = {}
-                pm25_value = None
-                pm10_value = None
-                no2_value = None
-                o3_value = None
-                
-                for measurement in measurements:
-                    parameter = measurement.get("parameter")
-                    value = measurement.get("value")
-                    if parameter and value:
-                        pollutants[parameter] = value
-                        if parameter == "pm25":
-                            pm25_value = value
-                        elif parameter == "pm10":
-                            pm10_value = value
-                        elif parameter == "no2":
-                            no2_value = value
-                        elif parameter == "o3":
-                            o3_value = value
-                
-                # Calculate AQI from PM2.5 if available, otherwise use PM10
-                aqi = None
-                if pm25_value:
-                    aqi = calculate_aqi_pm25(pm25_value)
-                elif pm10_value:
-                    # Convert PM10 to PM2.5 equivalent (rough estimation)
-                    pm25_equivalent = pm10_value * 0.7
-                    aqi = calculate_aqi_pm25(pm25_equivalent)
-                
-                coordinates = result.get("coordinates", {})
-                location = result.get("location", "Unknown")
-                
-                if coordinates.get("latitude") and coordinates.get("longitude"):
-                    station = StationData(
-                        station_id=str(result.get("location", "").replace(" ", "_") + "_" + str(result.get("locationId", ""))),
-                        name=location,
-                        latitude=coordinates["latitude"],
-                        longitude=coordinates["longitude"],
-                        aqi=aqi,
-                        pollutants=pollutants,
-                        last_update=result.get("lastUpdated", datetime.utcnow().isoformat())
-                    )
-                    stations.append(station)
-            
-            return stations if stations else get_mock_stations()
-            
+        return await station_cache.get(key, lambda: fetch_stations(lat, lon, radius))
     except Exception as e:
         print(f"Error fetching stations: {e}")
-        # Return mock data on error
-        return get_mock_stations()
+    
+    # No snapshot yet for this query: real stations from the fallback countries, else mock data
+    try:
+        stations = await upstream.flight.do("openaq_fallback", fetch_fallback_stations)
+    except Exception as e:
+        print(f"Error fetching fallback stations: {e}")
+        stations = []
+    stations = stations or get_mock_stations()
+    # Serve them from the cache for the error backoff; the next request after that
+    # retries OpenAQ in the background, so an outage costs one fallback fetch per backoff
+    station_cache.put(key, stations, STATION_CACHE_ERROR_BACKOFF)
+    return stations
 
-async def get_fallback_stations() -> List[StationData]:
-    """Try to get stations from multiple countries as fallback"""
-    countries = ['US', 'MX', 'CA', 'GB', 'DE', 'FR', 'IT', 'ES', 'AU', 'JP']
-    all_stations = []
+async def fetch_stations(lat: Optional[float] = None, lon: Optional[float] = None, radius: int = 50) -> List[StationData]:
+    """Fetch a fresh station snapshot from OpenAQ, raising if no real data is available"""
+    params = {
+        "limit": 100,
+        "order_by": "lastUpdated",
+        "sort": "desc"
+    }
     
-    for country in countries[:3]:  # Try first 3 countries
-        try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                headers = {"X-API-Key": OPENAQ_API_KEY}
-                params = {
-                    "limit": 20,
-                    "country": country,
-                    "order_by": "lastUpdated",
-                    "sort": "desc"
-                }
-                
-                response = await client.get(
-                    "https://api.openaq.org/v3/latest",
-                    params=params,
-                    headers=headers
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    for result in data.get("results", []):
-                        measurements = result.get("measurements", [])
-                        pollutants = {}
-                        pm25_value = None
-                        
-                        for measurement in measurements:
-                            parameter = measurement.get("parameter")
-                            value = measurement.get("value")
-                            if parameter and value:
-                                pollutants[parameter] = value
-                                if parameter == "pm25":
-                                    pm25_value = value
-                        
-                        aqi = calculate_aqi_pm25(pm25_value) if pm25_value else None
-                        coordinates = result.get("coordinates", {})
-                        location = result.get("location", "Unknown")
-                        
-                        if coordinates.get("latitude") is not None and coordinates.get("longitude") is not None:
-                            station = StationData(
-                                station_id=str(result.get("location", "").replace(" ", "_") + "_" + str(result.get("locationId", ""))),
-                                name=location,
-                                latitude=coordinates["latitude"],
-                                longitude=coordinates["longitude"],
-                                aqi=aqi,
-                                pollutants=pollutants,
-                                last_update=result.get("lastUpdated", datetime.utcnow().isoformat())
-                            )
-                            all_stations.append(station)
-                            
-                            if len(all_stations) >= 30:  # Limit total stations
-                                break
-                                
-        except Exception as e:
-            print(f"Error fetching stations from {country}: {e}")
+    if lat is not None and lon is not None:
+        params["coordinates"] = f"{lat},{lon}"
+        params["radius"] = radius * 1000  # Convert km to meters
+    
+    status, data = await upstream.get_json("openaq", "/v3/latest", params)
+    
+    if status != 200:
+        # The cache keeps serving the last good snapshot and backs off
+        raise UpstreamUnavailable(f"OpenAQ returned {status}: {data}")
+    
+    page = parse_latest(data)
+    all_stations = [StationData(**record) for record in page.records()]
+    
+    if not all_stations:
+        raise UpstreamUnavailable("OpenAQ returned no stations with coordinates")
+    
+    # Register the whole page so a covered area is complete in the registry;
+    # only the response is limited to 50 stations
+    register_stations(all_stations)
+    stations = all_stations[:50]
+    schedule_weather_prefetch(stations)
+    if lat is not None and lon is not None and len(data.get("results", [])) < params["limit"]:
+        # OpenAQ returned everything in the circle, so the registry covers it
+        station_registry.mark_covered(lat, lon, radius, STATION_CACHE_TTL)
+    return stations
+
+async def fetch_fallback_country(country: str) -> List[StationData]:
+    """Fetch the latest stations for one fallback country"""
+    params = {
+        "limit": OPENAQ_FALLBACK_PER_COUNTRY,
+        "country": country,
+        "order_by": "lastUpdated",
+        "sort": "desc"
+    }
+    
+    status, data = await upstream.get_json("openaq", "/v3/latest", params, timeout=OPENAQ_FALLBACK_TIMEOUT)
+    
+    stations = []
+    if status == 200:
+        page = parse_latest(data)
+        stations = [StationData(**record) for record in page.records()]
+    else:
+        print(f"OpenAQ API error for {country}: {status}")
+    
+    return stations
+
+async def fetch_fallback_stations() -> List[StationData]:
+    """Fetch real stations from all fallback countries at once, empty if none responded"""
+    tasks = [asyncio.create_task(fetch_fallback_country(country)) for country in OPENAQ_FALLBACK_COUNTRIES]
+    if not tasks:
+        return []
+    
+    # One overall deadline: take whatever has arrived, drop the stragglers
+    done, pending = await asyncio.wait(tasks, timeout=OPENAQ_FALLBACK_DEADLINE)
+    for task in pending:
+        task.cancel()
+    
+    all_stations = []
+    seen = set()
+    # Walk results in configured country order so earlier countries win the cap
+    for country, task in zip(OPENAQ_FALLBACK_COUNTRIES, tasks):
+        if task not in done:
+            print(f"Fallback stations from {country} missed the {OPENAQ_FALLBACK_DEADLINE}s deadline")
             continue
+        if task.exception() is not None:
+            print(f"Error fetching stations from {country}: {task.exception()}")
+            continue
+        for station in task.result():
+            if station.station_id in seen:
+                continue
+            seen.add(station.station_id)
+            all_stations.append(station)
+            if len(all_stations) >= OPENAQ_FALLBACK_MAX_STATIONS:  # Limit total stations
+                break
+        if len(all_stations) >= OPENAQ_FALLBACK_MAX_STATIONS:
+            break
     
-    # If we got some real data, return it, otherwise return mock data
-    return all_stations if all_stations else get_mock_stations()
+    register_stations(all_stations)
+    return all_stations
+
+def mock_random() -> random.Random:
+    """Random source for mock data: reproducible when MOCK_SEED is set"""
+    return random.Random(MOCK_SEED) if MOCK_SEED is not None else random.Random()
 
 def get_mock_stations() -> List[StationData]:
     """Return mock station data for development"""
-    import random
+    rng = mock_random()
     
     cities = [
         # Perú - Lima y alrededores
@@ -299,197 +437,444 @@ def get_mock_stations() -> List[StationData]:
         {"name": "Santa Cruz", "lat": -17.7833, "lon": -63.1833},
     ]
     
+    readings = []
+    for city in cities:
+        pm25 = rng.uniform(10, 180)
+        readings.append({
+            "pm25": round(pm25, 2),
+            "pm10": round(pm25 * 1.5, 2),
+            "no2": round(rng.uniform(10, 80), 2),
+            "o3": round(rng.uniform(20, 100), 2),
+        })
+    
+    # One vectorized AQI pass over every mock station
+    aqi_values, dominant = compute_aqi(
+        {name: np.array([r[name] for r in readings]) for name in MOCK_UNITS},
+        MOCK_UNITS
+    )
+    
     stations = []
-    for i, city in enumerate(cities):
-        pm25 = random.uniform(10, 180)
-        aqi = calculate_aqi_pm25(pm25)
-        
+    for i, (city, pollutants) in enumerate(zip(cities, readings)):
         station = StationData(
             station_id=f"station_{i+1}",
             name=city["name"],
-            latitude=city["lat"] + random.uniform(-0.05, 0.05),
-            longitude=city["lon"] + random.uniform(-0.05, 0.05),
-            aqi=aqi,
-            pollutants={
-                "pm25": round(pm25, 2),
-                "pm10": round(pm25 * 1.5, 2),
-                "no2": round(random.uniform(10, 80), 2),
-                "o3": round(random.uniform(20, 100), 2),
-            },
+            latitude=city["lat"] + rng.uniform(-0.05, 0.05),
+            longitude=city["lon"] + rng.uniform(-0.05, 0.05),
+            aqi=int(aqi_values[i]),
+            dominant_pollutant=dominant[i],
+            pollutants=pollutants,
             last_update=datetime.utcnow().isoformat()
         )
         stations.append(station)
     
     return stations
 
-@app.get("/api/stations/by-country/{country}")
-async def get_stations_by_country(country: str, limit: int = 100):
-    """Get air quality stations for a specific country"""
+@router.get("/api/stations/by-country/{country}", response_model=List[StationData])
+async def get_stations_by_country(request: Request, country: str, limit: int = 100):
+    """Get air quality stations for a specific country (cached, with ETag)"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            headers = {
-                "X-API-Key": OPENAQ_API_KEY
-            }
-            
-            # Use the latest measurements endpoint with country filter
-            params = {
-                "limit": limit,
-                "country": country,
-                "order_by": "lastUpdated",
-                "sort": "desc"
-            }
-            
-            response = await client.get(
-                "https://api.openaq.org/v3/latest",
-                params=params,
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                print(f"OpenAQ API error: {response.status_code} - {response.text}")
-                return []
-            
-            data = response.json()
-            stations = []
-            
-            for result in data.get("results", []):
-                measurements = result.get("measurements", [])
-                pollutants = {}
-                pm25_value = None
-                pm10_value = None
-                
-                for measurement in measurements:
-                    parameter = measurement.get("parameter")
-                    value = measurement.get("value")
-                    if parameter and value:
-                        pollutants[parameter] = value
-                        if parameter == "pm25":
-                            pm25_value = value
-                        elif parameter == "pm10":
-                            pm10_value = value
-                
-                # Calculate AQI from PM2.5 if available, otherwise use PM10
-                aqi = None
-                if pm25_value:
-                    aqi = calculate_aqi_pm25(pm25_value)
-                elif pm10_value:
-                    # Convert PM10 to PM2.5 equivalent (rough estimation)
-                    pm25_equivalent = pm10_value * 0.7
-                    aqi = calculate_aqi_pm25(pm25_equivalent)
-                
-                coordinates = result.get("coordinates", {})
-                location = result.get("location", "Unknown")
-                
-                if coordinates.get("latitude") is not None and coordinates.get("longitude") is not None:
-                    station = StationData(
-                        station_id=str(result.get("location", "").replace(" ", "_") + "_" + str(result.get("locationId", ""))),
-                        name=location,
-                        latitude=coordinates["latitude"],
-                        longitude=coordinates["longitude"],
-                        aqi=aqi,
-                        pollutants=pollutants,
-                        last_update=result.get("lastUpdated", datetime.utcnow().isoformat())
-                    )
-                    stations.append(station)
-            
-            return stations
+        return await response_cache.respond(
+            request,
+            ("stations_by_country", country, limit),
+            lambda: fetch_stations_by_country(country, limit),
+            ttl=STATIONS_BY_COUNTRY_TTL,
+            cache_control=f"public, max-age={int(STATIONS_BY_COUNTRY_TTL)}"
+        )
             
     except Exception as e:
         print(f"Error fetching stations by country: {e}")
         return []
 
-@app.get("/api/station/{station_id}")
+async def fetch_stations_by_country(country: str, limit: int) -> List[StationData]:
+    # Use the latest measurements endpoint with country filter
+    params = {
+        "limit": limit,
+        "country": country,
+        "order_by": "lastUpdated",
+        "sort": "desc"
+    }
+
+    status, data = await upstream.get_json("openaq", "/v3/latest", params)
+    
+    if status != 200:
+        print(f"OpenAQ API error: {status} - {data}")
+        raise UpstreamUnavailable(f"OpenAQ returned {status}")
+    
+    page = parse_latest(data)
+    stations = [StationData(**record) for record in page.records()]
+    
+    register_stations(stations)
+    return stations
+
+@router.get("/api/stations/bbox", response_model=List[StationData])
+async def get_stations_in_bbox(lat_min: float, lat_max: float, lon_min: float, lon_max: float):
+    """Get known stations inside a bounding box (served from the registry)"""
+    if not len(station_registry):
+        await get_stations()
+    return station_registry.within_bbox(lat_min, lat_max, lon_min, lon_max)
+
+async def refresh_station_feed():
+    """Poll the default snapshot so its background refresh (and publish) keeps running"""
+    while True:
+        await asyncio.sleep(STATION_FEED_REFRESH_INTERVAL)
+        if len(station_feed):
+            try:
+                await get_stations()
+            except Exception as e:
+                print(f"Station feed refresh error: {e}")
+
+def feed_bbox(lat_min: Optional[float], lat_max: Optional[float],
+              lon_min: Optional[float], lon_max: Optional[float]) -> Optional[tuple]:
+    bounds = (lat_min, lat_max, lon_min, lon_max)
+    if all(b is None for b in bounds):
+        return None
+    if any(b is None for b in bounds):
+        raise ValueError("bbox needs lat_min, lat_max, lon_min and lon_max")
+    return tuple(float(b) for b in bounds)
+
+async def subscribe_station_feed(bbox: Optional[tuple]):
+    """Subscribe to the live feed, loading stations first if none are known yet"""
+    if not len(station_registry):
+        await get_stations()
+    return station_feed.subscribe(bbox)
+
+@router.websocket("/ws/stations")
+async def stations_websocket(websocket: WebSocket, lat_min: Optional[float] = None, lat_max: Optional[float] = None,
+                             lon_min: Optional[float] = None, lon_max: Optional[float] = None):
+    """
+    Live station updates: a snapshot first, then only changed stations.
+    
+    Subscribe to a bbox with query parameters, or at any time by sending
+    {"bbox": [lat_min, lat_max, lon_min, lon_max]} ({"bbox": null} for all).
+    """
+    try:
+        bbox = feed_bbox(lat_min, lat_max, lon_min, lon_max)
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = await subscribe_station_feed(bbox)
+    
+    async def receive_bbox():
+        while True:
+            message = await websocket.receive_json()
+            if isinstance(message, dict) and "bbox" in message:
+                box = message["bbox"]
+                try:
+                    subscription.resubscribe(feed_bbox(*box) if box is not None else None)
+                except (TypeError, ValueError):
+                    await websocket.send_json({"type": "error", "detail": "bbox must be [lat_min, lat_max, lon_min, lon_max]"})
+    
+    async def send_updates():
+        while True:
+            await websocket.send_text(await subscription.next_message())
+    
+    tasks = [asyncio.create_task(receive_bbox()), asyncio.create_task(send_updates())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and not isinstance(task.exception(), WebSocketDisconnect):
+                print(f"Station websocket error: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        station_feed.unsubscribe(subscription)
+
+@router.get("/api/stations/stream")
+async def stations_stream(request: Request, lat_min: Optional[float] = None, lat_max: Optional[float] = None,
+                          lon_min: Optional[float] = None, lon_max: Optional[float] = None):
+    """Server-Sent Events version of /ws/stations for one fixed bbox"""
+    try:
+        bbox = feed_bbox(lat_min, lat_max, lon_min, lon_max)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def events():
+        # Subscribe only once the response is streaming: a generator that never
+        # starts never reaches the finally that unsubscribes
+        subscription = await subscribe_station_feed(bbox)
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscription.next_message(), STATION_FEED_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            station_feed.unsubscribe(subscription)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/api/stations/nearest")
+async def get_nearest_stations(lat: float, lon: float, k: int = 5):
+    """Get the k known stations nearest to a point (served from the registry)"""
+    if not len(station_registry):
+        await get_stations()
+    return [
+        {"station": station, "distance_km": round(distance, 3)}
+        for station, distance in station_registry.nearest(lat, lon, min(k, 100))
+    ]
+
+async def find_station(station_id: str) -> Optional[StationData]:
+    """Look a station up by id, loading the station snapshot if it is unknown"""
+    station = station_registry.get(station_id)
+    if station is None:
+        stations = await get_stations()
+        station = station_registry.get(station_id) or next((s for s in stations if s.station_id == station_id), None)
+    return station
+
+@router.get("/api/station/{station_id}")
 async def get_station_details(station_id: str):
     """Get detailed information for a specific station"""
-    stations = await get_stations()
-    station = next((s for s in stations if s.station_id == station_id), None)
+    station = await find_station(station_id)
     
     if not station:
         raise HTTPException(status_code=404, detail="Station not found")
     
     return station
 
-@app.get("/api/weather")
-async def get_weather(lat: float, lon: float):
-    """Get weather data from OpenWeatherMap"""
-    api_key = OPENWEATHER_API_KEY
+def weather_cell(lat: float, lon: float) -> tuple:
+    """Grid cell shared by all coordinates within WEATHER_GRID_DEG of each other"""
+    return (round(lat / WEATHER_GRID_DEG), round(lon / WEATHER_GRID_DEG))
+
+def weather_api_configured() -> bool:
+    # The replay stand-in serves weather fixtures without a real key
+    if UPSTREAM_MODE == "replay":
+        return True
+    return bool(OPENWEATHER_API_KEY) and OPENWEATHER_API_KEY != "your_openweather_api_key_here"
+
+async def fetch_weather(cell: tuple) -> WeatherData:
+    """Fetch current weather for the center of a grid cell from OpenWeatherMap"""
+    status, data = await upstream.get_json(
+        "openweather",
+        "/data/2.5/weather",
+        params={
+            "lat": round(cell[0] * WEATHER_GRID_DEG, 4),
+            "lon": round(cell[1] * WEATHER_GRID_DEG, 4),
+            "appid": OPENWEATHER_API_KEY,
+            "units": "metric"
+        }
+    )
+    
+    if status != 200:
+        raise UpstreamUnavailable(f"OpenWeather returned {status}")
+    return WeatherData(
+        temperature=data["main"]["temp"],
+        humidity=data["main"]["humidity"],
+        wind_speed=data["wind"]["speed"],
+        wind_direction=data["wind"].get("deg", 0),
+        pressure=data["main"]["pressure"]
+    )
+
+async def prefetch_weather(stations: List[StationData]):
+    """Warm the weather cache for every station cell with bounded parallelism"""
+    if not weather_api_configured():
+        return
     
-    if not api_key or api_key == "your_openweather_api_key_here":
+    cells = {weather_cell(s.latitude, s.longitude) for s in stations}
+    stale = []
+    for cell in cells:
+        age = weather_cache.age(cell)
+        if age is None or age >= WEATHER_CACHE_TTL:
+            stale.append(cell)
+    semaphore = asyncio.Semaphore(WEATHER_BATCH_CONCURRENCY)
+    
+    async def warm(cell):
+        async with semaphore:
+            await weather_cache.get(cell, lambda: fetch_weather(cell))
+    
+    results = await asyncio.gather(*(warm(cell) for cell in stale), return_exceptions=True)
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    if failed:
+        print(f"Weather prefetch: {failed}/{len(stale)} cells failed")
+
+def schedule_weather_prefetch(stations: List[StationData]):
+    """Refresh weather for a new station snapshot without blocking the caller"""
+    if weather_api_configured() and stations:
+        task = asyncio.create_task(prefetch_weather(stations))
+        weather_prefetches.add(task)
+        task.add_done_callback(weather_prefetch_done)
+
+def weather_prefetch_done(task: asyncio.Task):
+    weather_prefetches.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Weather prefetch error: {task.exception()}")
+
+@router.get("/api/weather")
+async def get_weather(lat: float, lon: float):
+    """Get weather data from OpenWeatherMap (cached per grid cell)"""
+    if not weather_api_configured():
         # Return mock weather data
-        import random
+        rng = mock_random()
         return WeatherData(
-            temperature=random.uniform(15, 30),
-            humidity=random.uniform(40, 80),
-            wind_speed=random.uniform(2, 15),
-            wind_direction=random.randint(0, 360),
-            pressure=random.uniform(1010, 1020)
+            temperature=rng.uniform(15, 30),
+            humidity=rng.uniform(40, 80),
+            wind_speed=rng.uniform(2, 15),
+            wind_direction=rng.randint(0, 360),
+            pressure=rng.uniform(1010, 1020)
         )
     
+    cell = weather_cell(lat, lon)
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"https://api.openweathermap.org/data/2.5/weather",
-                params={
-                    "lat": lat,
-                    "lon": lon,
-                    "appid": api_key,
-                    "units": "metric"
-                }
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return WeatherData(
-                    temperature=data["main"]["temp"],
-                    humidity=data["main"]["humidity"],
-                    wind_speed=data["wind"]["speed"],
-                    wind_direction=data["wind"]["deg"],
-                    pressure=data["main"]["pressure"]
-                )
+        return await weather_cache.get(cell, lambda: fetch_weather(cell))
     except Exception as e:
         print(f"Error fetching weather: {e}")
     
     raise HTTPException(status_code=500, detail="Failed to fetch weather data")
 
-@app.get("/api/history/{station_id}")
-async def get_station_history(station_id: str, days: int = 7):
-    """Get historical data for a station (mock data for now)"""
-    import random
-    from datetime import datetime, timedelta
-    
-    # Generate mock historical data
-    history = []
+def record_station_history(stations: List[StationData]) -> int:
+    """Append one snapshot of station readings to the history store"""
+    rows = []
     now = datetime.utcnow()
+    for station in stations:
+        values = dict(station.pollutants)
+        values["aqi"] = station.aqi
+        try:
+            to_hour(station.last_update)
+            timestamp = station.last_update
+        except (TypeError, ValueError):
+            timestamp = now
+        rows.append((station.station_id, timestamp, values))
+    feature_state.observe_many(rows)
+    return history_store.append(rows)
+
+async def poll_station_history():
+    """Every HISTORY_POLL_INTERVAL seconds, store the latest reading of every known station"""
+    try:
+        seeded = await asyncio.to_thread(feature_state.load_history, history_store)
+        print(f"History poller: loaded model features for {seeded} stations")
+    except Exception as e:
+        print(f"History poller: could not load model features: {e}")
+    while True:
+        try:
+            # Refreshes the default snapshot; the registry only holds real stations
+            await get_stations()
+            stations = station_registry.all()
+            if stations:
+                written = await asyncio.to_thread(record_station_history, stations)
+                print(f"History poller: stored {written} station readings")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"History poller error: {e}")
+        await asyncio.sleep(HISTORY_POLL_INTERVAL)
+
+def parse_time(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} timestamp: {value}")
+    return parsed.replace(tzinfo=None) - (parsed.utcoffset() or timedelta(0))
+
+def check_downsampling(max_points: Optional[int], downsample: str):
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+    if downsample not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"downsample must be one of {', '.join(DOWNSAMPLE_METHODS)}")
+
+def shape_series(columns: dict) -> np.ndarray:
+    """The series downsampling preserves: AQI, with PM2.5 filling hours without one"""
+    aqi_values = np.asarray(columns.get("aqi", []), dtype=float)
+    if "pm25" in columns:
+        aqi_values = np.where(np.isnan(aqi_values), np.asarray(columns["pm25"], dtype=float), aqi_values)
+    return aqi_values
+
+@router.get("/api/history/{station_id}")
+async def get_station_history(station_id: str, days: int = 7, start: Optional[str] = None, end: Optional[str] = None,
+                              max_points: Optional[int] = None, downsample: str = "lttb"):
+    """
+    Get hourly historical data for a station.
+    
+    The range is [start, end) in UTC, defaulting to the last `days` days.
+    Data comes from the local history store; stations without stored
+    readings get mock data, marked with "source": "mock".
+    With max_points, the series is reduced server-side with LTTB (or
+    per-bucket min/max with downsample=minmax), keeping its AQI shape.
+    """
+    check_downsampling(max_points, downsample)
+    end_time = parse_time(end, "end") or datetime.utcnow()
+    start_time = parse_time(start, "start") or end_time - timedelta(days=days)
+    if start_time >= end_time:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    if history_store is not None:
+        hours, columns = await asyncio.to_thread(history_store.query, station_id, start_time, end_time)
+        if len(hours):
+            keep = downsample_indices(hours, shape_series(columns), max_points, downsample)
+            if len(keep) < len(hours):
+                hours = hours[keep]
+                columns = {name: values[keep] for name, values in columns.items()}
+            return {"station_id": station_id, "source": "store", "data": history_records(hours, columns)}
     
-    # Generate data points every hour for the specified days
-    for i in range(days * 24):
-        timestamp = now - timedelta(hours=days * 24 - i)
-        base_pm25 = 50 + 30 * (i / (days * 24))  # Gradual increase
-        noise = random.uniform(-20, 20)
+    history = mock_station_history(start_time, end_time)
+    if max_points is not None and len(history) > max_points:
+        series = shape_series({"aqi": [point["aqi"] for point in history]})
+        keep = downsample_indices(np.arange(len(history)), series, max_points, downsample)
+        history = [history[i] for i in keep.tolist()]
+    return {"station_id": station_id, "source": "mock", "data": history}
+
+def history_records(hours: np.ndarray, columns: dict) -> List[dict]:
+    """Columnar store output as one dict per hour, leaving out missing fields"""
+    names = [name for name in HISTORY_FIELDS if not np.isnan(columns[name]).all()]
+    values = [(name, np.round(columns[name].astype(float), 4).tolist()) for name in names]
+    records = []
+    for i, hour in enumerate(hours.tolist()):
+        point = {"timestamp": hour_to_iso(hour)}
+        for name, column in values:
+            value = column[i]
+            if value == value:  # skip NaN
+                point[name] = int(value) if name == "aqi" else value
+        records.append(point)
+    return records
+
+def mock_station_history(start_time: datetime, end_time: datetime) -> List[dict]:
+    """Hourly mock readings with a gradual upward trend"""
+    rng = mock_random()
+    n = int((end_time - start_time).total_seconds() // 3600)
+    
+    # Generate data points every hour for the requested range
+    history = []
+    for i in range(n):
+        timestamp = start_time + timedelta(hours=i)
+        base_pm25 = 50 + 30 * (i / n)  # Gradual increase
+        noise = rng.uniform(-20, 20)
         pm25 = max(5, base_pm25 + noise)
         
         history.append({
             "timestamp": timestamp.isoformat(),
             "pm25": round(pm25, 2),
             "pm10": round(pm25 * 1.5, 2),
-            "no2": round(random.uniform(20, 80), 2),
-            "o3": round(random.uniform(30, 100), 2),
-            "aqi": calculate_aqi_pm25(pm25)
+            "no2": round(rng.uniform(20, 80), 2),
+            "o3": round(rng.uniform(30, 100), 2),
         })
     
-    return {"station_id": station_id, "data": history}
+    if not history:
+        return history
+    
+    # AQI for the whole series in one vectorized pass
+    aqi_values, _ = compute_aqi(
+        {name: np.array([point[name] for point in history]) for name in MOCK_UNITS},
+        MOCK_UNITS
+    )
+    for point, value in zip(history, aqi_values.tolist()):
+        point["aqi"] = int(value)
+    
+    return history
 
-@app.options("/api/send-notification")
+@router.options("/api/send-notification")
 async def options_send_notification():
     """Handle CORS preflight requests"""
     return {"message": "OK"}
 
-@app.post("/api/test-simple")
+@router.post("/api/test-simple")
 async def test_simple():
     """Simple test endpoint"""
     return {"message": "Test successful", "status": "ok"}
 
-@app.post("/api/send-notification")
+@router.post("/api/send-notification")
 async def send_notification(request: NotificationRequest):
     """Send personalized air quality notification email"""
     try:
@@ -528,21 +913,71 @@ async def send_notification(request: NotificationRequest):
         print(f"Tipo de error: {type(e).__name__}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
-# Include prediction endpoints
-from predict_api import router as predict_router
-from simple_advanced_api import router as advanced_router
-from prediction_layer_api import router as prediction_layer_router
-from prediction_charts_api import router as prediction_charts_router
-app.include_router(predict_router)
+def mark_startup_complete():
+    global startup_complete
+    startup_complete = True
 
-# Include TEMPO satellite data endpoints
-from tempo_api import router as tempo_router
-app.include_router(tempo_router)
-app.include_router(advanced_router)
-app.include_router(prediction_layer_router)
-app.include_router(prediction_charts_router)
+def create_app() -> FastAPI:
+    """
+    Build the application.
+
+    Feature routers only import pandas, scikit-learn, joblib and plotly when
+    they are first used, and models load in the background after startup,
+    so the server accepts connections within a second of starting.
+    """
+    application = FastAPI(title="AirGuardian API", version="1.0.0")
+
+    # CORS configuration
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:5173", "http://localhost:3000", "http://127.0.0.1:5173", "http://127.0.0.1:3000"],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+        expose_headers=["ETag"],
+    )
+
+    # Compress other large responses on the fly (cached responses are stored pre-compressed)
+    application.add_middleware(
+        StreamingAwareGZipMiddleware,
+        exclude_paths=["/api/stations/stream"],
+        minimum_size=RESPONSE_COMPRESSION_MIN_SIZE,
+        compresslevel=RESPONSE_GZIP_LEVEL,
+    )
+
+    # Slow-request and ?profile=1 stack sampling
+    application.add_middleware(
+        profiler.ProfilingMiddleware,
+        sampler=profiler.sampler,
+        store=profiler.profile_store,
+        threshold_ms=PROFILE_SLOW_REQUEST_MS,
+        exclude_paths=["/api/stations/stream"],
+    )
+
+    # Outermost, so timings include compression
+    if METRICS_ENABLED:
+        application.add_middleware(metrics.MetricsMiddleware, exclude_paths=["/api/stations/stream"])
+
+    from predict_api import router as predict_router
+    from tempo_api import router as tempo_router
+    from advanced_api import router as advanced_router
+    from prediction_layer_api import router as prediction_layer_router
+    from prediction_charts_api import router as prediction_charts_router
+    application.include_router(router)
+    application.include_router(predict_router)
+    application.include_router(tempo_router)
+    application.include_router(advanced_router)
+    application.include_router(prediction_layer_router)
+    application.include_router(prediction_charts_router)
+    application.include_router(profiler.router)
+    application.include_router(model_registry.router)
+
+    # Runs after every router's startup handlers
+    application.add_event_handler("startup", mark_startup_complete)
+    return application
+
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
-
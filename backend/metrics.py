@@ -0,0 +1,197 @@
+"""
+Prometheus metrics for the API
+
+Exposed in the Prometheus text format at /metrics:
+
+- airguardian_http_requests_total / airguardian_http_request_duration_seconds:
+  per method, route template and status
+- airguardian_upstream_request_duration_seconds, airguardian_upstream_bytes_total,
+  airguardian_upstream_errors_total: per upstream (openaq, openweather, smtp)
+- airguardian_model_inference_seconds / airguardian_model_batch_rows: per model
+- airguardian_cache_requests_total / airguardian_cache_entries: per named cache,
+  read from the caches' own counters at scrape time
+- airguardian_event_loop_lag_seconds: how late the event loop wakes up a timer
+
+Metrics live in the default registry of the process. With several uvicorn
+workers each worker reports its own values.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Optional
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+HTTP_REQUESTS = Counter(
+    "airguardian_http_requests_total", "HTTP requests handled",
+    ["method", "route", "status"],
+)
+HTTP_LATENCY = Histogram(
+    "airguardian_http_request_duration_seconds", "Time to handle an HTTP request",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_LATENCY = Histogram(
+    "airguardian_upstream_request_duration_seconds", "Duration of calls to upstream services",
+    ["upstream"], buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_BYTES = Counter(
+    "airguardian_upstream_bytes_total", "Payload bytes exchanged with upstream services",
+    ["upstream", "direction"],
+)
+UPSTREAM_ERRORS = Counter(
+    "airguardian_upstream_errors_total", "Failed upstream calls (error statuses, timeouts, connection errors)",
+    ["upstream", "kind"],
+)
+MODEL_INFERENCE = Histogram(
+    "airguardian_model_inference_seconds", "Duration of one model predict call",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+MODEL_BATCH_ROWS = Histogram(
+    "airguardian_model_batch_rows", "Feature rows per model predict call",
+    ["model"], buckets=BATCH_BUCKETS,
+)
+EVENT_LOOP_LAG = Histogram(
+    "airguardian_event_loop_lag_seconds", "Delay between a timer's due time and its callback running",
+    buckets=LAG_BUCKETS,
+)
+EVENT_LOOP_LAG_LAST = Gauge(
+    "airguardian_event_loop_lag_last_seconds", "Most recent event loop lag sample",
+)
+
+
+def record_upstream(upstream: str, seconds: float, status: Optional[int] = None,
+                    received: int = 0, sent: int = 0):
+    """Record one completed upstream call; a status of 400 or more counts as an error"""
+    UPSTREAM_LATENCY.labels(upstream).observe(seconds)
+    if received:
+        UPSTREAM_BYTES.labels(upstream, "received").inc(received)
+    if sent:
+        UPSTREAM_BYTES.labels(upstream, "sent").inc(sent)
+    if status is not None and status >= 400:
+        UPSTREAM_ERRORS.labels(upstream, "status").inc()
+
+
+def record_upstream_error(upstream: str, kind: str):
+    """Record an upstream call that failed without a response (timeout, connection, ...)"""
+    UPSTREAM_ERRORS.labels(upstream, kind).inc()
+
+
+@contextmanager
+def observe_inference(model: str, rows: int):
+    """Time one predict call on rows feature rows"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        MODEL_INFERENCE.labels(model).observe(time.perf_counter() - start)
+        MODEL_BATCH_ROWS.labels(model).observe(rows)
+
+
+class CacheCollector:
+    """
+    Exports hit/miss counters of registered caches at scrape time.
+
+    A cache exposes integer attributes named after the results it counts
+    (hits, misses, and optionally stale or not_modified), so the hot path
+    only increments a plain attribute.
+    """
+
+    RESULTS = {"hits": "hit", "misses": "miss", "stale": "stale", "not_modified": "not_modified"}
+
+    def __init__(self):
+        self._caches: Dict[str, Any] = {}
+
+    def register(self, name: str, cache: Any):
+        self._caches[name] = cache
+
+    def collect(self) -> Iterable:
+        requests = CounterMetricFamily("airguardian_cache_requests", "Cache lookups by result",
+                                       labels=["cache", "result"])
+        entries = GaugeMetricFamily("airguardian_cache_entries", "Entries held by the cache", labels=["cache"])
+        for name, cache in self._caches.items():
+            for attribute, result in self.RESULTS.items():
+                value = getattr(cache, attribute, None)
+                if value is not None:
+                    requests.add_metric([name, result], value)
+            entries.add_metric([name], len(cache))
+        yield requests
+        yield entries
+
+
+caches = CacheCollector()
+REGISTRY.register(caches)
+
+
+def register_cache(name: str, cache: Any):
+    caches.register(name, cache)
+
+
+async def monitor_event_loop(interval: float):
+    """Sleep interval seconds in a loop and record how late each wake-up is"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """
+    Count and time HTTP requests per route template.
+
+    The route label is the matched path template (e.g. /api/predict/{station_id}),
+    so path parameters do not create new series; unmatched paths share the
+    label "unmatched". Paths in exclude_paths (long-lived streams) are not
+    recorded.
+    """
+
+    def __init__(self, app: ASGIApp, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+        self._templates: Dict[Callable, str] = {}
+
+    def _route(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        template = self._templates.get(endpoint)
+        if template is None:
+            template = "unmatched"
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    template = route.path
+                    break
+            self._templates[endpoint] = template
+        return template
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            labels = (scope["method"], self._route(scope), str(status))
+            HTTP_REQUESTS.labels(*labels).inc()
+            HTTP_LATENCY.labels(*labels).observe(time.perf_counter() - start)
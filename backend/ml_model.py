@@ -3,19 +3,31 @@ Machine Learning model for air quality prediction
 """
 import numpy as np
 import pandas as pd
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
 from datetime import datetime, timedelta
 import pickle
 import os
+from aqi import compute_aqi
+from metrics import observe_inference
+from config import MODEL_MMAP
+from forest_arrays import load_or_export
+
+# Model inputs, in training column order
+FEATURE_COLUMNS = [
+    'hour_sin', 'hour_cos', 'month_sin', 'month_cos', 'is_weekend',
+    'pm25', 'pm10', 'no2', 'o3',
+    'temperature', 'humidity', 'wind_speed', 'pressure',
+    'pm25_lag_1h', 'pm25_lag_3h', 'pm25_lag_6h', 'pm25_lag_24h',
+    'pm25_rolling_mean_6h', 'pm25_rolling_std_6h', 'pm25_rolling_mean_24h'
+]
 
 class AirQualityPredictor:
-    def __init__(self):
+    def __init__(self, model_dir="model"):
         self.model = None
-        self.scaler = StandardScaler()
-        self.model_path = "model/aqi_model.pkl"
-        self.scaler_path = "model/scaler.pkl"
+        self.scaler = None
+        self.model_path = os.path.join(model_dir, "aqi_model.pkl")
+        self.scaler_path = os.path.join(model_dir, "scaler.pkl")
+        # Memory-mapped export of the two pickles, shared by all workers
+        self.packed_path = os.path.join(model_dir, "aqi_model.forest")
         
     def create_features(self, df):
         """Create features from raw data"""
@@ -70,32 +82,25 @@ class AirQualityPredictor:
         
         df = pd.DataFrame(data)
         
-        # Calculate AQI from PM2.5
-        def calculate_aqi(pm25):
-            if pm25 <= 12.0:
-                return (50 / 12.0) * pm25
-            elif pm25 <= 35.4:
-                return 50 + ((100 - 50) / (35.4 - 12.1)) * (pm25 - 12.1)
-            elif pm25 <= 55.4:
-                return 100 + ((150 - 100) / (55.4 - 35.5)) * (pm25 - 35.5)
-            elif pm25 <= 150.4:
-                return 150 + ((200 - 150) / (150.4 - 55.5)) * (pm25 - 55.5)
-            elif pm25 <= 250.4:
-                return 200 + ((300 - 200) / (250.4 - 150.5)) * (pm25 - 150.5)
-            else:
-                return 300 + ((500 - 300) / (500.4 - 250.5)) * (pm25 - 250.5)
-        
-        df['aqi'] = df['pm25'].apply(calculate_aqi)
-        
         # Add some temporal patterns
         hours = pd.to_datetime(df['timestamp']).dt.hour
         df['pm25'] += 20 * np.sin(2 * np.pi * hours / 24)  # Daily pattern
-        df['aqi'] = df['pm25'].apply(calculate_aqi)
+        
+        # Overall AQI over all pollutants, vectorized (values in µg/m³)
+        aqi_values, _ = compute_aqi(
+            {col: df[col].to_numpy() for col in ['pm25', 'pm10', 'no2', 'o3']},
+            {col: "µg/m³" for col in ['pm25', 'pm10', 'no2', 'o3']}
+        )
+        df['aqi'] = aqi_values
         
         return df
     
     def train(self, df=None):
         """Train the prediction model"""
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.model_selection import train_test_split
+        from sklearn.preprocessing import StandardScaler
+        
         if df is None:
             print("Generating synthetic training data...")
             df = self.generate_synthetic_data()
@@ -108,17 +113,8 @@ class AirQualityPredictor:
         # Drop rows with NaN values (from lag features)
         df = df.dropna()
         
-        # Select features for training
-        feature_cols = [
-            'hour_sin', 'hour_cos', 'month_sin', 'month_cos', 'is_weekend',
-            'pm25', 'pm10', 'no2', 'o3',
-            'temperature', 'humidity', 'wind_speed', 'pressure',
-            'pm25_lag_1h', 'pm25_lag_3h', 'pm25_lag_6h', 'pm25_lag_24h',
-            'pm25_rolling_mean_6h', 'pm25_rolling_std_6h', 'pm25_rolling_mean_24h'
-        ]
-        
-        # Filter out features that don't exist in the dataframe
-        feature_cols = [col for col in feature_cols if col in df.columns]
+        # Select features for training (filter out features that don't exist in the dataframe)
+        feature_cols = [col for col in FEATURE_COLUMNS if col in df.columns]
         
         X = df[feature_cols]
         y = df['aqi']
@@ -129,6 +125,7 @@ class AirQualityPredictor:
         )
         
         # Scale features
+        self.scaler = StandardScaler()
         X_train_scaled = self.scaler.fit_transform(X_train)
         X_test_scaled = self.scaler.transform(X_test)
         
@@ -159,7 +156,7 @@ class AirQualityPredictor:
     
     def save_model(self):
         """Save trained model to disk"""
-        os.makedirs("model", exist_ok=True)
+        os.makedirs(os.path.dirname(self.model_path) or ".", exist_ok=True)
         
         with open(self.model_path, 'wb') as f:
             pickle.dump(self.model, f)
@@ -168,15 +165,41 @@ class AirQualityPredictor:
             pickle.dump(self.scaler, f)
         
         print(f"Model saved to {self.model_path}")
+        
+        if MODEL_MMAP:
+            # Export the fitted model and serve from the shared mapping from now on
+            model, scaler = self.model, self.scaler
+            self.load_packed(lambda: (model, scaler, {}))
+    
+    def _load_pickles(self):
+        with open(self.model_path, 'rb') as f:
+            model = pickle.load(f)
+        with open(self.scaler_path, 'rb') as f:
+            scaler = pickle.load(f)
+        return model, scaler, {}
+    
+    def load_packed(self, load_source=None):
+        """Memory-map the packed model, exporting it from the pickles first if it is out of date"""
+        self.model, self.scaler, _ = load_or_export(self.packed_path, self.model_path,
+                                                    load_source or self._load_pickles)
+    
+    def load_artifacts(self):
+        """Load the saved model without training; raises FileNotFoundError if there is none"""
+        if MODEL_MMAP:
+            try:
+                self.load_packed()
+                return
+            except FileNotFoundError:
+                if not os.path.exists(self.model_path):
+                    raise
+                # The export could not be read; the pickles are still there
+                print("Packed model not available, loading the pickles instead")
+        self.model, self.scaler, _ = self._load_pickles()
     
     def load_model(self):
         """Load trained model from disk"""
         try:
-            with open(self.model_path, 'rb') as f:
-                self.model = pickle.load(f)
-            
-            with open(self.scaler_path, 'rb') as f:
-                self.scaler = pickle.load(f)
+            self.load_artifacts()
             
             print("Model loaded successfully")
             return True
@@ -193,71 +216,118 @@ class AirQualityPredictor:
         if self.model is None:
             self.load_model()
         
-        features_scaled = self.scaler.transform(features)
-        predictions = self.model.predict(features_scaled)
+        with observe_inference("aqi", len(features)):
+            features_scaled = self.scaler.transform(features)
+            predictions = self.model.predict(features_scaled)
         
         return predictions
     
     def predict_future(self, current_data, hours_ahead=48):
         """Predict AQI for future timestamps"""
-        if self.model is None:
-            self.load_model()
+        # The whole horizon is one feature matrix and one model call
+        return self.predict_batch([current_data], hours_ahead)[0]
+
+    def horizon_features(self, current_data, hours_ahead=48):
+        """
+        Feature rows for hours 1..hours_ahead after current_data['timestamp'].
         
-        predictions = []
+        Returns (timestamps, matrix) with one row per future hour and the
+        columns in FEATURE_COLUMNS order.
+        """
         last_timestamp = datetime.fromisoformat(current_data['timestamp'])
-        
-        # Simple prediction: use current values and project forward
-        for hour in range(1, hours_ahead + 1):
-            future_time = last_timestamp + timedelta(hours=hour)
-            
-            # Create feature vector
-            hour_val = future_time.hour
-            month_val = future_time.month
-            day_of_week = future_time.weekday()
-            
-            # Mock feature values (in real scenario, use weather forecasts)
-            features = {
-                'hour_sin': np.sin(2 * np.pi * hour_val / 24),
-                'hour_cos': np.cos(2 * np.pi * hour_val / 24),
-                'month_sin': np.sin(2 * np.pi * month_val / 12),
-                'month_cos': np.cos(2 * np.pi * month_val / 12),
-                'is_weekend': 1 if day_of_week >= 5 else 0,
-                'pm25': current_data.get('pm25', 30),
-                'pm10': current_data.get('pm10', 45),
-                'no2': current_data.get('no2', 40),
-                'o3': current_data.get('o3', 50),
-                'temperature': current_data.get('temperature', 20),
-                'humidity': current_data.get('humidity', 60),
-                'wind_speed': current_data.get('wind_speed', 5),
-                'pressure': current_data.get('pressure', 1013),
-                'pm25_lag_1h': current_data.get('pm25', 30),
-                'pm25_lag_3h': current_data.get('pm25', 30),
-                'pm25_lag_6h': current_data.get('pm25', 30),
-                'pm25_lag_24h': current_data.get('pm25', 30),
-                'pm25_rolling_mean_6h': current_data.get('pm25', 30),
-                'pm25_rolling_std_6h': 5.0,
-                'pm25_rolling_mean_24h': current_data.get('pm25', 30),
-            }
-            
-            # Convert to DataFrame
-            df_features = pd.DataFrame([features])
-            
-            # Predict
-            aqi_pred = self.predict(df_features)[0]
-            
-            # Add some uncertainty
-            confidence = max(0.5, 1.0 - (hour / hours_ahead) * 0.5)
-            
-            predictions.append({
-                'timestamp': future_time.isoformat(),
-                'aqi': int(max(0, min(500, aqi_pred))),
-                'confidence': round(confidence, 2)
-            })
-        
-        return predictions
+        timestamps = [last_timestamp + timedelta(hours=hour) for hour in range(1, hours_ahead + 1)]
+        
+        # Calendar fields from wall-clock datetime64 values (the offset of an
+        # aware timestamp is fixed, so adding hours never changes it)
+        wall = np.datetime64(last_timestamp.replace(tzinfo=None)) + np.arange(1, hours_ahead + 1).astype('m8[h]')
+        days = wall.astype('M8[D]')
+        hour_val = (wall.astype('M8[h]') - days).astype(float)
+        month_val = (wall.astype('M8[M]').astype(np.int64) % 12 + 1).astype(float)
+        # 1970-01-01 was a Thursday (weekday 3)
+        day_of_week = (days.astype(np.int64) + 3) % 7
+        is_weekend = (day_of_week >= 5).astype(float)
+        
+        # Mock projection: current values held constant (in real scenario, use weather forecasts).
+        # Lag and rolling features come from the station's history when the
+        # caller has it, and fall back to the current value otherwise
+        pm25 = current_data.get('pm25', 30)
+        constants = {
+            'pm25': pm25,
+            'pm10': current_data.get('pm10', 45),
+            'no2': current_data.get('no2', 40),
+            'o3': current_data.get('o3', 50),
+            'temperature': current_data.get('temperature', 20),
+            'humidity': current_data.get('humidity', 60),
+            'wind_speed': current_data.get('wind_speed', 5),
+            'pressure': current_data.get('pressure', 1013),
+            'pm25_lag_1h': current_data.get('pm25_lag_1h', pm25),
+            'pm25_lag_3h': current_data.get('pm25_lag_3h', pm25),
+            'pm25_lag_6h': current_data.get('pm25_lag_6h', pm25),
+            'pm25_lag_24h': current_data.get('pm25_lag_24h', pm25),
+            'pm25_rolling_mean_6h': current_data.get('pm25_rolling_mean_6h', pm25),
+            'pm25_rolling_std_6h': current_data.get('pm25_rolling_std_6h', 5.0),
+            'pm25_rolling_mean_24h': current_data.get('pm25_rolling_mean_24h', pm25),
+        }
+        columns = {
+            'hour_sin': np.sin(2 * np.pi * hour_val / 24),
+            'hour_cos': np.cos(2 * np.pi * hour_val / 24),
+            'month_sin': np.sin(2 * np.pi * month_val / 12),
+            'month_cos': np.cos(2 * np.pi * month_val / 12),
+            'is_weekend': is_weekend,
+        }
+        matrix = np.empty((hours_ahead, len(FEATURE_COLUMNS)))
+        for i, name in enumerate(FEATURE_COLUMNS):
+            matrix[:, i] = columns[name] if name in columns else constants[name]
+        return timestamps, matrix
+    
+    def predict_batch(self, current_rows, hours_ahead=48):
+        """
+        Forecast many stations with a single model call.
+        
+        current_rows holds one predict_future-style input dict per station.
+        All (station x hour) feature rows are stacked into one matrix, scaled
+        and predicted at once, and split back into one forecast list per
+        station, in the format predict_future returns.
+        """
+        if self.model is None:
+            self.load_model()
+        if not current_rows or hours_ahead <= 0:
+            return [[] for _ in current_rows]
+        
+        blocks = [self.horizon_features(row, hours_ahead) for row in current_rows]
+        matrix = np.vstack([features for _, features in blocks])
+        # A scikit-learn scaler fitted on a DataFrame expects column names;
+        # the packed scaler takes the matrix as is
+        if hasattr(self.scaler, 'feature_names_in_'):
+            matrix = pd.DataFrame(matrix, columns=FEATURE_COLUMNS)
+        aqi_pred = self.predict(matrix)
+        aqi_pred = np.clip(aqi_pred, 0, 500).astype(int).reshape(len(current_rows), hours_ahead)
+        
+        # Add some uncertainty
+        confidence = [round(max(0.5, 1.0 - (hour / hours_ahead) * 0.5), 2) for hour in range(1, hours_ahead + 1)]
+        
+        forecasts = []
+        for (timestamps, _), station_pred in zip(blocks, aqi_pred.tolist()):
+            forecasts.append([
+                {'timestamp': t.isoformat(), 'aqi': aqi, 'confidence': c}
+                for t, aqi, c in zip(timestamps, station_pred, confidence)
+            ])
+        return forecasts
+
+    def publish(self, metrics=None):
+        """Publish the saved model files as a new version in the model registry"""
+        from model_registry import registry
+        files = {"aqi_model.pkl": self.model_path, "scaler.pkl": self.scaler_path}
+        return registry.publish("aqi", files, FEATURE_COLUMNS, ["aqi"], metrics)
 
 if __name__ == "__main__":
+    import sys
+    
     # Train model on startup
     predictor = AirQualityPredictor()
-    predictor.train()
+    score = predictor.train()
+    if "--publish" in sys.argv:
+        # Running servers pick up the new version without a restart
+        version = predictor.publish({"r2": float(score)})
+        print(f"Published model version {version.version}")
 
@@ -0,0 +1,99 @@
+"""
+Background model loading
+
+Models are loaded (or trained) in a worker thread after the server starts,
+so the API accepts connections and serves station data immediately.
+Endpoints that need a model call BackgroundModel.get(), which answers 503
+with a Retry-After header until the model is ready.
+
+Every BackgroundModel registers itself here; /health/ready reports their
+states.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional
+from fastapi import HTTPException
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+UNAVAILABLE = "unavailable"  # the loader found no model to load
+FAILED = "failed"
+
+models: Dict[str, "BackgroundModel"] = {}
+
+
+class BackgroundModel:
+    """A model produced by load() in a worker thread; load() may return None if there is no model"""
+
+    def __init__(self, name: str, load: Callable[[], Optional[Any]], retry_after: int = 5):
+        self.name = name
+        self._load = load
+        self.retry_after = retry_after
+        self.state = PENDING
+        self.value: Optional[Any] = None
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        models[name] = self
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def start(self):
+        """Begin loading in the background (once)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def wait(self) -> Optional[Any]:
+        """Start loading if needed and wait for it to finish"""
+        self.start()
+        await asyncio.shield(self._task)
+        return self.value
+
+    async def _run(self):
+        self.state = LOADING
+        start = time.perf_counter()
+        try:
+            value = await asyncio.to_thread(self._load)
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            print(f"Model {self.name} failed to load: {e}")
+            return
+        self.load_seconds = round(time.perf_counter() - start, 3)
+        if value is None:
+            self.state = UNAVAILABLE
+            print(f"Model {self.name} not available")
+            return
+        self.value = value
+        self.state = READY
+        print(f"Model {self.name} ready in {self.load_seconds:.2f}s")
+
+    def get(self) -> Any:
+        """The loaded model, or a 503 HTTPException while it is not ready"""
+        if self.state == READY:
+            return self.value
+        if self.state in (PENDING, LOADING):
+            detail = f"Model {self.name} is warming up"
+        else:
+            detail = f"Model {self.name} is not available"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+    def status(self) -> Dict[str, Any]:
+        status = {"state": self.state}
+        if self.load_seconds is not None:
+            status["load_seconds"] = self.load_seconds
+        if self.error:
+            status["error"] = self.error
+        return status
+
+
+def start_all():
+    for model in models.values():
+        model.start()
+
+
+def statuses() -> Dict[str, Dict[str, Any]]:
+    return {name: model.status() for name, model in models.items()}
@@ -0,0 +1,346 @@
+"""
+Versioned model registry with hot reload
+
+Each model has a directory of numbered versions under MODEL_REGISTRY_DIR:
+
+    <model>/v<N>/manifest.json      the version's manifest
+    <model>/v<N>/<artifact files>   pickles etc., as listed in the manifest
+
+The manifest records name, version and created_at, the feature schema
+(features: input columns in order), the outputs, evaluation metrics, the
+sha256 checksum and size of every artifact file, and optional extra model
+information (config). publish() (or `python model_registry.py publish`)
+writes a version into a staging directory and renames it into place, so a
+worker never sees half a version. The highest version number is the one
+to serve; deleting a version directory rolls back to the one before it.
+
+Every worker checks the registry every MODEL_REGISTRY_POLL_INTERVAL
+seconds, and on POST /api/models/reload. A new version is loaded,
+checksum-verified and validated in a worker thread while the current model
+keeps serving, then swapped in with a single assignment; requests already
+running finish on the model they started with. A version that fails is
+remembered and skipped, and the current model stays active. Until a model
+has a published version, it is loaded from its fixed path as before.
+GET /api/models shows the active version of every model.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from fastapi import APIRouter, Depends
+from admin_auth import require_admin
+from config import MODEL_REGISTRY_DIR, MODEL_REGISTRY_POLL_INTERVAL
+from model_loader import BackgroundModel, LOADING, PENDING, READY, models
+
+MANIFEST = "manifest.json"
+
+_VERSION_DIR = re.compile(r"^v(\d+)$")
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelVersion:
+    """One published version of a model: its directory and manifest"""
+
+    def __init__(self, name: str, version: int, path: str, manifest: Dict[str, Any]):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.manifest = manifest
+
+    @property
+    def features(self) -> List[str]:
+        return list(self.manifest.get("features", []))
+
+    @property
+    def outputs(self) -> List[str]:
+        return list(self.manifest.get("outputs", []))
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        return dict(self.manifest.get("metrics", {}))
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return dict(self.manifest.get("config", {}))
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "created_at": self.manifest.get("created_at"),
+            "features": len(self.features),
+            "outputs": self.outputs,
+            "metrics": self.metrics,
+            "files": {name: entry.get("sha256") for name, entry in self.manifest.get("files", {}).items()},
+        }
+
+
+class ModelRegistry:
+    """Numbered model versions in a directory tree"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def versions(self, name: str) -> List[ModelVersion]:
+        """Published versions of a model, oldest first; directories without a readable manifest are skipped"""
+        model_dir = os.path.join(self.directory, name)
+        if not os.path.isdir(model_dir):
+            return []
+        found = []
+        for entry in os.listdir(model_dir):
+            match = _VERSION_DIR.match(entry)
+            if not match:
+                continue
+            path = os.path.join(model_dir, entry)
+            try:
+                with open(os.path.join(path, MANIFEST)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            found.append(ModelVersion(name, int(match.group(1)), path, manifest))
+        return sorted(found, key=lambda version: version.version)
+
+    def latest(self, name: str, skip: Iterable[int] = ()) -> Optional[ModelVersion]:
+        """Highest published version not in skip"""
+        skip = set(skip)
+        candidates = [version for version in self.versions(name) if version.version not in skip]
+        return candidates[-1] if candidates else None
+
+    def verify(self, version: ModelVersion):
+        """Check every artifact against the manifest checksums; raises ValueError on a mismatch"""
+        files = version.manifest.get("files")
+        if not files:
+            raise ValueError("manifest lists no files")
+        for name, entry in files.items():
+            path = version.file(name)
+            if not os.path.isfile(path):
+                raise ValueError(f"{name} is missing")
+            if os.path.getsize(path) != entry.get("size") or _sha256(path) != entry.get("sha256"):
+                raise ValueError(f"{name} does not match its checksum")
+
+    def publish(self, name: str, files: Dict[str, str], features: List[str], outputs: List[str],
+                metrics: Optional[Dict[str, Any]] = None, config: Optional[Dict[str, Any]] = None) -> ModelVersion:
+        """
+        Copy files ({name in the version: source path}) into a new version.
+
+        The version becomes visible to workers in one rename, with its
+        manifest already written.
+        """
+        model_dir = os.path.join(self.directory, name)
+        os.makedirs(model_dir, exist_ok=True)
+        while True:
+            existing = self.versions(name)
+            number = existing[-1].version + 1 if existing else 1
+            staging = os.path.join(model_dir, f".staging-{os.getpid()}-{number}")
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            entries = {}
+            for target, source in files.items():
+                path = os.path.join(staging, target)
+                shutil.copyfile(source, path)
+                entries[target] = {"sha256": _sha256(path), "size": os.path.getsize(path)}
+            manifest = {
+                "name": name,
+                "version": number,
+                "created_at": datetime.utcnow().isoformat(),
+                "features": list(features),
+                "outputs": list(outputs),
+                "metrics": dict(metrics or {}),
+                "files": entries,
+                "config": dict(config or {}),
+            }
+            with open(os.path.join(staging, MANIFEST), "w") as f:
+                json.dump(manifest, f, indent=2)
+            path = os.path.join(model_dir, f"v{number}")
+            try:
+                os.rename(staging, path)
+            except OSError:
+                # Another publisher took this number; try the next one
+                shutil.rmtree(staging, ignore_errors=True)
+                if not os.path.isdir(path):
+                    raise
+                continue
+            return ModelVersion(name, number, path, manifest)
+
+
+registry = ModelRegistry(MODEL_REGISTRY_DIR)
+
+
+class VersionedModel(BackgroundModel):
+    """
+    A BackgroundModel served from registry versions.
+
+    load_version(version) builds the served value from a verified version
+    directory and validate(value, version) raises if the result is not
+    fit to serve. load_fallback() loads the model from its fixed path while
+    the registry has no usable version.
+    """
+
+    def __init__(self, name: str, load_version: Callable[[ModelVersion], Any],
+                 validate: Callable[[Any, ModelVersion], None], load_fallback: Callable[[], Optional[Any]],
+                 model_registry: ModelRegistry = registry, retry_after: int = 5):
+        super().__init__(name, self._load_initial, retry_after)
+        self.registry = model_registry
+        self._load_version = load_version
+        self._validate = validate
+        self._load_fallback = load_fallback
+        self.active: Optional[ModelVersion] = None
+        self.rejected: Dict[int, str] = {}
+        self.last_check: Optional[float] = None
+        self._reload_lock = asyncio.Lock()
+
+    @property
+    def version(self) -> Optional[int]:
+        """Active registry version, or None when serving the fixed-path model"""
+        return self.active.version if self.active is not None else None
+
+    def _load_checked(self, version: ModelVersion) -> Any:
+        self.registry.verify(version)
+        value = self._load_version(version)
+        self._validate(value, version)
+        return value
+
+    def _reject(self, version: ModelVersion, error: Exception):
+        self.rejected[version.version] = str(error)
+        print(f"Model {self.name}: version {version.version} rejected: {error}")
+
+    def _load_initial(self) -> Optional[Any]:
+        """Newest version that loads and validates, else the fixed-path model (runs in a worker thread)"""
+        for version in reversed(self.registry.versions(self.name)):
+            try:
+                value = self._load_checked(version)
+            except Exception as e:
+                self._reject(version, e)
+                continue
+            self.active = version
+            return value
+        return self._load_fallback()
+
+    async def check_for_update(self) -> bool:
+        """Load the newest registry version and swap it in if it is not the active one"""
+        async with self._reload_lock:
+            if self.state in (PENDING, LOADING):
+                return False
+            self.last_check = time.time()
+            latest = await asyncio.to_thread(self.registry.latest, self.name, list(self.rejected))
+            if latest is None or latest.version == self.version:
+                return False
+
+            print(f"Model {self.name}: loading version {latest.version}")
+            start = time.perf_counter()
+            try:
+                value = await asyncio.to_thread(self._load_checked, latest)
+            except Exception as e:
+                self._reject(latest, e)
+                return False
+            # A single step on the event loop: requests see either the old or the new model
+            self.value, self.active = value, latest
+            self.state, self.error = READY, None
+            self.load_seconds = round(time.perf_counter() - start, 3)
+            print(f"Model {self.name}: version {latest.version} active")
+            return True
+
+    def status(self) -> Dict[str, Any]:
+        status = super().status()
+        status["version"] = self.version
+        return status
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            **self.status(),
+            "active": self.active.summary() if self.active is not None else None,
+            "available": [version.version for version in self.registry.versions(self.name)],
+            "rejected": self.rejected,
+            "last_check": datetime.utcfromtimestamp(self.last_check).isoformat() if self.last_check else None,
+        }
+
+
+def versioned_models() -> List[VersionedModel]:
+    return [model for model in models.values() if isinstance(model, VersionedModel)]
+
+
+async def reload_all() -> Dict[str, bool]:
+    """Check every versioned model for a new version; which ones were swapped"""
+    swapped = {}
+    for model in versioned_models():
+        try:
+            swapped[model.name] = await model.check_for_update()
+        except Exception as e:
+            print(f"Model {model.name}: registry check failed: {e}")
+            swapped[model.name] = False
+    return swapped
+
+
+async def watch(interval: float):
+    """Check the registry for new versions every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        await reload_all()
+
+
+router = APIRouter(prefix="/api/models", tags=["Models"])
+
+
+@router.get("")
+async def list_models():
+    """Active version, state and available versions of every model"""
+    described = await asyncio.to_thread(lambda: {model.name: model.describe() for model in versioned_models()})
+    return {"poll_interval": MODEL_REGISTRY_POLL_INTERVAL, "models": described}
+
+
+@router.post("/reload", dependencies=[Depends(require_admin)])
+async def reload_models():
+    """Check the registry now instead of waiting for the next poll"""
+    swapped = await reload_all()
+    return {"swapped": swapped, "versions": {model.name: model.version for model in versioned_models()}}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Publish and list versions in the model registry")
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish = commands.add_parser("publish", help="Publish artifact files as a new version")
+    publish.add_argument("name", help="Model name (aqi, advanced)")
+    publish.add_argument("files", nargs="+", help="Artifacts as <name in version>=<source path>")
+    publish.add_argument("--config", help="JSON model config; its features and outputs are used unless given")
+    publish.add_argument("--features", help="Comma-separated input columns, in order")
+    publish.add_argument("--outputs", help="Comma-separated output columns")
+    publish.add_argument("--metric", action="append", default=[], help="Evaluation metric as name=value")
+    listing = commands.add_parser("list", help="List the versions of a model")
+    listing.add_argument("name")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for version in registry.versions(args.name):
+            print(json.dumps(version.summary()))
+    else:
+        config = {}
+        if args.config:
+            with open(args.config) as f:
+                config = json.load(f)
+        features = args.features.split(",") if args.features else config.get("features")
+        outputs = args.outputs.split(",") if args.outputs else config.get("outputs")
+        if not features or not outputs:
+            parser.error("give --features and --outputs, or a --config that lists them")
+        metrics = {}
+        for metric in args.metric:
+            key, _, value = metric.partition("=")
+            metrics[key] = float(value)
+        files = dict(spec.split("=", 1) for spec in args.files)
+        version = registry.publish(args.name, files, features, outputs, metrics, config)
+        print(f"Published {args.name} version {version.version} to {version.path}")
@@ -0,0 +1,118 @@
+"""
+Columnar parser for OpenAQ /v3/latest pages
+
+One pass over the JSON collects ids, coordinates and one float array per
+pollutant; the multi-pollutant AQI is then computed for the whole page at
+once with aqi.compute_aqi. Response dicts are only built at the edge, by
+the endpoint that returns them.
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+import numpy as np
+from aqi import BREAKPOINTS, compute_aqi, convert
+
+
+class LatestPage:
+    """Columnar view of the stations in one /v3/latest response"""
+
+    def __init__(self, station_ids: List[str], names: List[str], last_updates: List[str],
+                 latitude: np.ndarray, longitude: np.ndarray, pollutants: Dict[str, np.ndarray],
+                 aqi_inputs: Dict[str, np.ndarray]):
+        self.station_ids = station_ids
+        self.names = names
+        self.last_updates = last_updates
+        self.latitude = latitude
+        self.longitude = longitude
+        # Raw reported values, as returned to clients
+        self.pollutants = pollutants
+        # Same values converted to the AQI engine's native units
+        self.aqi, self.dominant = compute_aqi(aqi_inputs) if aqi_inputs else (
+            np.full(len(station_ids), np.nan), np.full(len(station_ids), None, dtype=object))
+
+    def __len__(self) -> int:
+        return len(self.station_ids)
+
+    def records(self, limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield StationData-shaped dicts, one per station"""
+        n = len(self) if limit is None else min(limit, len(self))
+        columns = [(name, values.tolist()) for name, values in self.pollutants.items()]
+        aqi = self.aqi.tolist()
+        dominant = self.dominant.tolist()
+        latitude = self.latitude.tolist()
+        longitude = self.longitude.tolist()
+        for i in range(n):
+            pollutants = {}
+            for name, values in columns:
+                value = values[i]
+                if value == value:  # skip NaN
+                    pollutants[name] = value
+            station_aqi = aqi[i]
+            yield {
+                "station_id": self.station_ids[i],
+                "name": self.names[i],
+                "latitude": latitude[i],
+                "longitude": longitude[i],
+                "aqi": int(station_aqi) if station_aqi == station_aqi else None,
+                "dominant_pollutant": dominant[i],
+                "pollutants": pollutants,
+                "last_update": self.last_updates[i],
+            }
+
+
+def parse_latest(payload: Dict[str, Any]) -> LatestPage:
+    """Parse a /v3/latest JSON payload, skipping results without coordinates"""
+    results = payload.get("results", [])
+    station_ids = []
+    names = []
+    last_updates = []
+    latitude = []
+    longitude = []
+    # parameter -> (row index, value, unit) triples, densified into arrays below
+    cells: Dict[str, List[tuple]] = {}
+    now = datetime.utcnow().isoformat()
+
+    for result in results:
+        coordinates = result.get("coordinates") or {}
+        lat = coordinates.get("latitude")
+        lon = coordinates.get("longitude")
+        if lat is None or lon is None:
+            continue
+        row = len(station_ids)
+        location = result.get("location", "")
+        station_ids.append(str(location.replace(" ", "_") + "_" + str(result.get("locationId", ""))))
+        names.append(result.get("location", "Unknown"))
+        last_updates.append(result.get("lastUpdated", now))
+        latitude.append(lat)
+        longitude.append(lon)
+        for measurement in result.get("measurements", []):
+            parameter = measurement.get("parameter")
+            value = measurement.get("value")
+            if parameter and value:
+                cells.setdefault(parameter, []).append((row, value, measurement.get("unit")))
+
+    n = len(station_ids)
+    pollutants = {}
+    aqi_inputs = {}
+    for parameter, triples in cells.items():
+        rows, values, units = zip(*triples)
+        column = np.full(n, np.nan)
+        column[list(rows)] = values
+        pollutants[parameter] = column
+        if parameter not in BREAKPOINTS:
+            continue
+        native = np.full(n, np.nan)
+        rows = np.asarray(rows)
+        values = np.asarray(values, dtype=float)
+        for unit in set(units):
+            mask = np.fromiter((u == unit for u in units), dtype=bool, count=len(units))
+            try:
+                native[rows[mask]] = convert(parameter, values[mask], unit)
+            except ValueError:
+                pass  # Unknown unit: leave out of the AQI
+        aqi_inputs[parameter] = native
+
+    return LatestPage(
+        station_ids, names, last_updates,
+        np.asarray(latitude, dtype=float), np.asarray(longitude, dtype=float),
+        pollutants, aqi_inputs,
+    )
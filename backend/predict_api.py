@@ -4,7 +4,11 @@ Prediction API endpoints
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
-from ml_model import AirQualityPredictor
+from model_registry import VersionedModel
+from config import PREDICT_BATCH_MAX_STATIONS
+from fast_json import make, respond
+from forecast_cache import forecast_cache, hour_bucket
+from datetime import datetime
 import asyncio
 
 router = APIRouter()
@@ -22,13 +26,178 @@ class ForecastResponse(BaseModel):
     forecast: List[ForecastPoint]
     generated_at: str
 
-# Initialize predictor (load or train model)
-predictor = AirQualityPredictor()
-try:
-    predictor.load_model()
-except:
-    print("Training new model...")
-    predictor.train()
+class BoundingBox(BaseModel):
+    lat_min: float
+    lat_max: float
+    lon_min: float
+    lon_max: float
+
+class BatchForecastRequest(BaseModel):
+    station_ids: Optional[List[str]] = None
+    bbox: Optional[BoundingBox] = None
+    hours: int = 48
+
+class BatchForecastResponse(BaseModel):
+    forecasts: List[ForecastResponse]
+    missing: List[str]
+    generated_at: str
+
+def load_predictor():
+    """Load the AQI model, training a new one if none is saved"""
+    from ml_model import AirQualityPredictor
+    predictor = AirQualityPredictor()
+    try:
+        predictor.load_model()
+    except Exception:
+        print("Training new model...")
+        predictor.train()
+    if predictor.model is None:
+        raise RuntimeError("AQI model could not be loaded or trained")
+    return predictor
+
+def load_predictor_version(version):
+    """The AQI model of a registry version"""
+    from ml_model import AirQualityPredictor
+    predictor = AirQualityPredictor(model_dir=version.path)
+    predictor.load_artifacts()
+    return predictor
+
+# Input used to check that a new model version produces usable forecasts
+VALIDATION_INPUT = {
+    'timestamp': '2025-01-15T12:00:00+00:00',
+    'pm25': 35.0, 'pm10': 50.0, 'no2': 25.0, 'o3': 40.0,
+    'temperature': 20, 'humidity': 60, 'wind_speed': 5, 'pressure': 1013,
+}
+
+def validate_predictor(predictor, version):
+    """Raise if a registry version does not match the serving feature schema or predicts garbage"""
+    import numpy as np
+    import pandas as pd
+    from ml_model import FEATURE_COLUMNS
+    if version.features != FEATURE_COLUMNS:
+        raise ValueError("feature schema does not match the serving features")
+    if version.outputs != ['aqi']:
+        raise ValueError(f"expected output ['aqi'], got {version.outputs}")
+    if predictor.model.n_features_in_ != len(FEATURE_COLUMNS):
+        raise ValueError(f"model takes {predictor.model.n_features_in_} features, expected {len(FEATURE_COLUMNS)}")
+    _, matrix = predictor.horizon_features(VALIDATION_INPUT, 3)
+    predictions = np.asarray(predictor.predict(pd.DataFrame(matrix, columns=FEATURE_COLUMNS)))
+    if predictions.shape != (3,) or not np.isfinite(predictions).all():
+        raise ValueError("model returned invalid predictions")
+
+# Loaded (or trained) in the background at startup and swapped for newer
+# registry versions as they are published; 503 until ready
+predictor_model = VersionedModel("aqi", load_predictor_version, validate_predictor, load_predictor)
+
+DEFAULT_WEATHER = {
+    'temperature': 20,
+    'humidity': 60,
+    'wind_speed': 5,
+    'pressure': 1013
+}
+
+async def station_weather(station) -> dict:
+    """Current weather for a station, or neutral defaults if unavailable"""
+    from main import get_weather
+    try:
+        weather = await get_weather(station.latitude, station.longitude)
+        return weather.dict()
+    except:
+        return DEFAULT_WEATHER
+
+def prediction_inputs(station, weather_dict: dict) -> dict:
+    """
+    Model input dict for a station's latest reading.
+    
+    The reading is recorded in the station's feature state, so lag and
+    rolling features come from its real recent history when there is one.
+    """
+    from main import feature_state
+    values = dict(station.pollutants)
+    values['aqi'] = station.aqi
+    feature_state.observe(station.station_id, station.last_update, values)
+    
+    return {
+        'timestamp': station.last_update,
+        'pm25': station.pollutants.get('pm25', 30),
+        'pm10': station.pollutants.get('pm10', 45),
+        'no2': station.pollutants.get('no2', 40),
+        'o3': station.pollutants.get('o3', 50),
+        'temperature': weather_dict['temperature'],
+        'humidity': weather_dict['humidity'],
+        'wind_speed': weather_dict['wind_speed'],
+        'pressure': weather_dict['pressure'],
+        **feature_state.features(station.station_id, {'pm25': 'pm25'}),
+    }
+
+def forecast_response(station, predictions: list) -> ForecastResponse:
+    return make(
+        ForecastResponse,
+        station_id=station.station_id,
+        station_name=station.name,
+        current_aqi=station.aqi or 0,
+        forecast=[
+            make(
+                ForecastPoint,
+                timestamp=pred['timestamp'],
+                aqi=pred['aqi'],
+                confidence=pred.get('confidence')
+            )
+            for pred in predictions
+        ],
+        generated_at=station.last_update
+    )
+
+@router.post("/api/predict/batch", response_model=BatchForecastResponse)
+async def predict_air_quality_batch(request: BatchForecastRequest):
+    """
+    Predict air quality for many stations with one model call.
+    
+    Stations come from station_ids or from a bbox of known stations.
+    Every (station x hour) feature row is predicted in a single batch.
+    """
+    from main import find_station, get_stations, station_registry
+    
+    if not request.station_ids and request.bbox is None:
+        raise HTTPException(status_code=400, detail="Provide station_ids or bbox")
+    predictor = predictor_model.get()
+    
+    missing = []
+    if request.station_ids:
+        if len(request.station_ids) > PREDICT_BATCH_MAX_STATIONS:
+            raise HTTPException(status_code=400, detail=f"At most {PREDICT_BATCH_MAX_STATIONS} stations per batch")
+        unique_ids = list(dict.fromkeys(request.station_ids))
+        found = await asyncio.gather(*(find_station(station_id) for station_id in unique_ids))
+        stations = [station for station in found if station is not None]
+        missing = [station_id for station_id, station in zip(unique_ids, found) if station is None]
+    else:
+        if not len(station_registry):
+            await get_stations()
+        box = request.bbox
+        stations = station_registry.within_bbox(box.lat_min, box.lat_max, box.lon_min, box.lon_max)
+        stations = stations[:PREDICT_BATCH_MAX_STATIONS]
+    
+    try:
+        # Weather is cached per grid cell, so nearby stations share lookups
+        weather = await asyncio.gather(*(station_weather(station) for station in stations))
+        inputs = [prediction_inputs(station, w) for station, w in zip(stations, weather)]
+        
+        # One feature matrix, one predict call
+        hours = max(0, min(request.hours, 48))
+        predictions = await asyncio.to_thread(predictor.predict_batch, inputs, hours)
+        
+        return respond(make(
+            BatchForecastResponse,
+            forecasts=[
+                forecast_response(station, station_predictions)
+                for station, station_predictions in zip(stations, predictions)
+            ],
+            missing=missing,
+            generated_at=datetime.utcnow().isoformat()
+        ))
+    except Exception as e:
+        print(f"Error in batch prediction: {e}")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 @router.get("/api/predict/{station_id}", response_model=ForecastResponse)
 async def predict_air_quality(station_id: str, hours: int = 48):
@@ -37,64 +206,34 @@ async def predict_air_quality(station_id: str, hours: int = 48):
     """
     try:
         # Import here to avoid circular imports
-        from main import get_stations, get_weather
+        from main import find_station
+        predictor = predictor_model.get()
+        model_version = predictor_model.version
         
         # Get current station data
-        stations = await get_stations()
-        station = next((s for s in stations if s.station_id == station_id), None)
+        station = await find_station(station_id)
         
         if not station:
             raise HTTPException(status_code=404, detail="Station not found")
         
-        # Get weather data
-        try:
-            weather = await get_weather(station.latitude, station.longitude)
-            weather_dict = weather.dict()
-        except:
-            weather_dict = {
-                'temperature': 20,
-                'humidity': 60,
-                'wind_speed': 5,
-                'pressure': 1013
-            }
+        horizon = min(hours, 48)
         
-        # Prepare current data for prediction
-        current_data = {
-            'timestamp': station.last_update,
-            'pm25': station.pollutants.get('pm25', 30),
-            'pm10': station.pollutants.get('pm10', 45),
-            'no2': station.pollutants.get('no2', 40),
-            'o3': station.pollutants.get('o3', 50),
-            'temperature': weather_dict['temperature'],
-            'humidity': weather_dict['humidity'],
-            'wind_speed': weather_dict['wind_speed'],
-            'pressure': weather_dict['pressure'],
-        }
+        async def compute_forecast():
+            # Get weather data and prepare current data for prediction
+            weather_dict = await station_weather(station)
+            current_data = prediction_inputs(station, weather_dict)
+            
+            # Generate predictions
+            return predictor.predict_future(current_data, hours_ahead=horizon)
         
-        # Generate predictions
-        predictions = predictor.predict_future(current_data, hours_ahead=min(hours, 48))
+        # Same reading hour, horizon and model version: same forecast
+        key = ("aqi", station.station_id, hour_bucket(station.last_update), horizon, model_version)
+        predictions = await forecast_cache.get(key, compute_forecast)
         
-        # Convert to response format
-        forecast_points = [
-            ForecastPoint(
-                timestamp=pred['timestamp'],
-                aqi=pred['aqi'],
-                confidence=pred.get('confidence')
-            )
-            for pred in predictions
-        ]
-        
-        return ForecastResponse(
-            station_id=station_id,
-            station_name=station.name,
-            current_aqi=station.aqi or 0,
-            forecast=forecast_points,
-            generated_at=current_data['timestamp']
-        )
+        return respond(forecast_response(station, predictions))
         
     except HTTPException:
         raise
     except Exception as e:
         print(f"Error in prediction: {e}")
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
-
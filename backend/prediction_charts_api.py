@@ -6,14 +6,14 @@ from fastapi import APIRouter, HTTPException
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
 import json
 import os
+from downsample import METHODS as DOWNSAMPLE_METHODS, downsample_indices
+
+# pandas and plotly are imported inside the functions that use them, so that
+# registering this router does not load them at application startup
 
 router = APIRouter()
 
@@ -23,6 +23,8 @@ class PredictionChartRequest(BaseModel):
     chart_type: str  # 'impact', 'timeline', 'comparison'
     pollutants: List[str] = ['PM2_5', 'PM10', 'NO2', 'O3']
     years: List[int] = [2020, 2023, 2024]
+    max_points: Optional[int] = None  # Puntos máximos por serie del timeline
+    downsample: str = 'lttb'  # 'lttb' o 'minmax'
 
 class PredictionChartResponse(BaseModel):
     station_id: str
@@ -32,6 +34,7 @@ class PredictionChartResponse(BaseModel):
 
 def load_prediction_data():
     """Cargar datos de predicciones del modelo entrenado"""
+    import pandas as pd
     try:
         # Intentar cargar datos del modelo entrenado
         prediction_files = [
@@ -56,6 +59,7 @@ def load_prediction_data():
 
 def generate_model_based_data():
     """Generar datos basados en el modelo entrenado"""
+    import pandas as pd
     print("[GENERANDO] Datos basados en el modelo entrenado...")
     
     # Estaciones de ejemplo con datos realistas
@@ -119,12 +123,19 @@ def generate_model_based_data():
     
     return pd.DataFrame(data)
 
+def station_rows(df, station_id):
+    """Filas de una estación; location_id es numérico en los datos y station_id llega como texto"""
+    return df[df['location_id'].astype(str) == str(station_id)]
+
 def create_impact_analysis_chart(df, station_id):
     """Crear gráfico de análisis de impacto con datos del modelo"""
+    import pandas as pd
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
     print(f"[CREANDO] Gráfico de impacto para estación {station_id}...")
     
     # Filtrar datos por estación
-    station_data = df[df['location_id'] == station_id]
+    station_data = station_rows(df, station_id)
     if len(station_data) == 0:
         raise HTTPException(status_code=404, detail="Station not found")
     
@@ -216,12 +227,28 @@ def create_impact_analysis_chart(df, station_id):
     
     return fig
 
-def create_timeline_chart(df, station_id):
+def downsample_series(frame, column, max_points=None, method='lttb'):
+    """Reducir una serie a max_points conservando su forma (LTTB o min/max por bucket)"""
+    if max_points is None or len(frame) <= max_points:
+        return frame
+    x = frame['datetime'].values.astype('datetime64[s]').astype(np.int64)
+    keep = downsample_indices(x, frame[column].to_numpy(dtype=float), max_points, method)
+    return frame.iloc[keep]
+
+def check_downsampling(max_points, method):
+    if max_points is not None and max_points < 3:
+        raise HTTPException(status_code=400, detail="max_points must be at least 3")
+    if method not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"downsample must be one of {', '.join(DOWNSAMPLE_METHODS)}")
+
+def create_timeline_chart(df, station_id, max_points=None, downsample='lttb'):
     """Crear gráfico de timeline con datos del modelo"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
     print(f"[CREANDO] Gráfico de timeline para estación {station_id}...")
     
     # Filtrar datos por estación
-    station_data = df[df['location_id'] == station_id]
+    station_data = station_rows(df, station_id)
     if len(station_data) == 0:
         raise HTTPException(status_code=404, detail="Station not found")
     
@@ -248,8 +275,8 @@ def create_timeline_chart(df, station_id):
         monthly_data['datetime'] = monthly_data['datetime'].dt.to_timestamp()
         
         # Separar datos históricos y predicciones
-        historical_data = monthly_data[monthly_data['datetime'].dt.year <= 2022]
-        prediction_data = monthly_data[monthly_data['datetime'].dt.year >= 2023]
+        historical_data = downsample_series(monthly_data[monthly_data['datetime'].dt.year <= 2022], pollutant, max_points, downsample)
+        prediction_data = downsample_series(monthly_data[monthly_data['datetime'].dt.year >= 2023], pollutant, max_points, downsample)
         
         # Agregar línea histórica (azul)
         if len(historical_data) > 0:
@@ -300,10 +327,13 @@ def create_timeline_chart(df, station_id):
 
 def create_comparison_chart(df, station_id):
     """Crear gráfico de comparación de escenarios"""
+    import pandas as pd
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
     print(f"[CREANDO] Gráfico de comparación para estación {station_id}...")
     
     # Filtrar datos por estación
-    station_data = df[df['location_id'] == station_id]
+    station_data = station_rows(df, station_id)
     if len(station_data) == 0:
         raise HTTPException(status_code=404, detail="Station not found")
     
@@ -341,7 +371,7 @@ def create_comparison_chart(df, station_id):
         base_value = current_data[pollutant].mean()
         
         # Crear fechas futuras
-        future_dates = pd.date_range(start='2023-01-01', end='2025-01-01', freq='M')
+        future_dates = pd.date_range(start='2023-01-01', end='2025-01-01', freq=pd.offsets.MonthEnd())
         
         # Agregar línea actual (azul)
         if len(current_data) > 0:
@@ -395,6 +425,8 @@ def create_comparison_chart(df, station_id):
 async def generate_prediction_chart(request: PredictionChartRequest):
     """Generar gráfico de predicciones basado en el modelo entrenado"""
     try:
+        check_downsampling(request.max_points, request.downsample)
+        
         # Cargar datos del modelo
         df = load_prediction_data()
         
@@ -402,7 +434,7 @@ async def generate_prediction_chart(request: PredictionChartRequest):
         if request.chart_type == 'impact':
             fig = create_impact_analysis_chart(df, request.station_id)
         elif request.chart_type == 'timeline':
-            fig = create_timeline_chart(df, request.station_id)
+            fig = create_timeline_chart(df, request.station_id, request.max_points, request.downsample)
         elif request.chart_type == 'comparison':
             fig = create_comparison_chart(df, request.station_id)
         else:
@@ -412,7 +444,7 @@ async def generate_prediction_chart(request: PredictionChartRequest):
         html_content = fig.to_html(include_plotlyjs='cdn', div_id=f"chart_{request.station_id}_{request.chart_type}")
         
         # Crear resumen de datos
-        station_data = df[df['location_id'] == request.station_id]
+        station_data = station_rows(df, request.station_id)
         data_summary = {
             'station_name': f"{station_data['city'].iloc[0]}, {station_data['state'].iloc[0]}",
             'total_records': len(station_data),
@@ -444,9 +476,11 @@ async def generate_prediction_chart(request: PredictionChartRequest):
         raise HTTPException(status_code=500, detail=f"Error generating chart: {str(e)}")
 
 @router.get("/api/prediction-charts/{station_id}/{chart_type}")
-async def get_prediction_chart_html(station_id: str, chart_type: str):
+async def get_prediction_chart_html(station_id: str, chart_type: str, max_points: Optional[int] = None, downsample: str = 'lttb'):
     """Obtener gráfico de predicciones como HTML"""
     try:
+        check_downsampling(max_points, downsample)
+        
         # Cargar datos del modelo
         df = load_prediction_data()
         
@@ -454,7 +488,7 @@ async def get_prediction_chart_html(station_id: str, chart_type: str):
         if chart_type == 'impact':
             fig = create_impact_analysis_chart(df, station_id)
         elif chart_type == 'timeline':
-            fig = create_timeline_chart(df, station_id)
+            fig = create_timeline_chart(df, station_id, max_points, downsample)
         elif chart_type == 'comparison':
             fig = create_comparison_chart(df, station_id)
         else:
@@ -2,13 +2,15 @@
 API endpoints for prediction layer functionality
 Integrates with AirGuardian's existing system
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import asyncio
+from config import HEATMAP_TTL
+from response_cache import response_cache
+from fast_json import make, respond
 
 router = APIRouter()
 
@@ -71,7 +73,8 @@ def generate_prediction_data(station_id: str, latitude: float, longitude: float,
         # Add some variation to predictions
         variation = np.random.uniform(0.8, 1.2)
         
-        prediction = PredictionData(
+        prediction = make(
+            PredictionData,
             station_id=station_id,
             latitude=latitude,
             longitude=longitude,
@@ -93,7 +96,8 @@ def generate_prediction_data(station_id: str, latitude: float, longitude: float,
         # Create a grid of points around the station
         for lat_offset in [-0.01, 0, 0.01]:
             for lon_offset in [-0.01, 0, 0.01]:
-                heatmap_data.append(HeatmapData(
+                heatmap_data.append(make(
+                    HeatmapData,
                     latitude=latitude + lat_offset,
                     longitude=longitude + lon_offset,
                     value=base_values[pollutant] * np.random.uniform(0.8, 1.2),
@@ -137,11 +141,10 @@ async def get_prediction_layer(station_id: str):
     """Get prediction layer data for a specific station"""
     try:
         # Import here to avoid circular imports
-        from main import get_stations
+        from main import find_station
         
         # Get station data
-        stations = await get_stations()
-        station = next((s for s in stations if s.station_id == station_id), None)
+        station = await find_station(station_id)
         
         if not station:
             raise HTTPException(status_code=404, detail="Station not found")
@@ -154,7 +157,7 @@ async def get_prediction_layer(station_id: str):
             station.name
         )
         
-        return PredictionLayerResponse(**prediction_data)
+        return respond(make(PredictionLayerResponse, **prediction_data))
         
     except HTTPException:
         raise
@@ -163,60 +166,69 @@ async def get_prediction_layer(station_id: str):
         raise HTTPException(status_code=500, detail=f"Error generating predictions: {str(e)}")
 
 @router.get("/api/prediction-layer/heatmap/{pollutant}")
-async def get_heatmap_data(pollutant: str, lat: Optional[float] = None, lon: Optional[float] = None, radius: float = 0.1):
-    """Get heatmap data for a specific pollutant"""
+async def get_heatmap_data(request: Request, pollutant: str, lat: Optional[float] = None, lon: Optional[float] = None, radius: float = 0.1):
+    """Get heatmap data for a specific pollutant (cached for HEATMAP_TTL, with ETag)"""
+    # If no coordinates provided, use default area
+    if lat is None or lon is None:
+        lat, lon = -12.0464, -77.0428  # Lima, Peru default
+    
     try:
-        # If no coordinates provided, use default area
-        if lat is None or lon is None:
-            lat, lon = -12.0464, -77.0428  # Lima, Peru default
-        
-        # Generate heatmap data in a grid around the coordinates
-        heatmap_data = []
-        
-        # Create a grid of points
-        for lat_offset in np.arange(-radius, radius + 0.01, 0.01):
-            for lon_offset in np.arange(-radius, radius + 0.01, 0.01):
-                # Generate random values based on pollutant
-                if pollutant == 'pm25':
-                    value = np.random.uniform(10, 60)
-                elif pollutant == 'pm10':
-                    value = np.random.uniform(20, 100)
-                elif pollutant == 'no2':
-                    value = np.random.uniform(0.01, 0.05)
-                elif pollutant == 'o3':
-                    value = np.random.uniform(0.02, 0.08)
-                elif pollutant == 'so2':
-                    value = np.random.uniform(0.001, 0.01)
-                else:
-                    value = np.random.uniform(10, 50)
-                
-                heatmap_data.append({
-                    'latitude': lat + lat_offset,
-                    'longitude': lon + lon_offset,
-                    'value': value,
-                    'pollutant': pollutant
-                })
-        
-        return {
-            'pollutant': pollutant,
-            'data': heatmap_data,
-            'generated_at': datetime.now().isoformat()
-        }
+        return await response_cache.respond(
+            request,
+            ("heatmap", pollutant, lat, lon, radius),
+            lambda: build_heatmap_data(pollutant, lat, lon, radius),
+            ttl=HEATMAP_TTL,
+            cache_control=f"public, max-age={int(HEATMAP_TTL)}"
+        )
         
     except Exception as e:
         print(f"Error generating heatmap data: {e}")
         raise HTTPException(status_code=500, detail=f"Error generating heatmap: {str(e)}")
 
+async def build_heatmap_data(pollutant: str, lat: float, lon: float, radius: float) -> Dict[str, Any]:
+    """Heatmap grid of values for a pollutant around a point"""
+    # Generate heatmap data in a grid around the coordinates
+    heatmap_data = []
+    
+    # Create a grid of points
+    for lat_offset in np.arange(-radius, radius + 0.01, 0.01):
+        for lon_offset in np.arange(-radius, radius + 0.01, 0.01):
+            # Generate random values based on pollutant
+            if pollutant == 'pm25':
+                value = np.random.uniform(10, 60)
+            elif pollutant == 'pm10':
+                value = np.random.uniform(20, 100)
+            elif pollutant == 'no2':
+                value = np.random.uniform(0.01, 0.05)
+            elif pollutant == 'o3':
+                value = np.random.uniform(0.02, 0.08)
+            elif pollutant == 'so2':
+                value = np.random.uniform(0.001, 0.01)
+            else:
+                value = np.random.uniform(10, 50)
+            
+            heatmap_data.append({
+                'latitude': lat + lat_offset,
+                'longitude': lon + lon_offset,
+                'value': value,
+                'pollutant': pollutant
+            })
+    
+    return {
+        'pollutant': pollutant,
+        'data': heatmap_data,
+        'generated_at': datetime.now().isoformat()
+    }
+
 @router.post("/api/prediction-layer/analysis", response_model=AnalysisResponse)
 async def get_analysis(request: AnalysisRequest):
     """Get analysis data for a specific station and analysis type"""
     try:
         # Import here to avoid circular imports
-        from main import get_stations
+        from main import find_station
         
         # Get station data
-        stations = await get_stations()
-        station = next((s for s in stations if s.station_id == request.station_id), None)
+        station = await find_station(request.station_id)
         
         if not station:
             raise HTTPException(status_code=404, detail="Station not found")
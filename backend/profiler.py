@@ -0,0 +1,299 @@
+"""
+Sampling profiler for slow requests
+
+A background thread samples the Python stack of every thread at a fixed
+interval into a ring buffer. When a request takes longer than
+PROFILE_SLOW_REQUEST_MS, the samples taken while it ran are saved as a
+speedscope profile (https://www.speedscope.app); admin requests with
+?profile=1 are always saved. Profiles can be listed and downloaded, as
+speedscope JSON or collapsed stacks (for flamegraph.pl), from
+/api/admin/profiles.
+
+Samples cover every busy thread, so work done in asyncio.to_thread (model
+inference, chart rendering) appears under its worker thread, and time the
+event loop spends waiting on upstream I/O appears under select(). With
+concurrent requests a profile also contains whatever else ran during the
+same window.
+
+When the threshold is 0 the sampler only runs while an explicitly
+profiled request is in flight, and the middleware costs one check per
+request.
+"""
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response
+from starlette.datastructures import Headers, QueryParams
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from admin_auth import is_admin, require_admin
+from config import (
+    PROFILE_SLOW_REQUEST_MS, PROFILE_SAMPLE_INTERVAL, PROFILE_BUFFER_SECONDS,
+    PROFILE_DIR, PROFILE_MAX_FILES,
+)
+
+# (monotonic time, thread name, stack of code objects from the outermost frame)
+_Sample = Tuple[float, str, Tuple[Any, ...]]
+
+_PROFILE_NAME = re.compile(r"^[\w.-]+\.speedscope\.json$")
+
+
+def _idle(code: Any) -> bool:
+    """A worker thread parked on a lock or queue"""
+    return code.co_name in ("wait", "get", "_wait_for_tstate_lock") and \
+        code.co_filename.endswith(("threading.py", "queue.py"))
+
+
+class StackSampler:
+    """Samples all thread stacks into a bounded ring buffer"""
+
+    def __init__(self, interval: float, buffer_seconds: float):
+        self.interval = interval
+        self._samples: "deque[_Sample]" = deque(maxlen=max(1, int(buffer_seconds / interval)))
+        self._lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        self._continuous = False
+        self._users = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """Sample continuously, until stop()"""
+        with self._lock:
+            self._continuous = True
+            self._ensure_thread()
+
+    def stop(self):
+        with self._lock:
+            self._continuous = False
+            self._users = 0
+            self._stop_thread()
+
+    def acquire(self):
+        """Sample at least until the matching release()"""
+        with self._lock:
+            self._users += 1
+            self._ensure_thread()
+
+    def release(self):
+        with self._lock:
+            self._users = max(0, self._users - 1)
+            if not self._users and not self._continuous:
+                self._stop_thread()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,),
+                                            name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def _stop_thread(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread = None
+
+    def _run(self, stop: threading.Event):
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        while not stop.wait(self.interval):
+            now = time.monotonic()
+            for ident, frame in sys._current_frames().items():
+                if ident == own or _idle(frame.f_code):
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    name = names.get(ident, str(ident))
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                with self._buffer_lock:
+                    self._samples.append((now, name, tuple(stack)))
+
+    def window(self, start: float, end: float) -> List[_Sample]:
+        """Samples taken between two time.monotonic() values"""
+        with self._buffer_lock:
+            samples = list(self._samples)
+        return [sample for sample in samples if start <= sample[0] <= end]
+
+
+def to_speedscope(samples: List[_Sample], name: str, interval: float) -> Dict[str, Any]:
+    """One sampled speedscope profile per thread, with a shared frame table"""
+    frames: List[Dict[str, Any]] = []
+    frame_index: Dict[Any, int] = {}
+    per_thread: Dict[str, List[List[int]]] = {}
+    for _, thread, stack in samples:
+        indices = []
+        for code in stack:
+            index = frame_index.get(code)
+            if index is None:
+                index = frame_index[code] = len(frames)
+                frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+            indices.append(index)
+        per_thread.setdefault(thread, []).append(indices)
+
+    profiles = []
+    for thread, stacks in per_thread.items():
+        profiles.append({
+            "type": "sampled",
+            "name": thread,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": round(len(stacks) * interval, 6),
+            "samples": stacks,
+            "weights": [interval] * len(stacks),
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "airguardian-profiler",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames},
+        "profiles": profiles,
+    }
+
+
+def to_collapsed(profile: Dict[str, Any]) -> str:
+    """Collapsed stacks ("thread;outer;...;inner count" per line) from a speedscope profile"""
+    labels = [f"{frame['name']} ({os.path.basename(frame['file'])}:{frame['line']})"
+              for frame in profile["shared"]["frames"]]
+    counts: Dict[str, int] = {}
+    for thread_profile in profile["profiles"]:
+        thread = thread_profile["name"].replace(";", ":")
+        for stack in thread_profile["samples"]:
+            line = ";".join([thread] + [labels[i] for i in stack])
+            counts[line] = counts.get(line, 0) + 1
+    return "".join(f"{line} {count}\n" for line, count in counts.items())
+
+
+class ProfileStore:
+    """Saved profiles in a directory, oldest removed beyond max_files"""
+
+    def __init__(self, directory: str, max_files: int):
+        self.directory = directory
+        self.max_files = max_files
+
+    def new_name(self, method: str, path: str) -> str:
+        slug = re.sub(r"[^\w-]+", "_", path.strip("/"))[:60] or "root"
+        return f"{int(time.time() * 1000)}-{method}-{slug}.speedscope.json"
+
+    def save(self, name: str, profile: Dict[str, Any]):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), "w", encoding="utf-8") as f:
+            json.dump(profile, f, separators=(",", ":"))
+        for old in self._files()[:-self.max_files]:
+            os.remove(os.path.join(self.directory, old))
+
+    def _files(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if _PROFILE_NAME.match(name))
+
+    def list(self) -> List[Dict[str, Any]]:
+        entries = []
+        for name in reversed(self._files()):
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append({"name": name, "size": stat.st_size,
+                            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(stat.st_mtime))})
+        return entries
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        if not _PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        if not os.path.isfile(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+class ProfilingMiddleware:
+    """
+    Save a profile for requests slower than threshold_ms, or for admin
+    requests with ?profile=1. Forced profiles are named in an X-Profile
+    response header.
+    """
+
+    def __init__(self, app: ASGIApp, sampler: "StackSampler", store: ProfileStore,
+                 threshold_ms: float, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self.sampler = sampler
+        self.store = store
+        self.threshold = threshold_ms / 1000.0 if threshold_ms > 0 else None
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths or \
+                (self.threshold is None and b"profile=" not in scope["query_string"]):
+            await self.app(scope, receive, send)
+            return
+
+        forced = (QueryParams(scope["query_string"]).get("profile") in ("1", "true")
+                  and is_admin(Headers(scope=scope)))
+        if not forced and self.threshold is None:
+            await self.app(scope, receive, send)
+            return
+
+        name = self.store.new_name(scope["method"], scope["path"])
+        send_wrapper = send
+        if forced:
+            self.sampler.acquire()
+
+            async def send_wrapper(message: Message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile", name.encode())]
+                await send(message)
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.monotonic()
+            if forced:
+                self.sampler.release()
+            if forced or end - start >= self.threshold:
+                title = f"{scope['method']} {scope['path']} {(end - start) * 1000:.0f}ms"
+                # Off the event loop: large profiles take a while to build and write
+                await asyncio.to_thread(self._save, name, title, start, end)
+
+    def _save(self, name: str, title: str, start: float, end: float):
+        samples = self.sampler.window(start, end)
+        self.store.save(name, to_speedscope(samples, title, self.sampler.interval))
+
+
+sampler = StackSampler(PROFILE_SAMPLE_INTERVAL, PROFILE_BUFFER_SECONDS)
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_MAX_FILES)
+
+router = APIRouter(prefix="/api/admin/profiles", dependencies=[Depends(require_admin)])
+
+
+@router.get("")
+async def list_profiles():
+    """Saved profiles, newest first"""
+    return {"threshold_ms": PROFILE_SLOW_REQUEST_MS, "sampling": sampler.running,
+            "profiles": profile_store.list()}
+
+
+@router.get("/{name}")
+async def download_profile(name: str, format: str = Query("speedscope", pattern="^(speedscope|collapsed)$")):
+    """One profile as speedscope JSON or as collapsed stacks"""
+    profile = profile_store.load(name)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return PlainTextResponse(to_collapsed(profile))
+    return Response(json.dumps(profile), media_type="application/json",
+                    headers={"Content-Disposition": f'attachment; filename="{name}"'})
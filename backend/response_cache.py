@@ -0,0 +1,155 @@
+"""
+Cached, pre-compressed JSON responses with content-hash ETags
+
+Large, slowly changing payloads (TEMPO grids, heatmaps, per-country
+station lists) are serialized once per TTL and kept as bytes, together
+with their gzip (and brotli, if installed) encodings. Requests get the
+stored bytes in the best encoding they accept, and a request whose
+If-None-Match matches the current ETag gets an empty 304.
+
+The ETag is a hash of the uncompressed body, so rebuilding an unchanged
+payload after the TTL keeps the same ETag.
+"""
+import gzip
+import hashlib
+import importlib.util
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from fastapi import Request, Response
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import Receive, Scope, Send
+from pydantic import BaseModel
+from config import RESPONSE_CACHE_MAX_BYTES, RESPONSE_COMPRESSION_MIN_SIZE, RESPONSE_GZIP_LEVEL
+from singleflight import SingleFlight
+from fast_json import dumps
+
+BROTLI_AVAILABLE = importlib.util.find_spec("brotli") is not None
+if BROTLI_AVAILABLE:
+    import brotli
+
+
+def encode_json(payload: Any) -> bytes:
+    """Serialize a Pydantic model or JSON-compatible data to compact UTF-8 JSON"""
+    if isinstance(payload, BaseModel):
+        return payload.model_dump_json().encode()
+    return dumps(payload)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> set:
+    """Content codings the client accepts (those not refused with q=0)"""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding and params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class _Entry:
+    __slots__ = ("etag", "bodies", "expires_at", "size")
+
+    def __init__(self, etag: str, bodies: Dict[str, bytes], expires_at: float):
+        self.etag = etag
+        self.bodies = bodies
+        self.expires_at = expires_at
+        self.size = sum(len(body) for body in bodies.values())
+
+
+class ResponseCache:
+    """LRU of serialized responses, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int, min_compress_size: int = 1024, gzip_level: int = 6):
+        self.max_bytes = max_bytes
+        self.min_compress_size = min_compress_size
+        self.gzip_level = gzip_level
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _encode(self, body: bytes) -> Dict[str, bytes]:
+        bodies = {"identity": body}
+        if len(body) >= self.min_compress_size:
+            bodies["gzip"] = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+            if BROTLI_AVAILABLE:
+                bodies["br"] = brotli.compress(body, quality=5)
+        return bodies
+
+    async def _build(self, key: Hashable, build: Callable[[], Awaitable[Any]], ttl: float) -> _Entry:
+        body = encode_json(await build())
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        entry = _Entry(etag, self._encode(body), time.monotonic() + ttl)
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key: Hashable, entry: _Entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+
+    async def respond(self, request: Request, key: Hashable, build: Callable[[], Awaitable[Any]],
+                      ttl: float, cache_control: Optional[str] = None) -> Response:
+        """
+        Serve key from the cache, calling build() when it is missing or expired.
+
+        build returns the response payload (a Pydantic model or JSON data).
+        Exceptions from build propagate and nothing is cached.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = await self._flight.do(key, lambda: self._build(key, build, ttl))
+
+        headers = {"ETag": entry.etag, "Vary": "Accept-Encoding"}
+        if cache_control:
+            headers["Cache-Control"] = cache_control
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        for encoding in ("br", "gzip"):
+            if encoding in entry.bodies and (encoding in accepted or "*" in accepted):
+                headers["Content-Encoding"] = encoding
+                return Response(entry.bodies[encoding], media_type="application/json", headers=headers)
+        return Response(entry.bodies["identity"], media_type="application/json", headers=headers)
+
+
+class StreamingAwareGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves event streams uncompressed, so each event is flushed at once"""
+
+    def __init__(self, app, exclude_paths=(), **kwargs):
+        super().__init__(app, **kwargs)
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_COMPRESSION_MIN_SIZE, RESPONSE_GZIP_LEVEL)
@@ -0,0 +1,104 @@
+"""
+In-process snapshot cache with stale-while-revalidate
+
+Entries are served from memory while fresh. Once an entry is older than
+the TTL it is still served immediately, and a single background task
+refreshes it. If the refresh fails the last good snapshot keeps being
+served and the next attempt is delayed by a short backoff.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "next_refresh_at")
+
+    def __init__(self, value: Any, fetched_at: float, next_refresh_at: float):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.next_refresh_at = next_refresh_at
+
+
+class SnapshotCache:
+    """TTL cache keyed by query, refreshed in the background once stale"""
+
+    def __init__(self, ttl: float, max_entries: int = 256, error_backoff: float = 30.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.error_backoff = error_backoff
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: Hashable, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the snapshot for key.
+
+        A missing entry is fetched inline (errors propagate to the caller).
+        A stale entry is returned as-is and refreshed in the background.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return await self._fetch(key, fetcher)
+
+        self._entries.move_to_end(key)
+        if time.monotonic() >= entry.next_refresh_at:
+            self.stale += 1
+            self._schedule_refresh(key, fetcher)
+        else:
+            self.hits += 1
+        return entry.value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Return the cached snapshot for key without triggering a fetch"""
+        entry = self._entries.get(key)
+        return entry.value if entry is not None else None
+
+    def age(self, key: Hashable) -> Optional[float]:
+        """Seconds since the snapshot for key was fetched, or None"""
+        entry = self._entries.get(key)
+        return time.monotonic() - entry.fetched_at if entry is not None else None
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a snapshot for key, stale (refreshed on the next get) after ttl, default the cache TTL"""
+        now = time.monotonic()
+        self._store(key, _Entry(value, now, now + (self.ttl if ttl is None else ttl)))
+
+    def clear(self):
+        self._entries.clear()
+
+    async def _fetch(self, key: Hashable, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        value = await fetcher()
+        self.put(key, value)
+        return value
+
+    def _store(self, key: Hashable, entry: _Entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _schedule_refresh(self, key: Hashable, fetcher: Callable[[], Awaitable[Any]]):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._background_refresh(key, fetcher))
+        self._refreshing[key] = task
+
+    async def _background_refresh(self, key: Hashable, fetcher: Callable[[], Awaitable[Any]]):
+        try:
+            await self._fetch(key, fetcher)
+        except Exception as e:
+            print(f"Snapshot refresh failed for {key}, serving last good snapshot: {e}")
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.next_refresh_at = time.monotonic() + self.error_backoff
+        finally:
+            self._refreshing.pop(key, None)
@@ -0,0 +1,134 @@
+"""
+Push feed of station changes for WebSocket and SSE clients
+
+Each upstream refresh is published once: stations whose AQI or pollutant
+readings changed are serialized to JSON a single time, and the batch is
+queued for every subscriber. Subscribers filter the batch by their own
+bounding box when rendering it, so serialization cost does not grow with
+the number of connected clients.
+
+Messages are JSON objects:
+
+    {"type": "snapshot", "timestamp": ..., "stations": [...]}   # on subscribe
+    {"type": "update", "timestamp": ..., "stations": [...]}     # changed stations only
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# (lat_min, lat_max, lon_min, lon_max); lon_min > lon_max crosses the antimeridian
+BBox = Tuple[float, float, float, float]
+
+# (station_id, latitude, longitude, serialized station JSON)
+_Item = Tuple[str, float, float, str]
+
+
+def in_bbox(lat: float, lon: float, bbox: Optional[BBox]) -> bool:
+    if bbox is None:
+        return True
+    lat_min, lat_max, lon_min, lon_max = bbox
+    if not lat_min <= lat <= lat_max:
+        return False
+    if lon_min <= lon_max:
+        return lon_min <= lon <= lon_max
+    return lon >= lon_min or lon <= lon_max
+
+
+def _signature(station: Any) -> tuple:
+    """What counts as a change: the AQI and the pollutant readings"""
+    return station.aqi, tuple(sorted(station.pollutants.items()))
+
+
+class FeedBatch:
+    """One published message, serialized once and shared by all subscribers"""
+    __slots__ = ("kind", "timestamp", "items")
+
+    def __init__(self, kind: str, items: List[_Item]):
+        self.kind = kind
+        self.timestamp = datetime.utcnow().isoformat()
+        self.items = items
+
+
+class Subscription:
+    """One connected client: a bounded queue of batches and an optional bbox"""
+
+    def __init__(self, feed: "StationFeed", bbox: Optional[BBox], max_pending: int):
+        self.feed = feed
+        self.bbox = bbox
+        self.queue: "asyncio.Queue[FeedBatch]" = asyncio.Queue(maxsize=max_pending)
+
+    def render(self, batch: FeedBatch) -> Optional[str]:
+        """JSON text for this client, or None for an update with nothing in its bbox"""
+        fragments = [item[3] for item in batch.items if in_bbox(item[1], item[2], self.bbox)]
+        if not fragments and batch.kind == "update":
+            return None
+        return (f'{{"type":"{batch.kind}","timestamp":"{batch.timestamp}",'
+                f'"stations":[{",".join(fragments)}]}}')
+
+    def resubscribe(self, bbox: Optional[BBox]):
+        """Change the bbox and queue a fresh snapshot of it"""
+        self.bbox = bbox
+        self._replace_pending(self.feed.snapshot())
+
+    def offer(self, batch: FeedBatch):
+        try:
+            self.queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            # A slow client gets a full snapshot instead of an unbounded backlog
+            self._replace_pending(self.feed.snapshot())
+
+    def _replace_pending(self, batch: FeedBatch):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(batch)
+
+    async def next_message(self) -> str:
+        """Wait for the next message this client should receive"""
+        while True:
+            text = self.render(await self.queue.get())
+            if text is not None:
+                return text
+
+
+class StationFeed:
+    """Latest serialized state of every station plus the connected subscribers"""
+
+    def __init__(self, max_pending: int = 16):
+        self.max_pending = max_pending
+        self._current: Dict[str, Tuple[tuple, _Item]] = {}
+        self._subscribers: Set[Subscription] = set()
+        self.published = 0
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, stations: Iterable[Any]) -> int:
+        """Record a refreshed set of stations and push the changed ones; returns the change count"""
+        changed: Dict[str, _Item] = {}
+        for station in stations:
+            signature = _signature(station)
+            known = self._current.get(station.station_id)
+            if known is not None and known[0] == signature:
+                continue
+            item = (station.station_id, station.latitude, station.longitude, station.model_dump_json())
+            self._current[station.station_id] = (signature, item)
+            changed[station.station_id] = item
+        if changed and self._subscribers:
+            batch = FeedBatch("update", list(changed.values()))
+            for subscription in self._subscribers:
+                subscription.offer(batch)
+            self.published += 1
+        return len(changed)
+
+    def snapshot(self) -> FeedBatch:
+        return FeedBatch("snapshot", [item for _, item in self._current.values()])
+
+    def subscribe(self, bbox: Optional[BBox] = None) -> Subscription:
+        """Register a client; its first message is the current snapshot"""
+        subscription = Subscription(self, bbox, self.max_pending)
+        subscription.offer(self.snapshot())
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
@@ -0,0 +1,152 @@
+"""
+In-memory station registry with O(1) id lookup and a grid spatial index
+
+Stations are kept in a dict by station_id and bucketed into fixed-size
+lat/lon grid cells, so radius, bounding-box and k-nearest queries only
+look at the cells that can contain a match.
+"""
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.195
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometers"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class StationRegistry:
+    """All known stations by id, plus a lat/lon grid for spatial queries"""
+
+    def __init__(self, cell_size_deg: float = 0.5):
+        self.cell_size = cell_size_deg
+        self._n_lon_cells = int(math.ceil(360.0 / cell_size_deg))
+        self._by_id: Dict[str, Any] = {}
+        self._cell_of: Dict[str, Tuple[int, int]] = {}
+        self._grid: Dict[Tuple[int, int], Set[str]] = {}
+        # (lat, lon, radius_km, expires_at) areas known to be fully loaded
+        self._coverage: List[Tuple[float, float, float, float]] = []
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def __contains__(self, station_id: str) -> bool:
+        return station_id in self._by_id
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        row = int(math.floor((lat + 90.0) / self.cell_size))
+        col = int(math.floor((lon + 180.0) / self.cell_size)) % self._n_lon_cells
+        return row, col
+
+    def update(self, stations: Iterable[Any]):
+        """Bulk upsert stations (objects with station_id, latitude, longitude)"""
+        for station in stations:
+            station_id = station.station_id
+            cell = self._cell(station.latitude, station.longitude)
+            old_cell = self._cell_of.get(station_id)
+            if old_cell is not None and old_cell != cell:
+                self._grid[old_cell].discard(station_id)
+            self._by_id[station_id] = station
+            self._cell_of[station_id] = cell
+            self._grid.setdefault(cell, set()).add(station_id)
+
+    def get(self, station_id: str) -> Optional[Any]:
+        return self._by_id.get(station_id)
+
+    def all(self) -> List[Any]:
+        return list(self._by_id.values())
+
+    def mark_covered(self, lat: float, lon: float, radius_km: float, ttl: float):
+        """Record that every upstream station within radius_km of (lat, lon) is loaded"""
+        now = time.monotonic()
+        self._coverage = [c for c in self._coverage if c[3] > now]
+        self._coverage.append((lat, lon, radius_km, now + ttl))
+
+    def covers(self, lat: float, lon: float, radius_km: float) -> bool:
+        """True if a query circle lies entirely inside an unexpired loaded area"""
+        now = time.monotonic()
+        for c_lat, c_lon, c_radius, expires_at in self._coverage:
+            if expires_at > now and haversine_km(lat, lon, c_lat, c_lon) + radius_km <= c_radius:
+                return True
+        return False
+
+    def _cells_in_bbox(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float):
+        row_min, _ = self._cell(max(lat_min, -90.0), 0.0)
+        row_max, _ = self._cell(min(lat_max, 90.0), 0.0)
+        if lon_max - lon_min >= 360.0:
+            cols = range(self._n_lon_cells)
+        else:
+            col_min = int(math.floor((lon_min + 180.0) / self.cell_size))
+            col_max = int(math.floor((lon_max + 180.0) / self.cell_size))
+            cols = [c % self._n_lon_cells for c in range(col_min, col_max + 1)]
+        for row in range(row_min, row_max + 1):
+            for col in cols:
+                ids = self._grid.get((row, col))
+                if ids:
+                    yield ids
+
+    def within_bbox(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> List[Any]:
+        """Stations inside a bounding box (lon_min > lon_max crosses the antimeridian)"""
+        if lon_min > lon_max:
+            lon_max += 360.0
+        shift = ((lon_min + 180.0) // 360.0) * 360.0
+        lon_min -= shift
+        lon_max -= shift
+        results = []
+        for ids in self._cells_in_bbox(lat_min, lat_max, lon_min, lon_max):
+            for station_id in ids:
+                station = self._by_id[station_id]
+                lon = station.longitude
+                if lon < lon_min:
+                    lon += 360.0
+                if lat_min <= station.latitude <= lat_max and lon_min <= lon <= lon_max:
+                    results.append(station)
+        return results
+
+    def _hits_within_radius(self, lat: float, lon: float, radius_km: float) -> List[Tuple[float, Any]]:
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        cos_lat = math.cos(math.radians(min(89.9, abs(lat) + dlat)))
+        dlon = min(360.0, dlat / cos_lat)
+        hits = []
+        for ids in self._cells_in_bbox(lat - dlat, lat + dlat, lon - dlon, lon + dlon):
+            for station_id in ids:
+                station = self._by_id[station_id]
+                distance = haversine_km(lat, lon, station.latitude, station.longitude)
+                if distance <= radius_km:
+                    hits.append((distance, station))
+        hits.sort(key=lambda h: h[0])
+        return hits
+
+    def within_radius(self, lat: float, lon: float, radius_km: float) -> List[Any]:
+        """Stations within radius_km of (lat, lon), nearest first"""
+        return [station for _, station in self._hits_within_radius(lat, lon, radius_km)]
+
+    def nearest(self, lat: float, lon: float, k: int = 5) -> List[Tuple[Any, float]]:
+        """k nearest stations to (lat, lon) as (station, distance_km), nearest first"""
+        if not self._by_id or k <= 0:
+            return []
+        k = min(k, len(self._by_id))
+        # Grow the search box until it holds k candidates
+        half = self.cell_size
+        while half < 180.0:
+            candidates = [
+                haversine_km(lat, lon, self._by_id[sid].latitude, self._by_id[sid].longitude)
+                for ids in self._cells_in_bbox(lat - half, lat + half, lon - half, lon + half)
+                for sid in ids
+            ]
+            if len(candidates) >= k:
+                break
+            half *= 2
+        else:
+            candidates = [haversine_km(lat, lon, s.latitude, s.longitude) for s in self._by_id.values()]
+        # Any closer station lies within the distance of the kth candidate
+        bound = sorted(candidates)[k - 1]
+        return [(station, distance) for distance, station in self._hits_within_radius(lat, lon, bound)[:k]]
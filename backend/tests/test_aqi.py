@@ -0,0 +1,129 @@
+import math
+import numpy as np
+import pytest
+from aqi import BREAKPOINTS, NATIVE_UNITS, POLLUTANTS, compute_aqi, convert, sub_index
+
+INDEX_RANGES = [(0, 50), (50, 100), (100, 150), (150, 200), (200, 300), (300, 500)]
+
+# (pollutant, concentration in the native unit, expected sub-index) at the EPA breakpoints
+BREAKPOINT_EDGES = [
+    (name, concentration, index)
+    for name, segments in BREAKPOINTS.items()
+    for (c_lo, c_hi), (i_lo, i_hi) in zip(segments, INDEX_RANGES)
+    for concentration, index in ((c_lo, i_lo), (c_hi, i_hi))
+]
+
+
+def calculate_aqi_pm25(pm25):
+    """The PM2.5 AQI formula the engine replaced"""
+    if pm25 <= 12.0:
+        return int((50 / 12.0) * pm25)
+    elif pm25 <= 35.4:
+        return int(50 + ((100 - 50) / (35.4 - 12.1)) * (pm25 - 12.1))
+    elif pm25 <= 55.4:
+        return int(100 + ((150 - 100) / (55.4 - 35.5)) * (pm25 - 35.5))
+    elif pm25 <= 150.4:
+        return int(150 + ((200 - 150) / (150.4 - 55.5)) * (pm25 - 55.5))
+    elif pm25 <= 250.4:
+        return int(200 + ((300 - 200) / (250.4 - 150.5)) * (pm25 - 150.5))
+    else:
+        return int(300 + ((500 - 300) / (500.4 - 250.5)) * (pm25 - 250.5))
+
+
+@pytest.mark.parametrize("pollutant,concentration,expected", BREAKPOINT_EDGES)
+def test_sub_index_at_breakpoints(pollutant, concentration, expected):
+    assert sub_index(pollutant, concentration) == pytest.approx(expected, abs=1e-9)
+
+
+@pytest.mark.parametrize("pollutant,concentration,expected", [
+    ("pm25", 12.05, 50 + (50 / 23.3) * (12.05 - 12.1)),   # between two segments: next segment's line
+    ("pm25", 23.75, 75.0),                                # segment midpoint
+    ("pm10", 100.0, 50 + (50 / 99) * 45),
+    ("o3", 62.5, 50 + (50 / 15) * 7.5),
+    ("no2", 150.0, 100 + (50 / 259) * 49),
+    ("so2", 50.0, 50 + (50 / 39) * 14),
+    ("co", 7.0, 50 + (50 / 4.9) * 2.5),
+    ("pm25", 600.4, 500 + (200 / 249.9) * 100),           # above the table: top segment extrapolated
+])
+def test_sub_index_inside_segments(pollutant, concentration, expected):
+    assert sub_index(pollutant, concentration) == pytest.approx(expected, abs=1e-9)
+
+
+@pytest.mark.parametrize("pollutant", POLLUTANTS)
+def test_sub_index_is_increasing_within_segments_and_missing_for_negative_or_nan(pollutant):
+    for c_lo, c_hi in BREAKPOINTS[pollutant]:
+        values = sub_index(pollutant, np.linspace(c_lo, c_hi, 201))
+        assert np.all(np.diff(values) > 0)
+    assert np.isnan(sub_index(pollutant, [-1.0, np.nan])).all()
+
+
+@pytest.mark.parametrize("pollutant", POLLUTANTS)
+def test_values_between_segments_use_the_next_segment(pollutant):
+    # As in calculate_aqi_pm25: the EPA tables leave gaps between segments
+    # (12.0 / 12.1 for PM2.5), and values inside them follow the next line
+    segments = BREAKPOINTS[pollutant]
+    for (_, c_hi), (c_lo, next_hi), (i_lo, i_hi) in zip(segments, segments[1:], INDEX_RANGES[1:]):
+        gap = (c_hi + c_lo) / 2
+        expected = i_lo + (i_hi - i_lo) / (next_hi - c_lo) * (gap - c_lo)
+        assert sub_index(pollutant, gap) == pytest.approx(expected, abs=1e-9)
+
+
+@pytest.mark.parametrize("pollutant,values,unit,expected", [
+    ("o3", 0.07, "ppm", 70.0),
+    ("o3", 100.0, "µg/m³", 100.0 * 24.45 / 48.00),
+    ("no2", 100.0, "ug/m3", 100.0 * 24.45 / 46.01),
+    ("no2", 100.0, "μg/m³", 100.0 * 24.45 / 46.01),   # Greek mu, as some sources send it
+    ("so2", 0.1, "PPM", 100.0),
+    ("so2", 100.0, "µg/m³", 100.0 * 24.45 / 64.07),
+    ("co", 4400.0, "ppb", 4.4),
+    ("co", 1000.0, "µg/m³", 1000.0 * 24.45 / 28.01 / 1000.0),
+    ("pm25", 35.4, "µg/m³", 35.4),
+    ("co", 9.4, "ppm", 9.4),
+    ("no2", 53.0, None, 53.0),
+])
+def test_convert_to_native_units(pollutant, values, unit, expected):
+    assert convert(pollutant, values, unit) == pytest.approx(expected, rel=1e-12)
+
+
+@pytest.mark.parametrize("pollutant,unit", [("pm25", "ppb"), ("pm10", "ppm"), ("no2", "mg/m3")])
+def test_convert_rejects_unsupported_units(pollutant, unit):
+    with pytest.raises(ValueError):
+        convert(pollutant, [1.0], unit)
+
+
+def test_native_units_cover_every_table():
+    assert set(NATIVE_UNITS) == set(BREAKPOINTS)
+
+
+def test_pm25_matches_the_old_formula():
+    edges = [c for segment in BREAKPOINTS["pm25"] for c in segment]
+    grid = np.round(np.arange(0, 700, 0.05), 2)
+    concentrations = np.concatenate([grid, edges, np.nextafter(edges, 0), np.nextafter(edges, 1000)])
+    concentrations = concentrations[concentrations >= 0]
+
+    aqi, dominant = compute_aqi({"pm25": concentrations})
+
+    assert np.trunc(aqi).astype(int).tolist() == [calculate_aqi_pm25(c) for c in concentrations]
+    assert set(dominant.tolist()) == {"pm25"}
+
+
+def test_overall_aqi_is_the_largest_sub_index_and_names_its_pollutant():
+    aqi, dominant = compute_aqi(
+        {"pm25": [10.0, 100.0, np.nan, np.nan], "o3": [0.080, 0.030, 0.060, np.nan], "unknown": [1, 2, 3, 4]},
+        {"o3": "ppm"},
+    )
+
+    assert aqi[0] == pytest.approx(float(sub_index("o3", 80.0)))
+    assert aqi[1] == pytest.approx(float(sub_index("pm25", 100.0)))
+    assert aqi[2] == pytest.approx(float(sub_index("o3", 60.0)))
+    assert math.isnan(aqi[3])
+    assert dominant.tolist() == ["o3", "pm25", "o3", None]
+
+
+def test_compute_aqi_broadcasts_scalars_and_handles_no_known_pollutant():
+    aqi, dominant = compute_aqi({"pm25": 35.4, "pm10": [0.0, 254.0]})
+    assert aqi.tolist() == pytest.approx([100.0, 150.0])
+    assert dominant.tolist() == ["pm25", "pm10"]
+
+    aqi, dominant = compute_aqi({"unknown": [1.0, 2.0]})
+    assert np.isnan(aqi).all() and dominant.tolist() == [None, None]
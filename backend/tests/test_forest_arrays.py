@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import pytest
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.preprocessing import StandardScaler
+from forest_arrays import (CHUNK_ROWS, PackedForest, check_equivalence, export_forest, load_packed,
+                           sample_inputs, save_packed)
+
+
+def training_data(n_outputs=1, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(400, 6))
+    # Repeated values put many split thresholds exactly between training values
+    X[:, 0] = rng.integers(0, 10, 400)
+    y = np.column_stack([X[:, 0] * 2 + np.sin(X[:, 1]) + rng.normal(scale=0.1, size=400) * (i + 1)
+                         for i in range(n_outputs)])
+    return X, y if n_outputs > 1 else y[:, 0]
+
+
+def packed(model, scaler=None):
+    arrays, meta = export_forest(model, scaler)
+    return PackedForest(arrays, meta)
+
+
+def threshold_inputs(model, n_features):
+    """Rows whose every feature is exactly one of scikit-learn's thresholds, and float32 neighbours of it"""
+    estimators = model.estimators_ if hasattr(model, "estimators_") else [model]
+    thresholds = [[] for _ in range(n_features)]
+    for estimator in estimators:
+        for tree in getattr(estimator, "estimators_", [estimator]):
+            nodes = tree.tree_
+            split = nodes.children_left >= 0
+            for column, threshold in zip(nodes.feature[split], nodes.threshold[split]):
+                thresholds[column].append(threshold)
+    rng = np.random.default_rng(1)
+    rows = []
+    for _ in range(300):
+        row = []
+        for values in thresholds:
+            value = np.float32(rng.choice(values)) if values else np.float32(0)
+            row.append(rng.choice([np.nextafter(value, np.float32(-np.inf)), value,
+                                   np.nextafter(value, np.float32(np.inf))]))
+        rows.append(row)
+    return np.array(rows, dtype=np.float64)
+
+
+@pytest.mark.parametrize("model", [
+    RandomForestRegressor(n_estimators=10, max_depth=8, random_state=0),
+    ExtraTreesRegressor(n_estimators=10, random_state=0),
+])
+def test_single_output_matches_sklearn(model):
+    X, y = training_data()
+    model.fit(X, y)
+    forest = packed(model)
+
+    assert check_equivalence(model, forest, X) <= 1e-9
+    assert check_equivalence(model, forest, sample_inputs(forest, 2000)) <= 1e-9
+    assert check_equivalence(model, forest, threshold_inputs(model, X.shape[1])) <= 1e-9
+
+
+def test_multi_output_matches_sklearn():
+    X, y = training_data(n_outputs=3)
+    model = MultiOutputRegressor(RandomForestRegressor(n_estimators=5, max_depth=6, random_state=0)).fit(X, y)
+    forest = packed(model)
+
+    assert forest.predict(X[:1]).shape == (1, 3)
+    assert check_equivalence(model, forest, sample_inputs(forest, 2000)) <= 1e-9
+    assert check_equivalence(model, forest, threshold_inputs(model, X.shape[1])) <= 1e-9
+
+
+def test_batches_across_chunks_match_single_rows():
+    X, y = training_data()
+    model = RandomForestRegressor(n_estimators=5, random_state=0).fit(X, y)
+    forest = packed(model)
+    rows = sample_inputs(forest, CHUNK_ROWS * 2 + 7)
+
+    batch = forest.predict(rows)
+    single = np.array([forest.predict(row[None, :])[0] for row in rows[:20]])
+    np.testing.assert_allclose(batch[:20], single, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(batch, model.predict(rows), rtol=0, atol=1e-9)
+
+
+def test_saved_export_loads_memory_mapped_with_scaler(tmp_path):
+    X, y = training_data()
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(n_estimators=5, random_state=0).fit(scaler.transform(X), y)
+    directory = str(tmp_path / "model.forest")
+
+    save_packed(directory, *export_forest(model, scaler))
+    forest, packed_scaler, _ = load_packed(directory)
+
+    assert isinstance(forest.threshold, np.memmap)
+    rows = X[:50]
+    np.testing.assert_allclose(forest.predict(packed_scaler.transform(rows)),
+                               model.predict(scaler.transform(rows)), rtol=0, atol=1e-9)
+
+
+def test_export_again_switches_the_link_and_keeps_the_previous_version(tmp_path):
+    X, y = training_data()
+    directory = str(tmp_path / "model.forest")
+    first = RandomForestRegressor(n_estimators=3, random_state=0).fit(X, y)
+    second = RandomForestRegressor(n_estimators=3, random_state=1).fit(X, y)
+
+    save_packed(directory, *export_forest(first))
+    first_version = os.path.realpath(directory)
+    save_packed(directory, *export_forest(second))
+    second_version = os.path.realpath(directory)
+    save_packed(directory, *export_forest(second))
+
+    assert os.path.islink(directory)
+    assert not os.path.exists(first_version)
+    assert os.path.isdir(second_version)
+    forest, _, _ = load_packed(directory)
+    np.testing.assert_allclose(forest.predict(X[:20]), second.predict(X[:20]), rtol=0, atol=1e-9)
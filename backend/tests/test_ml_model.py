@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+from forest_arrays import PackedForest, PackedScaler, export_forest
+from ml_model import FEATURE_COLUMNS, AirQualityPredictor
+
+CURRENT = {'pm25': 35.2, 'pm10': 50, 'no2': 22, 'o3': 41,
+           'temperature': 18.5, 'humidity': 70, 'wind_speed': 3.1, 'pressure': 1009}
+
+TIMESTAMPS = [
+    '2025-10-05T10:00:00+00:00',
+    '2025-12-31T20:00:00',         # crosses a year end
+    '2024-02-28T23:30:00-05:00',   # leap day, non-UTC offset
+    '2025-03-08T12:00:00+05:30',   # weekend to weekday
+]
+
+
+@pytest.fixture(scope="module")
+def predictor():
+    predictor = AirQualityPredictor()
+    df = predictor.create_features(predictor.generate_synthetic_data(1500)).dropna()
+    X = df[FEATURE_COLUMNS]
+    predictor.scaler = StandardScaler().fit(X)
+    predictor.model = RandomForestRegressor(n_estimators=20, max_depth=10, random_state=0).fit(
+        predictor.scaler.transform(X), df['aqi'])
+    return predictor
+
+
+def per_hour_loop(predictor, current_data, hours_ahead=48):
+    """The forecast as it was computed before predict_batch: one single-row prediction per hour"""
+    predictions = []
+    last_timestamp = datetime.fromisoformat(current_data['timestamp'])
+    for hour in range(1, hours_ahead + 1):
+        future_time = last_timestamp + timedelta(hours=hour)
+        pm25 = current_data.get('pm25', 30)
+        features = {
+            'hour_sin': np.sin(2 * np.pi * future_time.hour / 24),
+            'hour_cos': np.cos(2 * np.pi * future_time.hour / 24),
+            'month_sin': np.sin(2 * np.pi * future_time.month / 12),
+            'month_cos': np.cos(2 * np.pi * future_time.month / 12),
+            'is_weekend': 1 if future_time.weekday() >= 5 else 0,
+            'pm25': pm25,
+            'pm10': current_data.get('pm10', 45),
+            'no2': current_data.get('no2', 40),
+            'o3': current_data.get('o3', 50),
+            'temperature': current_data.get('temperature', 20),
+            'humidity': current_data.get('humidity', 60),
+            'wind_speed': current_data.get('wind_speed', 5),
+            'pressure': current_data.get('pressure', 1013),
+            'pm25_lag_1h': current_data.get('pm25_lag_1h', pm25),
+            'pm25_lag_3h': current_data.get('pm25_lag_3h', pm25),
+            'pm25_lag_6h': current_data.get('pm25_lag_6h', pm25),
+            'pm25_lag_24h': current_data.get('pm25_lag_24h', pm25),
+            'pm25_rolling_mean_6h': current_data.get('pm25_rolling_mean_6h', pm25),
+            'pm25_rolling_std_6h': current_data.get('pm25_rolling_std_6h', 5.0),
+            'pm25_rolling_mean_24h': current_data.get('pm25_rolling_mean_24h', pm25),
+        }
+        aqi_pred = predictor.predict(pd.DataFrame([features])[FEATURE_COLUMNS])[0]
+        predictions.append({
+            'timestamp': future_time.isoformat(),
+            'aqi': int(max(0, min(500, aqi_pred))),
+            'confidence': round(max(0.5, 1.0 - (hour / hours_ahead) * 0.5), 2),
+            'raw': aqi_pred,
+        })
+    return predictions
+
+
+def inputs():
+    rows = [dict(CURRENT, timestamp=timestamp) for timestamp in TIMESTAMPS]
+    rows.append(dict(CURRENT, timestamp=TIMESTAMPS[0], pm25=140))
+    rows.append({'timestamp': TIMESTAMPS[1]})  # every value defaulted
+    rows.append(dict(CURRENT, timestamp=TIMESTAMPS[2], pm25_lag_1h=20.0, pm25_lag_24h=60.0,
+                     pm25_rolling_mean_6h=28.0, pm25_rolling_std_6h=9.5))
+    return rows
+
+
+def assert_same_forecast(actual, expected):
+    assert [p['timestamp'] for p in actual] == [p['timestamp'] for p in expected]
+    assert [p['confidence'] for p in actual] == [p['confidence'] for p in expected]
+    assert [p['aqi'] for p in actual] == [p['aqi'] for p in expected]
+
+
+def test_horizon_features_match_the_per_hour_features(predictor):
+    for row in inputs():
+        timestamps, matrix = predictor.horizon_features(row, 48)
+        last = datetime.fromisoformat(row['timestamp'])
+        assert timestamps == [last + timedelta(hours=hour) for hour in range(1, 49)]
+        future = [last + timedelta(hours=hour) for hour in range(1, 49)]
+        np.testing.assert_allclose(matrix[:, FEATURE_COLUMNS.index('hour_sin')],
+                                   [np.sin(2 * np.pi * t.hour / 24) for t in future], rtol=0, atol=1e-12)
+        np.testing.assert_allclose(matrix[:, FEATURE_COLUMNS.index('month_cos')],
+                                   [np.cos(2 * np.pi * t.month / 12) for t in future], rtol=0, atol=1e-12)
+        assert matrix[:, FEATURE_COLUMNS.index('is_weekend')].tolist() == [float(t.weekday() >= 5) for t in future]
+
+
+@pytest.mark.parametrize("hours_ahead", [1, 24, 48])
+def test_predict_batch_matches_the_per_hour_loop(predictor, hours_ahead):
+    rows = inputs()
+    expected = [per_hour_loop(predictor, row, hours_ahead) for row in rows]
+
+    batch = predictor.predict_batch(rows, hours_ahead)
+    for actual, reference in zip(batch, expected):
+        assert_same_forecast(actual, reference)
+    for row, reference in zip(rows, expected):
+        assert_same_forecast(predictor.predict_future(row, hours_ahead), reference)
+
+
+def test_batched_predictions_equal_single_row_predictions(predictor):
+    rows = inputs()
+    matrix = np.vstack([predictor.horizon_features(row, 48)[1] for row in rows])
+    batched = predictor.predict(pd.DataFrame(matrix, columns=FEATURE_COLUMNS))
+    single = [raw for row in rows for raw in (p['raw'] for p in per_hour_loop(predictor, row, 48))]
+    np.testing.assert_allclose(batched, single, rtol=1e-12, atol=1e-9)
+
+
+def test_packed_model_gives_the_same_forecast(predictor):
+    arrays, meta = export_forest(predictor.model, predictor.scaler)
+    packed = AirQualityPredictor()
+    packed.model = PackedForest(arrays, meta)
+    packed.scaler = PackedScaler(arrays['scaler_mean'], arrays['scaler_scale'])
+
+    rows = inputs()
+    for actual, row in zip(packed.predict_batch(rows), rows):
+        assert_same_forecast(actual, per_hour_loop(predictor, row))
@@ -0,0 +1,148 @@
+"""
+Persistent hourly time-series store for station measurements
+
+Measurements live in SQLite, one row per (station, UTC day). Each row holds
+a compressed 24 x N float32 block: one slot per hour and one column per
+field, with NaN for missing values. A range query reads only the
+station-day chunks it covers, through the primary key.
+"""
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+import numpy as np
+
+FIELDS = ("pm25", "pm10", "no2", "o3", "so2", "co", "aqi")
+HOURS_PER_CHUNK = 24
+SECONDS_PER_HOUR = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    station_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    block BLOB NOT NULL,
+    PRIMARY KEY (station_id, day)
+) WITHOUT ROWID
+"""
+
+
+def to_hour(timestamp: Any) -> int:
+    """Hours since the Unix epoch for a datetime, ISO string or epoch seconds (UTC assumed)"""
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp // SECONDS_PER_HOUR)
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() // SECONDS_PER_HOUR)
+
+
+def hour_to_iso(hour: int) -> str:
+    return datetime.utcfromtimestamp(hour * SECONDS_PER_HOUR).isoformat()
+
+
+class TimeSeriesStore:
+    """Hourly float32 measurements per station, chunked by day in SQLite"""
+
+    def __init__(self, path: str, fields: Tuple[str, ...] = FIELDS, compression_level: int = 6):
+        self.path = path
+        self.fields = tuple(fields)
+        self.compression_level = compression_level
+        self._column = {name: i for i, name in enumerate(self.fields)}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _pack(self, block: np.ndarray) -> bytes:
+        return zlib.compress(block.astype(np.float32).tobytes(), self.compression_level)
+
+    def _unpack(self, blob: bytes) -> np.ndarray:
+        return np.frombuffer(zlib.decompress(blob), dtype=np.float32).reshape(HOURS_PER_CHUNK, len(self.fields))
+
+    def append(self, rows: Iterable[Tuple[str, Any, Dict[str, float]]]) -> int:
+        """
+        Store (station_id, timestamp, values) rows, keyed by station and hour.
+
+        A later value for the same station, hour and field replaces the
+        earlier one. Returns the number of rows written.
+        """
+        # Group by chunk so each station-day is read and written once
+        grouped: Dict[Tuple[str, int], list] = {}
+        count = 0
+        for station_id, timestamp, values in rows:
+            hour = to_hour(timestamp)
+            day, slot = divmod(hour, HOURS_PER_CHUNK)
+            grouped.setdefault((station_id, day), []).append((slot, values))
+            count += 1
+        if not grouped:
+            return 0
+
+        with self._lock:
+            cursor = self._db.cursor()
+            for (station_id, day), updates in grouped.items():
+                found = cursor.execute(
+                    "SELECT block FROM chunks WHERE station_id = ? AND day = ?", (station_id, day)
+                ).fetchone()
+                if found:
+                    block = self._unpack(found[0]).copy()
+                else:
+                    block = np.full((HOURS_PER_CHUNK, len(self.fields)), np.nan, dtype=np.float32)
+                for slot, values in updates:
+                    for name, value in values.items():
+                        column = self._column.get(name)
+                        if column is not None and value is not None:
+                            block[slot, column] = value
+                cursor.execute(
+                    "INSERT OR REPLACE INTO chunks (station_id, day, block) VALUES (?, ?, ?)",
+                    (station_id, day, self._pack(block)),
+                )
+            self._db.commit()
+        return count
+
+    def query(self, station_id: str, start: Any, end: Any) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Hourly series for one station with start <= hour < end.
+
+        Returns (hours, columns): hours since the epoch as int64, and one
+        float32 array per field. Hours where every field is missing are
+        dropped.
+        """
+        start_hour, end_hour = to_hour(start), to_hour(end)
+        with self._lock:
+            found = self._db.execute(
+                "SELECT day, block FROM chunks WHERE station_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (station_id, start_hour // HOURS_PER_CHUNK, (end_hour - 1) // HOURS_PER_CHUNK),
+            ).fetchall()
+        if not found:
+            return np.empty(0, dtype=np.int64), {name: np.empty(0, dtype=np.float32) for name in self.fields}
+
+        days = np.array([day for day, _ in found], dtype=np.int64)
+        hours = (days[:, np.newaxis] * HOURS_PER_CHUNK + np.arange(HOURS_PER_CHUNK)).ravel()
+        block = np.concatenate([self._unpack(blob) for _, blob in found])
+        keep = (hours >= start_hour) & (hours < end_hour) & ~np.isnan(block).all(axis=1)
+        hours = hours[keep]
+        block = block[keep]
+        return hours, {name: block[:, i] for i, name in enumerate(self.fields)}
+
+    def stations(self) -> list:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT station_id FROM chunks")]
+
+    def latest_hour(self, station_id: str) -> Optional[int]:
+        """Most recent stored hour for a station, or None"""
+        with self._lock:
+            found = self._db.execute(
+                "SELECT day, block FROM chunks WHERE station_id = ? ORDER BY day DESC LIMIT 1", (station_id,)
+            ).fetchone()
+        if not found:
+            return None
+        present = np.flatnonzero(~np.isnan(self._unpack(found[1])).all(axis=1))
+        return int(found[0] * HOURS_PER_CHUNK + present[-1]) if len(present) else None
@@ -0,0 +1,278 @@
+"""
+Stand-in for the OpenAQ and OpenWeather APIs, replaying recorded fixtures
+
+UPSTREAM_MODE selects how the shared upstream clients reach the network:
+
+- live (default): real upstream hosts.
+- replay: an in-process httpx transport answers from the JSON fixtures in
+  UPSTREAM_FIXTURES_DIR, with configurable latency, error rate and payload
+  size. Nothing leaves the process, so load tests are deterministic.
+- record: requests go to the real hosts and every 200 response is saved
+  as a fixture for later replay.
+
+The same replay logic can also run as a standalone HTTP server
+(python upstream_stub.py --port 8001) for clients that are not the
+backend itself; point OPENAQ_BASE_URL/OPENWEATHER_BASE_URL at it.
+
+Fixture lookup: an exact recording for (upstream, path, params) wins;
+otherwise the route's base fixture (openaq_latest.json,
+openweather_weather.json) is filtered by the request's country,
+coordinates/radius and limit parameters.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import math
+import random
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from config import (
+    UPSTREAM_MODE,
+    UPSTREAM_FIXTURES_DIR,
+    UPSTREAM_STUB_LATENCY_MS,
+    UPSTREAM_STUB_JITTER_MS,
+    UPSTREAM_STUB_ERROR_RATE,
+    UPSTREAM_STUB_RESULTS,
+    UPSTREAM_STUB_SEED,
+)
+
+BASE_FIXTURES = {
+    ("openaq", "/v3/latest"): "openaq_latest.json",
+    ("openweather", "/data/2.5/weather"): "openweather_weather.json",
+}
+
+# Query parameters that never change the response (credentials)
+_IGNORED_PARAMS = {"appid"}
+
+
+def fixture_key(name: str, path: str, params: Dict[str, str]) -> str:
+    """File name of the exact recording for one request"""
+    query = "&".join(f"{k}={v}" for k, v in sorted(params.items()) if k not in _IGNORED_PARAMS)
+    digest = hashlib.sha1(query.encode()).hexdigest()[:12]
+    return f"{name}{path.replace('/', '_')}__{digest}.json"
+
+
+def _distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * 6371.0088 * math.asin(min(1.0, math.sqrt(a)))
+
+
+class FixtureStore:
+    """Recorded upstream responses plus the rules to answer unrecorded requests"""
+
+    def __init__(self, directory: str, results: int = 0, seed: int = 0):
+        self.directory = Path(directory)
+        self.results = results
+        self.seed = seed
+        self._cache: Dict[str, Any] = {}
+
+    def _load(self, filename: str) -> Optional[Any]:
+        if filename not in self._cache:
+            path = self.directory / filename
+            self._cache[filename] = json.loads(path.read_text(encoding="utf-8")) if path.exists() else None
+        return self._cache[filename]
+
+    def save(self, name: str, path: str, params: Dict[str, str], body: Any):
+        """Store a live response as an exact recording (and as the base fixture if missing)"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        filenames = [fixture_key(name, path, params)]
+        base = BASE_FIXTURES.get((name, path))
+        if base and not (self.directory / base).exists():
+            filenames.append(base)
+        for filename in filenames:
+            (self.directory / filename).write_text(json.dumps(body, ensure_ascii=False), encoding="utf-8")
+            self._cache[filename] = body
+
+    def lookup(self, name: str, path: str, params: Dict[str, str]) -> Optional[Any]:
+        """Body to answer a request with, or None when nothing matches the route"""
+        recorded = self._load(fixture_key(name, path, params))
+        if recorded is not None:
+            return recorded
+        base = BASE_FIXTURES.get((name, path))
+        body = self._load(base) if base else None
+        if body is None:
+            return None
+        if (name, path) == ("openaq", "/v3/latest"):
+            return self._latest(body, params)
+        if (name, path) == ("openweather", "/data/2.5/weather"):
+            return self._weather(body, params)
+        return body
+
+    def _expanded_results(self, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Base results, cycled with shifted ids and coordinates up to UPSTREAM_STUB_RESULTS"""
+        results = body.get("results", [])
+        if not results or self.results <= len(results):
+            return results
+        cache_key = f"__expanded_{self.results}"
+        if cache_key not in self._cache:
+            rng = random.Random(self.seed)
+            expanded = list(results)
+            while len(expanded) < self.results:
+                source = results[len(expanded) % len(results)]
+                copy_no = len(expanded) // len(results)
+                result = copy.deepcopy(source)
+                result["locationId"] = f"{source.get('locationId')}{copy_no:03d}"
+                result["location"] = f"{source.get('location', 'Station')} {copy_no}"
+                coordinates = result.get("coordinates") or {}
+                if coordinates.get("latitude") is not None:
+                    coordinates["latitude"] = round(coordinates["latitude"] + rng.uniform(-0.5, 0.5), 5)
+                    coordinates["longitude"] = round(coordinates["longitude"] + rng.uniform(-0.5, 0.5), 5)
+                for measurement in result.get("measurements", []):
+                    if isinstance(measurement.get("value"), (int, float)):
+                        measurement["value"] = round(measurement["value"] * rng.uniform(0.7, 1.3), 4)
+                expanded.append(result)
+            self._cache[cache_key] = expanded
+        return self._cache[cache_key]
+
+    def _latest(self, body: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+        results = self._expanded_results(body)
+        country = params.get("country")
+        if country:
+            results = [r for r in results if r.get("country") == country]
+        if params.get("coordinates") and params.get("radius"):
+            lat, lon = (float(v) for v in params["coordinates"].split(","))
+            radius_km = float(params["radius"]) / 1000.0
+            results = [
+                r for r in results
+                if (r.get("coordinates") or {}).get("latitude") is not None
+                and _distance_km(lat, lon, r["coordinates"]["latitude"], r["coordinates"]["longitude"]) <= radius_km
+            ]
+        limit = int(params.get("limit", len(results)) or len(results))
+        page = results[:limit]
+        return {"meta": {**body.get("meta", {}), "found": len(results), "limit": limit}, "results": page}
+
+    def _weather(self, body: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+        if "lat" not in params or "lon" not in params:
+            return body
+        lat, lon = float(params["lat"]), float(params["lon"])
+        # Stable per-location variation so different cells see different weather
+        rng = random.Random(f"{self.seed}:{lat:.4f}:{lon:.4f}")
+        weather = copy.deepcopy(body)
+        weather["coord"] = {"lat": lat, "lon": lon}
+        weather["main"]["temp"] = round(weather["main"]["temp"] + rng.uniform(-5, 5), 2)
+        weather["main"]["humidity"] = int(min(100, max(5, weather["main"]["humidity"] + rng.uniform(-15, 15))))
+        weather["wind"]["speed"] = round(max(0.0, weather["wind"]["speed"] + rng.uniform(-2, 2)), 2)
+        weather["wind"]["deg"] = rng.randint(0, 359)
+        return weather
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """In-process httpx transport that answers one upstream from the fixture store"""
+
+    def __init__(self, name: str, store: FixtureStore, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.name = name
+        self.store = store
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(f"{seed}:{name}")
+        self.requests = 0
+        self.errors = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        delay = self.latency_ms + (self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+        status, body = respond(self.store, self.name, request.url.path, dict(request.url.params),
+                               self.error_rate, self._rng)
+        if status != 200:
+            self.errors += 1
+        return httpx.Response(status, json=body, request=request)
+
+
+def respond(store: FixtureStore, name: str, path: str, params: Dict[str, str],
+            error_rate: float, rng: random.Random) -> Tuple[int, Any]:
+    """(status, body) for one stubbed request, shared by the transport and the server"""
+    if error_rate and rng.random() < error_rate:
+        return 503, {"detail": "Injected upstream error"}
+    body = store.lookup(name, path, params)
+    if body is None:
+        return 404, {"detail": f"No fixture for {name} {path}"}
+    return 200, body
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Pass-through transport that saves every successful JSON response as a fixture"""
+
+    def __init__(self, name: str, store: FixtureStore, inner: Optional[httpx.AsyncBaseTransport] = None):
+        self.name = name
+        self.store = store
+        self.inner = inner or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.inner.handle_async_request(request)
+        content = await response.aread()
+        if response.status_code == 200:
+            try:
+                self.store.save(self.name, request.url.path, dict(request.url.params), json.loads(content))
+            except ValueError:
+                pass  # Not JSON: nothing to replay
+        return httpx.Response(response.status_code, headers=response.headers, content=content, request=request)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+_store: Optional[FixtureStore] = None
+
+
+def fixture_store() -> FixtureStore:
+    global _store
+    if _store is None:
+        _store = FixtureStore(UPSTREAM_FIXTURES_DIR, UPSTREAM_STUB_RESULTS, UPSTREAM_STUB_SEED)
+    return _store
+
+
+def upstream_transport(name: str) -> Optional[httpx.AsyncBaseTransport]:
+    """Transport for the named upstream client under UPSTREAM_MODE (None means live)"""
+    if UPSTREAM_MODE == "replay":
+        return ReplayTransport(
+            name, fixture_store(),
+            latency_ms=UPSTREAM_STUB_LATENCY_MS,
+            jitter_ms=UPSTREAM_STUB_JITTER_MS,
+            error_rate=UPSTREAM_STUB_ERROR_RATE,
+            seed=UPSTREAM_STUB_SEED,
+        )
+    if UPSTREAM_MODE == "record":
+        return RecordingTransport(name, fixture_store())
+    return None
+
+
+def create_stub_app():
+    """Standalone HTTP stand-in serving both upstreams from the fixture store"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+    stub = FastAPI(title="Air Guardian upstream stub")
+    store = fixture_store()
+    rng = random.Random(UPSTREAM_STUB_SEED)
+
+    @stub.get("/{path:path}")
+    async def serve(path: str, request: Request):
+        path = "/" + path
+        name = "openweather" if path.startswith("/data/") else "openaq"
+        delay = UPSTREAM_STUB_LATENCY_MS + (rng.uniform(-UPSTREAM_STUB_JITTER_MS, UPSTREAM_STUB_JITTER_MS)
+                                            if UPSTREAM_STUB_JITTER_MS else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+        status, body = respond(store, name, path, dict(request.query_params), UPSTREAM_STUB_ERROR_RATE, rng)
+        return JSONResponse(body, status_code=status)
+
+    return stub
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve recorded OpenAQ/OpenWeather fixtures over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(), host=args.host, port=args.port, log_level="warning")